@@ -1,19 +1,24 @@
 # This python script retrives data from ACI and saves them into an excel
 # for an easier processing and filtering capabilities for everyone.
 from openpyxl import Workbook, load_workbook
-from openpyxl.utils.cell import get_column_letter
-import re
 import time
 import os.path
-from Aci_Cal_Toolkit import FabLogin, Query
+from Aci_Cal_Toolkit import FabLogin, Query, QueryFailed
+from aci_dn import BD_SUBNET_DN
 from credentials import apic_ip, apic_pwd, apic_user
 
 # clock_time = time.strftime("%H %M %S")
 day_time = time.strftime("a%Y m%m g%d")
+# the workbook is write-only: rows are streamed to the file and not kept in
+# memory, sheets already saved today are copied into it row by row.
+target = Workbook(write_only=True)
 if os.path.exists('C:/<path_to_excel_output_dir>/ACI_class_' + day_time + '.xlsx'):
-    target = load_workbook('C:/<path_to_excel_output_dir>/ACI_class_' + day_time + ".xlsx")
-else:
-    target = Workbook()
+    source = load_workbook('C:/<path_to_excel_output_dir>/ACI_class_' + day_time + ".xlsx", read_only=True)
+    for old_sheet in source.worksheets:
+        sheet = target.create_sheet(old_sheet.title)
+        for row in old_sheet.iter_rows(values_only=True):
+            sheet.append(row)
+    source.close()
 
 apic = FabLogin (apic_ip, apic_user, apic_pwd)
 cookies = apic.login()
@@ -28,46 +33,42 @@ fvClass = ['mgmtRsInBStNode', 'fvTenant']
 if 'fvBD' in fvClass:
     bd_nets = {}
     print('Retrieving BD subnets ...')
-    [status, payload] = req.query_class('fvSubnet')
-    if (status != 200):
+    try:
+        for obj in req.iter_class('fvSubnet'):
+            dn = obj['fvSubnet']['attributes']['dn']
+            # uni/tn-<tn_name>/BD-<bd_name>/subnet-[<subnet>]
+            # There are also the following objects in case subnets are created
+            # as 'sons' of epg, this MUST be done in case contracts are created
+            # between different vrf through route-leaking:
+            #  uni/tn-<tn_name>/ap-<anp_name>/epg-<epg_name>/subnet-[<subnet>]
+            reg = BD_SUBNET_DN.search(dn)
+            if reg is not None:
+                [ten_name, bd_name, ip] = reg.group(1, 2, 3)
+                if not bd_name in bd_nets:
+                    bd_nets[bd_name] = []
+                bd_nets[bd_name].append(ip)
+    except QueryFailed:
         print('Error retrieving fvSubnet')
         exit(0)
-    json_data = payload['imdata']
-    for obj in json_data:
-        dn = obj['fvSubnet']['attributes']['dn']
-        # uni/tn-<tn_name>/BD-<bd_name>/subnet-[<subnet>]
-        # There are also the following objects in case subnets are created
-        # as 'sons' of epg, this MUST be done in case contracts are created
-        # between different vrf through route-leaking:
-        #  uni/tn-<tn_name>/ap-<anp_name>/epg-<epg_name>/subnet-[<subnet>]
-        reg = re.search('\/tn-(.*?)\/BD-(.*?)\/subnet-\[(.*)\]', dn)
-        if reg != None:
-            ten_name = reg.group(1)
-            bd_name = reg.group(2)
-            ip = reg.group(3)
-            if not bd_name in bd_nets:
-                bd_nets[bd_name] = []
-            bd_nets[bd_name].append(ip)
 
 
+# classes are retrieved page by page (see Query.iter_class), rows are appended
+# to the write-only sheet as every page arrives, so that huge classes are never
+# kept in memory.
 for aci_class in fvClass:
     sheet = target.create_sheet(aci_class, 0)
     print('Retrieving class '+aci_class+' ...')
-    [status, payload] = req.query_class(aci_class)
-    if status != 200 or not len(payload['imdata']):
-        continue
-    json_data = payload['imdata']
     cols = []
-    for attr in sorted(json_data[0][aci_class]['attributes']):
-        cols.append(attr)
-        sheet[get_column_letter(len(cols))+'1'] = attr
-    row_counter = 2
-    for obj in json_data:
-        for i in range(len(cols)):
-            sheet[get_column_letter(i+1)+str(row_counter)] = obj[aci_class]['attributes'][cols[i]]
-        if aci_class == 'fvBD' and (obj[aci_class]['attributes']['name'] in bd_nets):
-            nets = '\n'.join(bd_nets[obj[aci_class]['attributes']['name']])
-            sheet[get_column_letter(len(cols)+1)+str(row_counter)] = nets
-        row_counter += 1
+    try:
+        for obj in req.iter_class(aci_class):
+            if not cols:
+                cols = sorted(obj[aci_class]['attributes'])
+                sheet.append(cols)
+            row = [obj[aci_class]['attributes'][col] for col in cols]
+            if aci_class == 'fvBD' and (obj[aci_class]['attributes']['name'] in bd_nets):
+                row.append('\n'.join(bd_nets[obj[aci_class]['attributes']['name']]))
+            sheet.append(row)
+    except QueryFailed as e:
+        print('Error retrieving '+aci_class+': '+str(e))
 
 target.save('C:/<path_to_excel_output_dir>/ACI_class_'+day_time+".xlsx")
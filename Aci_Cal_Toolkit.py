@@ -5,8 +5,21 @@ import collections
 import jinja2
 import ipaddress
 import time
+import math
 import re
 import urllib3
+import asyncio
+import functools
+import concurrent.futures
+import threading
+import gzip
+import os
+import atexit
+import logging
+import aci_log
+from aci_dn import split_dn, parse_dn, selector_name, NODE_BLK_DN, \
+    ACC_PORT_P_DN, PORT_SEL_DN, POL_GRP_DN, CTX_DN, AP_DN, RS_CTX_DN, \
+    BD_SUBNET_DN, EPG_DN, PATH_ATT_DN, PATHEP_DN
 urllib3.disable_warnings()
 
 # Global options for debugging
@@ -15,10 +28,47 @@ PRINT_PAYLOAD = True
 PUSH_TO_APIC = False
 PRINT_RESPONSE_TEXT_ALWAYS = False
 PRINT_RESPONSE_TEXT_ON_FAIL = True
+# print the per-port dump of Query.query_ports
+PRINT_QUERY_PORTS = True
+# 'classes' or 'subtree', see Query.query_all_tenants
+QUERY_TENANTS_MODE = 'classes'
+# print at exit the latency percentiles of the requests by template and by
+# class (see RequestStats), collected from the login on
+PRINT_REQUEST_STATS = False
+# port of the Prometheus/OpenMetrics exporter of the requests and batches
+# (see aci_metrics.py), started at the login. None disables it.
+METRICS_PORT = None
+# Logging of the payloads, failed answers and port dumps (see aci_log.py):
+# the level of the records written, the json lines file where they are also
+# written (None for none), one payload logged out of LOG_PAYLOAD_SAMPLE, and
+# whether they are written by a background thread
+LOG_LEVEL = 'INFO'
+LOG_FILE = None
+LOG_PAYLOAD_SAMPLE = 1
+LOG_BACKGROUND = True
 
 # Global path to main json directory
 json_path = 'C:/path_to_json_template_dir/jsondata/'
 
+# Directory where the compiled jinja2 templates are persisted as bytecode,
+# so that later runs do not compile them again. None disables the cache.
+template_cache_dir = None
+# If True, all the templates are compiled the first time one of them is used,
+# otherwise every template is compiled the first time it is used.
+PRECOMPILE_TEMPLATES = False
+# 'text': payloads are rendered by jinja2 as json strings
+# 'dict': payloads are built directly as python dictionaries (see DictTemplate)
+PAYLOAD_MODE = 'text'
+
+# Seconds the results of the class queries are kept in the MIT snapshot
+# cache (see MitCache), 0 disables the cache.
+MIT_CACHE_TTL = 0
+# Maximum number of objects kept in the MIT snapshot cache
+MIT_CACHE_SIZE = 500000
+# File where the MIT snapshot cache is persisted, so that the scripts run
+# in the same maintenance window share it. None keeps it in memory only.
+mit_cache_file = None
+
 # Global list of allowed statuses
 valid_status = ['created', 'created,modified', 'deleted']
 
@@ -32,6 +82,9 @@ class InvalidArg(Exception):
 class LoginFailed(Exception):
     pass
 
+class QueryFailed(Exception):
+    pass
+
 # Function to validate input for each method
 def process_kwargs(required_args, optional_args, **kwargs):
     # Validate all required kwargs passed
@@ -56,46 +109,1239 @@ def process_kwargs(required_args, optional_args, **kwargs):
     return(templateVars)
 
 
-# Function to execute HTTP Post
-def post(apic, payload, cookies, uri, section=''):
-    if PRINT_PAYLOAD or not PUSH_TO_APIC:
-        print('Adding to the object: "'+uri+'" the following json string:')
-        print(payload)
-    s = requests.Session()
-    r = ''
-    if PUSH_TO_APIC:
-        while r == '':
+# Default number of keep-alive connections kept open toward every APIC
+DEFAULT_POOL_SIZE = 10
+
+# Default number of requests in flight toward the same APIC in async mode,
+# it should not be bigger than the connection pool size.
+DEFAULT_CONCURRENCY = 8
+
+# Shared connection objects, one for every APIC, see get_connection()
+connections = {}
+
+# Shared asyncio engines, one for every APIC, see get_async_client()
+async_clients = {}
+
+# Default number of objects per page for the paginated queries
+DEFAULT_PAGE_SIZE = 1000
+
+# Default number of queued objects committed with a single POST by FabBatch
+DEFAULT_BATCH_SIZE = 50
+
+# Class of the container objects, from the prefix of their RN. They are used
+# by FabBatch to build the polUni tree when the father of a queued object
+# has not been queued itself.
+rn_classes = {'uni': 'polUni',
+              'tn': 'fvTenant',
+              'ctx': 'fvCtx',
+              'BD': 'fvBD',
+              'ap': 'fvAp',
+              'epg': 'fvAEPg',
+              'brc': 'vzBrCP',
+              'flt': 'vzFilter',
+              'out': 'l3extOut',
+              'infra': 'infraInfra',
+              'accportprof': 'infraAccPortP',
+              'nprof': 'infraNodeP',
+              'funcprof': 'infraFuncP',
+              'fabric': 'fabricInst'}
+
+
+# Requests per second allowed toward every APIC when a connection is created
+# (see RateLimiter), None means no limit until the APIC throttles the client.
+RATE_LIMIT = None
+# Lower bound of the rate, the limiter never slows down below it
+MIN_RATE = 1.0
+# Number of retries of a request throttled by the APIC (HTTP 429/503) or
+# failed with a connection error, with an exponential backoff
+MAX_RETRIES = 5
+# Seconds waited before the first retry, doubled at every retry
+RETRY_BACKOFF = 1.0
+# If True, FabLogin.login starts a FabSession keeping the APIC token alive
+SESSION_KEEPALIVE = True
+# Seconds before the token expiration when aaaRefresh is called
+SESSION_REFRESH_MARGIN = 60
+# Controller of an APIC cluster receiving the posts (the first one of the
+# cluster if None), see FabCluster
+CLUSTER_WRITE_CONTROLLER = None
+# Seconds between two health checks of the controllers of a cluster
+CLUSTER_HEALTH_INTERVAL = 10
+# Seconds waited for the TCP connection toward a controller of a cluster
+# before failing over to another one
+CLUSTER_CONNECT_TIMEOUT = 5
+
+
+# Client side token bucket limiting the requests toward an APIC, with an
+# AIMD behaviour: the rate is halved when the APIC throttles (HTTP 429 or
+# 503) or when the latency rises well above its long term average, and it
+# is raised by about 'increase' requests per second every second while the
+# responses stay healthy. A single decrease is applied every 'cooldown'
+# seconds, so that the requests already in flight do not collapse the rate.
+# With adaptive=False the rate never changes.
+class RateLimiter(object):
+    def __init__(self, rate=None, min_rate=None, increase=5.0, decrease=0.5,
+                 latency_factor=3.0, cooldown=1.0, adaptive=True):
+        self.rate = rate
+        self.adaptive = adaptive
+        self.min_rate = MIN_RATE if min_rate is None else min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        # the bucket holds at most one second of requests
+        self.tokens = rate or 0.0
+        self.last_fill = time.monotonic()
+        self.last_decrease = 0.0
+        # short and long term moving averages of the latency, and the
+        # number of samples they are made of
+        self.latency = None
+        self.baseline = None
+        self.samples = 0
+        # completion times of the recent requests, to measure the rate
+        # reached while unlimited
+        self.recent = collections.deque()
+        # counters useful for statistics
+        self.requests = 0
+        self.throttled = 0
+
+    # Blocks until the request can be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.rate is None:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens +
+                                  (now - self.last_fill) * self.rate)
+                self.last_fill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Updates the rate with the result of a request: status is the HTTP
+    # status code (None for a connection error), latency in seconds (None
+    # if it must not be considered)
+    def update(self, status, latency):
+        with self.lock:
+            now = time.monotonic()
+            self.requests += 1
+            self.recent.append(now)
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            congested = status in (429, 503)
+            if congested:
+                self.throttled += 1
+            elif status is not None and latency is not None:
+                if self.latency is None:
+                    self.latency = self.baseline = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+                    self.baseline = 0.98 * self.baseline + 0.02 * latency
+                self.samples += 1
+                congested = (self.samples >= 20 and self.latency >
+                             self.latency_factor * self.baseline)
+            if not self.adaptive:
+                return
+            if congested:
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    current = self.rate
+                    if current is None:
+                        current = float(len(self.recent))
+                    self.rate = max(self.min_rate, current * self.decrease)
+                    self.tokens = min(self.tokens, self.rate)
+            elif self.rate is not None and status is not None and status < 500:
+                # about 'increase' more requests per second every second
+                self.rate += self.increase / self.rate
+
+    # Seconds to wait before retrying a throttled request, the Retry-After
+    # header of the APIC is used when present
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
             try:
-                r = s.post('https://{}/api/node/{}.json'.format(apic, uri),
-                       data=payload, cookies=cookies, verify=False)
-                status = r.status_code
-            except requests.exceptions.ConnectionError as e:
-                print("Connection error, pausing before retrying. Error: {}"
-                  .format(e))
-                time.sleep(5)
-            except Exception as e:
-                print("Method {} failed. Exception: {}".format(section[:-5], e))
-                status = 666
-            return(status)
-    
-        if PRINT_RESPONSE_TEXT_ALWAYS:
-            print(r.text)
-        if status != 200 and PRINT_RESPONSE_TEXT_ON_FAIL:
-            print(r.text)
+                return float(retry_after)
+            except ValueError:
+                pass
+        return RETRY_BACKOFF * (2 ** attempt)
+
+    def stats(self):
+        with self.lock:
+            return {'rate': self.rate,
+                    'requests': self.requests,
+                    'throttled': self.throttled}
+
+
+# Instrumentation of the requests toward the APIC: the hooks are called with
+# a RequestInfo, the before_request ones when a request is about to be sent,
+# the after_request ones when it has completed, after all its retries. Hooks
+# run in the thread of the request and must be fast, see RequestStats for an
+# example.
+before_request_hooks = []
+after_request_hooks = []
+
+
+def add_request_hook(after=None, before=None):
+    if before is not None:
+        before_request_hooks.append(before)
+    if after is not None:
+        after_request_hooks.append(after)
+
+
+def remove_request_hook(hook):
+    for hooks in (before_request_hooks, after_request_hooks):
+        if hook in hooks:
+            hooks.remove(hook)
+
+
+# Hooks called when a batch of pushes (FabBatch.commit, PushScheduler.run)
+# starts, with its kind and number of objects, and when it ends, with the
+# elapsed seconds too
+before_batch_hooks = []
+after_batch_hooks = []
+
+
+def add_batch_hook(after=None, before=None):
+    if before is not None:
+        before_batch_hooks.append(before)
+    if after is not None:
+        after_batch_hooks.append(after)
+
+
+def remove_batch_hook(hook):
+    for hooks in (before_batch_hooks, after_batch_hooks):
+        if hook in hooks:
+            hooks.remove(hook)
+
+
+# Called by the batches, start_batch returns the start time to be passed
+# to end_batch
+def start_batch(kind, objects):
+    for hook in before_batch_hooks:
+        hook(kind, objects)
+    return time.monotonic()
+
+
+def end_batch(kind, objects, start):
+    elapsed = time.monotonic() - start
+    for hook in after_batch_hooks:
+        hook(kind, objects, elapsed)
+
+
+# A request toward the APIC, as seen by the hooks. template is the json
+# template of the posts performed by the toolkit classes, aci_class the
+# class of a class query or of the posted object. status, response_bytes
+# and latency (seconds, retries included) are set when the request has
+# completed, error if it raised an exception. reused is False if the
+# request had to open a new connection.
+class RequestInfo(object):
+    __slots__ = ('apic', 'controller', 'method', 'uri', 'template',
+                 'aci_class', 'payload_bytes', 'response_bytes', 'status',
+                 'latency', 'retries', 'reused', 'error')
+
+    def __init__(self, apic, method, uri, template=None, data=None):
+        self.apic = apic
+        self.controller = None
+        self.method = method
+        self.uri = uri
+        self.template = template
+        self.aci_class = request_class(uri, data)
+        self.payload_bytes = len(data.encode()) if data else 0
+        self.response_bytes = None
+        self.status = None
+        self.latency = None
+        self.retries = 0
+        self.reused = None
+        self.error = None
+
+
+# Returns the class of a class query, or the class of the posted object
+def request_class(uri, data=None):
+    if data:
+        reg = re.match(r'\s*\{\s*"([A-Za-z0-9]+)"', data)
     else:
+        reg = re.search(r'/class/([A-Za-z0-9]+)\.json', uri)
+    return reg.group(1) if reg else None
+
+
+# Returns the p-th percentile (0-100) of a sorted list, nearest rank: the
+# smallest value with at least p% of the values less or equal to it
+def percentile(values, p):
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[index]
+
+
+# Collects the latency of every request by template and by class, and
+# prints their percentiles. enable() registers it as a request hook and
+# prints the summary when the script exits:
+#
+#   request_stats.enable()
+class RequestStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (method, template or class) -> list of latencies
+        self.by_template = {}
+        self.by_class = {}
+        self.retries = 0
+        self.reused = 0
+        self.errors = 0
+        self.enabled = False
+
+    def __call__(self, info):
+        template = info.template or '{} {}'.format(
+            info.method, info.aci_class or info.uri.split('?')[0])
+        aci_class = '{} {}'.format(info.method, info.aci_class or '-')
+        with self.lock:
+            self.by_template.setdefault(template, []).append(info.latency)
+            self.by_class.setdefault(aci_class, []).append(info.latency)
+            self.retries += info.retries
+            self.reused += 1 if info.reused else 0
+            if info.error is not None or info.status != 200:
+                self.errors += 1
+
+    def enable(self):
+        if not self.enabled:
+            add_request_hook(after=self)
+            atexit.register(self.report)
+            self.enabled = True
+
+    def disable(self):
+        remove_request_hook(self)
+        self.enabled = False
+
+    # Returns {name: {count, total, p50, p95, p99}} for the latencies by
+    # template, or by class with by_class=True
+    def summary(self, by_class=False):
+        with self.lock:
+            data = dict((name, sorted(latencies)) for name, latencies in
+                        (self.by_class if by_class else self.by_template).items())
+        return dict((name, {'count': len(latencies),
+                            'total': sum(latencies),
+                            'p50': percentile(latencies, 50),
+                            'p95': percentile(latencies, 95),
+                            'p99': percentile(latencies, 99)})
+                    for name, latencies in data.items())
+
+    # Prints the summaries, the slowest (in total) first
+    def report(self, top=20):
+        for title, by_class in (('template', False), ('class', True)):
+            summary = self.summary(by_class)
+            if not summary:
+                continue
+            print('APIC requests by {:<36} {:>7} {:>8} {:>8} {:>8} {:>9}'.format(
+                title, 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'total s'))
+            for name, row in sorted(summary.items(),
+                                    key=lambda item: -item[1]['total'])[:top]:
+                print('  {:<51} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>9.2f}'.format(
+                    name[:51], row['count'], 1000 * row['p50'],
+                    1000 * row['p95'], 1000 * row['p99'], row['total']))
+        requests = sum(len(latencies) for latencies in self.by_class.values())
+        if requests:
+            print('{} requests, {} on reused connections, {} retries, {} failed'
+                  .format(requests, self.reused, self.retries, self.errors))
+
+
+request_stats = RequestStats()
+
+
+# Set when a connection of the pools opens a new socket, so that the
+# requests served on an already open connection are known
+connection_events = threading.local()
+
+
+class TrackedHTTPConnection(urllib3.connection.HTTPConnection):
+    def connect(self):
+        connection_events.opened = True
+        urllib3.connection.HTTPConnection.connect(self)
+
+
+class TrackedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        connection_events.opened = True
+        urllib3.connection.HTTPSConnection.connect(self)
+
+
+class TrackedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TrackedHTTPConnection
+
+
+class TrackedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TrackedHTTPSConnection
+
+
+# Class holding a keep-alive connection pool toward a single APIC. All the
+# queries and posts toward the same APIC should share the same object, so
+# that the TCP and TLS handshakes are performed only once per connection
+# and not once per REST call.
+class FabConnection(object):
+    def __init__(self, apic, pool_size=DEFAULT_POOL_SIZE, hosts=1):
+        self.apic = apic
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        # pool_connections is the number of different hosts cached, one
+        # for every controller, pool_maxsize the connections kept toward it
+        adapter = requests.adapters.HTTPAdapter(pool_connections=hosts,
+                                                pool_maxsize=pool_size)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': TrackedHTTPConnectionPool,
+            'https': TrackedHTTPSConnectionPool}
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.limiter = RateLimiter(RATE_LIMIT)
+        # FabSession re-authenticating the requests refused for an expired
+        # token, see FabSession
+        self.auth = None
+
+    # Returns the full url for an APIC path, for example /api/node/mo/uni.json
+    # The apic can also be passed with the scheme, i.e. http://127.0.0.1:8000
+    # for a local mock APIC.
+    def url(self, path, controller=None):
+        if controller is None:
+            controller = self.apic
+        if '://' in controller:
+            return controller + path
+        return 'https://{}{}'.format(controller, path)
+
+    # Controller receiving a request, a single APIC has only one
+    def controller(self, method):
+        return self.apic
+
+    # Controller receiving the posts
+    def preferred(self):
+        return self.apic
+
+    # Called when a controller does not answer, returns True if the
+    # request can be sent at once to another controller
+    def failover(self, controller):
+        return False
+
+    def send(self, controller, method, path, kwargs):
+        return self.session.request(method, self.url(path, controller),
+                                    verify=False, **kwargs)
+
+    # Sends a request, calling the request hooks if there are any
+    def request(self, method, path, template=None, **kwargs):
+        if not before_request_hooks and not after_request_hooks:
+            return self.retry(method, path, kwargs)
+        info = RequestInfo(self.apic, method, path, template,
+                           kwargs.get('data'))
+        for hook in before_request_hooks:
+            hook(info)
+        start = time.monotonic()
+        try:
+            r = self.retry(method, path, kwargs, info)
+        except Exception as e:
+            info.error = e
+            raise
+        else:
+            info.status = r.status_code
+            info.response_bytes = len(r.content)
+            return r
+        finally:
+            info.latency = time.monotonic() - start
+            for hook in after_request_hooks:
+                hook(info)
+
+    # Sends a request through the rate limiter. Throttled requests (HTTP 429
+    # or 503) and connection errors are retried up to MAX_RETRIES times with
+    # an exponential backoff, then the last response is returned (or the
+    # connection error raised).
+    def retry(self, method, path, kwargs, info=None):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.monotonic()
+            controller = self.controller(method)
+            connection_events.opened = False
+            if info is not None:
+                info.controller = controller
+                info.retries = attempt
+            try:
+                r = self.send(controller, method, path, kwargs)
+                if info is not None:
+                    info.reused = not connection_events.opened
+            except requests.exceptions.ConnectionError as e:
+                self.limiter.update(None, None)
+                if self.failover(controller):
+                    continue
+                if attempt >= MAX_RETRIES:
+                    raise
+                wait = self.limiter.backoff(attempt)
+                get_logger().warning(
+                    "Connection error, pausing %.0fs before retrying. "
+                    "Error: %s", wait, e, extra={'uri': path})
+            else:
+                # only the latency of the posts is compared, the queries
+                # take very different times depending on their size
+                latency = None
+                if method == 'POST':
+                    latency = time.monotonic() - start
+                self.limiter.update(r.status_code, latency)
+                if (r.status_code == 403 and self.auth is not None and
+                        '/aaa' not in path and attempt < MAX_RETRIES and
+                        self.auth.token_expired(r)):
+                    # the cookie jar is updated in place by the new login,
+                    # the request is sent again with the new token
+                    self.auth.relogin()
+                    attempt += 1
+                    continue
+                if r.status_code not in (429, 503) or attempt >= MAX_RETRIES:
+                    return r
+                wait = self.limiter.backoff(attempt,
+                                            r.headers.get('Retry-After'))
+            attempt += 1
+            time.sleep(wait)
+
+    def get(self, path, cookies=None):
+        return self.request('GET', path, cookies=cookies)
+
+    # data can be a json string or a dictionary (see PAYLOAD_MODE).
+    # Any change to the MIT makes the cached snapshot of the APIC stale.
+    def post(self, path, data, cookies=None, template=None):
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        if '/aaa' not in path and mit_cache.enabled():
+            mit_cache.invalidate_post(self.apic, data)
+        return self.request('POST', path, template=template, data=data,
+                            cookies=cookies)
+
+    # Returns how many connections have been opened toward the APIC, and
+    # how many requests have been served on an already open connection.
+    def stats(self):
+        opened = 0
+        served = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                opened += pools[key].num_connections
+                served += pools[key].num_requests
+        limiter = self.limiter.stats()
+        return {'requests': served,
+                'opened': opened,
+                'reused': served - opened,
+                'rate': limiter['rate'],
+                'throttled': limiter['throttled']}
+
+    def close(self):
+        self.session.close()
+
+
+# Returns the list of the controllers of an apic, which can be a single
+# address or the addresses of all the controllers of a cluster separated
+# by commas, i.e. "10.0.0.1,10.0.0.2,10.0.0.3"
+def cluster_controllers(apic):
+    return [controller.strip() for controller in apic.split(',')
+            if controller.strip()]
+
+
+# Connection toward all the controllers of an APIC cluster, used in place
+# of FabConnection when the apic lists more than one controller. The
+# queries are spread round robin on the healthy controllers, the posts
+# (and the login) always go to the preferred one, CLUSTER_WRITE_CONTROLLER
+# or the first of the list. A controller not answering is marked down and
+# the request is sent at once to the next one; a background thread checks
+# the health of all the controllers every CLUSTER_HEALTH_INTERVAL seconds
+# and brings them back when they answer again. The token is valid on the
+# whole cluster, the cookies are sent to every controller.
+class FabCluster(FabConnection):
+    def __init__(self, apic, pool_size=DEFAULT_POOL_SIZE):
+        self.controllers = cluster_controllers(apic)
+        FabConnection.__init__(self, apic, pool_size,
+                               hosts=len(self.controllers))
+        self.write_controller = CLUSTER_WRITE_CONTROLLER
+        if self.write_controller not in self.controllers:
+            self.write_controller = self.controllers[0]
+        self.healthy = dict((controller, True) for controller in
+                            self.controllers)
+        self.lock = threading.Lock()
+        self.next = 0
+        # counters useful for statistics
+        self.served = dict((controller, 0) for controller in self.controllers)
+        self.failovers = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Healthy controllers, all of them if none is answering (the request
+    # is then retried with the backoff of the connection)
+    def up(self):
+        controllers = [controller for controller in self.controllers
+                       if self.healthy[controller]]
+        return controllers or self.controllers
+
+    def preferred(self):
+        controllers = self.up()
+        if self.write_controller in controllers:
+            return self.write_controller
+        return controllers[0]
+
+    def controller(self, method):
+        with self.lock:
+            if method != 'GET':
+                controller = self.preferred()
+            else:
+                controllers = self.up()
+                controller = controllers[self.next % len(controllers)]
+                self.next += 1
+            self.served[controller] += 1
+        return controller
+
+    def failover(self, controller):
+        with self.lock:
+            if self.healthy[controller]:
+                get_logger().warning("APIC controller %s is not answering, "
+                                     "failing over", controller)
+                self.healthy[controller] = False
+                self.failovers += 1
+        return any(self.healthy.values())
+
+    # The cookies set by the login on one controller are sent to all of them
+    def send(self, controller, method, path, kwargs):
+        cookies = kwargs.get('cookies')
+        if cookies is not None and not isinstance(cookies, dict):
+            kwargs = dict(kwargs, cookies=requests.utils.dict_from_cookiejar(
+                cookies))
+        kwargs.setdefault('timeout', (CLUSTER_CONNECT_TIMEOUT, None))
+        return FabConnection.send(self, controller, method, path, kwargs)
+
+    # aaaListDomains answers without authentication
+    def check(self, controller):
+        try:
+            r = self.session.get(self.url('/api/aaaListDomains.json',
+                                          controller), verify=False,
+                                 timeout=CLUSTER_CONNECT_TIMEOUT)
+            return r.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def run(self):
+        while not self.stopped.wait(CLUSTER_HEALTH_INTERVAL):
+            for controller in self.controllers:
+                healthy = self.check(controller)
+                with self.lock:
+                    if healthy and not self.healthy[controller]:
+                        get_logger().warning("APIC controller %s is back",
+                                             controller)
+                    elif not healthy and self.healthy[controller]:
+                        get_logger().warning("APIC controller %s failed the "
+                                             "health check", controller)
+                    self.healthy[controller] = healthy
+
+    def stats(self):
+        stats = FabConnection.stats(self)
+        with self.lock:
+            stats['controllers'] = dict(self.served)
+            stats['failovers'] = self.failovers
+        return stats
+
+    def close(self):
+        self.stopped.set()
+        FabConnection.close(self)
+
+
+# Returns the shared connection toward the APIC, creating it the first time.
+# The pool_size is only used when the connection is created.
+def get_connection(apic, pool_size=DEFAULT_POOL_SIZE):
+    if apic not in connections:
+        if len(cluster_controllers(apic)) > 1:
+            connections[apic] = FabCluster(apic, pool_size)
+        else:
+            connections[apic] = FabConnection(apic, pool_size)
+    return connections[apic]
+
+
+# Asyncio engine toward a single APIC. The blocking calls of the toolkit
+# are executed in a thread pool sharing the pooled connection, while a
+# semaphore limits the number of requests in flight toward the controller.
+class AsyncFabClient(object):
+    def __init__(self, apic, concurrency=DEFAULT_CONCURRENCY):
+        self.apic = apic
+        self.concurrency = concurrency
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency)
+        # the semaphore is bound to the event loop, it is created again
+        # every time the client is used from a new loop (i.e. asyncio.run)
+        self.loop = None
+        self.semaphore = None
+
+    # Awaitable execution of any blocking function, i.e. a toolkit method
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+# Returns the shared asyncio engine toward the APIC, creating it the first
+# time. The concurrency is only used when the engine is created.
+def get_async_client(apic, concurrency=DEFAULT_CONCURRENCY):
+    if apic not in async_clients:
+        async_clients[apic] = AsyncFabClient(apic, concurrency)
+    return async_clients[apic]
+
+
+# Wraps any object of the toolkit (Query, FabTnPol, FabAccPol, FabL3Pol ...)
+# and exposes an awaitable variant of every method, for example:
+#
+#   tnConf = AsyncFab(FabTnPol(apic_ip, cookies))
+#   [st1, st2] = await asyncio.gather(tnConf.vrf(...), tnConf.bd(...))
+class AsyncFab(object):
+    def __init__(self, obj, client=None):
+        self.obj = obj
+        if client is None:
+            client = get_async_client(obj.apic)
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.obj, name)
+        if not callable(method):
+            return method
+
+        async def awaitable(*args, **kwargs):
+            return await self.client.run(method, *args, **kwargs)
+        awaitable.__name__ = name
+        return awaitable
+
+
+# Process-wide registry of the json templates under json_path. Every
+# template is compiled only once and shared by all the classes, the
+# 'section' is the template subdirectory (FabTnPol, FabAccPol ...).
+class TemplateRegistry(object):
+    def __init__(self):
+        self.env = None
+        self.templates = {}
+        self.dict_templates = {}
+
+    # json_path and template_cache_dir are read the first time a template
+    # is needed, so that they can be changed after importing the module.
+    def environment(self):
+        if self.env is None:
+            bytecode_cache = None
+            if template_cache_dir is not None:
+                bytecode_cache = jinja2.FileSystemBytecodeCache(
+                    template_cache_dir)
+            self.env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(searchpath=json_path),
+                bytecode_cache=bytecode_cache,
+                auto_reload=False, cache_size=-1)
+            if PRECOMPILE_TEMPLATES:
+                self.precompile()
+        return self.env
+
+    # Name must be in the form 'FabTnPol/bd.json'
+    def get_template(self, name):
+        template = self.templates.get(name)
+        if template is None:
+            template = self.environment().get_template(name)
+            self.templates[name] = template
+        return template
+
+    # Same as get_template, but the template renders python dictionaries
+    def get_dict_template(self, name):
+        template = self.dict_templates.get(name)
+        if template is None:
+            source = self.environment().loader.get_source(self.env, name)[0]
+            template = DictTemplate(source, self.get_template(name))
+            self.dict_templates[name] = template
+        return template
+
+    # Compiles all the templates under json_path, returns how many they are
+    def precompile(self):
+        env = self.environment()
+        for name in env.list_templates(extensions=['json']):
+            if name not in self.templates:
+                self.templates[name] = env.get_template(name)
+        return len(self.templates)
+
+    # Forgets all the compiled templates, i.e. after changing json_path
+    def reset(self):
+        self.env = None
+        self.templates = {}
+        self.dict_templates = {}
+
+    def section(self, section):
+        return TemplateSection(self, section)
+
+
+# View of the registry used by the classes as their template environment
+class TemplateSection(object):
+    def __init__(self, registry, section):
+        self.registry = registry
+        self.section = section
+
+    def get_template(self, name):
+        if PAYLOAD_MODE == 'dict':
+            return self.registry.get_dict_template(self.section + '/' + name)
+        return self.registry.get_template(self.section + '/' + name)
+
+
+template_registry = TemplateRegistry()
+
+
+# Json template compiled once into a python function with placeholders, the
+# render method fills them and returns a dictionary without producing and
+# parsing any json text. All the {{variables}} of the templates are inside
+# json strings, so the template itself is valid json. Templates with jinja2
+# statements ({% if %} ...) are rendered by jinja2 and parsed instead.
+class DictTemplate(object):
+    placeholder = re.compile(r'{{\s*(\w+)\s*}}')
+
+    def __init__(self, source, template=None):
+        self.template = template
+        self.build = None
+        if '{%' not in source:
+            self.build = self.compile(json.loads(source))
+
+    # Every node of the json becomes a function of the template variables:
+    # strings with variables are turned into format strings, dictionaries
+    # (keys can contain variables as well, i.e. "{{pol_type}}IfP") and
+    # lists build a new object at every render.
+    def compile(self, node):
+        if isinstance(node, dict):
+            items = [(self.compile(key), self.compile(value))
+                     for key, value in node.items()]
+            return lambda v: {key(v): value(v) for key, value in items}
+        if isinstance(node, list):
+            values = [self.compile(value) for value in node]
+            return lambda v: [value(v) for value in values]
+        if isinstance(node, str) and '{{' in node:
+            parts = self.placeholder.split(node)
+            if len(parts) == 3 and parts[0] == '' and parts[2] == '':
+                return lambda v, name=parts[1]: str(v[name])
+            fmt = ''.join([part.replace('{', '{{').replace('}', '}}')
+                           if i % 2 == 0 else '{' + part + '}'
+                           for i, part in enumerate(parts)])
+            return fmt.format_map
+        return lambda v: node
+
+    def render(self, variables=None, **kwargs):
+        variables = TemplateVars(variables or {}, **kwargs)
+        if self.build is None:
+            return json.loads(self.template.render(variables))
+        return self.build(variables)
+
+
+# Variables missing from the template vars are rendered as empty strings,
+# like jinja2 does with undefined variables.
+class TemplateVars(dict):
+    def __missing__(self, key):
+        return ''
+
+
+# Response returned to post() for the payloads queued by FabBatch, the real
+# status of every object is known only after the commit.
+class QueuedResponse(object):
+    status_code = 200
+    text = ''
+
+
+# Batch (transaction) builder. It is used in place of the connection of a
+# class, every payload posted by the class methods is queued under its DN
+# instead of being sent to the APIC:
+#
+#   batch = FabBatch(apic.conn, cookies, size=50)
+#   tnConf = FabTnPol(apic_ip, cookies, conn=batch)
+#   tnConf.tenant(...)
+#   tnConf.vrf(...)
+#   results = batch.commit()
+#
+# The commit merges the queued payloads in a single polUni tree for every
+# tenant (or infra, fabric ...), and sends it with a single POST to mo/uni,
+# with at most 'size' queued payloads per POST. The APIC applies a POST as
+# a whole, so when a tree is rejected it is split in two halves which are
+# committed again, until the objects that have failed are found.
+class FabBatch(object):
+    def __init__(self, conn, cookies=None, size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.apic = conn.apic
+        self.cookies = cookies
+        self.size = size
+        self.entries = []
+        # number of POST performed by the commits, useful for statistics
+        self.posts = 0
+
+    # Queries are not queued, they go straight to the APIC
+    def get(self, path, cookies=None):
+        return self.conn.get(path, cookies=cookies)
+
+    def post(self, path, data, cookies=None, template=None):
+        reg = re.match(r'/api/node/mo/(.*)\.json$', path)
+        if reg is None:
+            return self.conn.post(path, data, cookies=cookies,
+                                  template=template)
+        if isinstance(data, str):
+            data = json.loads(data)
+        entry = {'uri': 'mo/' + reg.group(1),
+                 'payload': data,
+                 'status': None}
+        [(aci_class, body)] = entry['payload'].items()
+        entry['dn'] = body.get('attributes', {}).get('dn', reg.group(1))
+        # the object can be added to the tree only if the class of all the
+        # fathers is known, otherwise it is committed on its own.
+        rns = split_dn(entry['dn'])
+        entry['nested'] = (rns[0] == 'uni' and
+                           all(rn.split('-')[0] in rn_classes
+                               for rn in rns[1:-1]))
+        if cookies is not None:
+            self.cookies = cookies
+        self.entries.append(entry)
+        return QueuedResponse()
+
+    # Commits all the queued payloads and returns the list of (uri, status)
+    # in the same order they have been queued.
+    def commit(self):
+        entries = self.entries
+        self.entries = []
+        start = start_batch('FabBatch', len(entries))
+        try:
+            groups = collections.OrderedDict()
+            for entry in entries:
+                if not entry['nested']:
+                    self.commit_single(entry)
+                    continue
+                key = '/'.join(split_dn(entry['dn'])[:2])
+                groups.setdefault(key, []).append(entry)
+            for group in groups.values():
+                for i in range(0, len(group), self.size):
+                    self.commit_entries(group[i:i+self.size])
+        finally:
+            end_batch('FabBatch', len(entries), start)
+        return [(entry['uri'], entry['status']) for entry in entries]
+
+    def send(self, uri, payload):
+        self.posts += 1
+        try:
+            r = self.conn.post('/api/node/{}.json'.format(uri),
+                               json.dumps(payload), cookies=self.cookies)
+        except Exception as e:
+            get_logger().error("Batch commit of %s failed. Exception: %s", uri,
+                               e, extra={'uri': uri})
+            return (666, str(e))
+        return (r.status_code, r.text)
+
+    def commit_single(self, entry):
+        [entry['status'], text] = self.send(entry['uri'], entry['payload'])
+        if entry['status'] != 200 and PRINT_RESPONSE_TEXT_ON_FAIL:
+            get_logger('aci.response').warning(
+                text, extra={'uri': entry['uri'], 'status': entry['status']})
+
+    def commit_entries(self, entries):
+        if len(entries) == 1 and entries[0]['dn'] == entries[0]['uri'][3:]:
+            self.commit_single(entries[0])
+            return
+        [status, text] = self.send('mo/uni', self.build_tree(entries))
+        if status == 200 or len(entries) == 1:
+            for entry in entries:
+                entry['status'] = status
+            if status != 200 and PRINT_RESPONSE_TEXT_ON_FAIL:
+                get_logger('aci.response').warning(
+                    text, extra={'uri': 'mo/uni', 'status': status})
+            return
+        half = len(entries) // 2
+        self.commit_entries(entries[:half])
+        self.commit_entries(entries[half:])
+
+    # Returns the polUni tree containing all the entries, the fathers that
+    # have not been queued are added with status 'modified', so that the
+    # commit fails if they do not exist, exactly like single POSTs do.
+    def build_tree(self, entries):
+        root = {'attributes': {'dn': 'uni'}, 'children': []}
+        nodes = {'uni': root}
+        placeholders = set()
+        for entry in entries:
+            [(aci_class, body)] = entry['payload'].items()
+            body = dict(body)
+            body['attributes'] = dict(body.get('attributes', {}))
+            body['attributes'].setdefault('dn', entry['dn'])
+            self.merge(nodes, placeholders, aci_class, body)
+        return {'polUni': root}
+
+    def merge(self, nodes, placeholders, aci_class, body):
+        dn = body['attributes']['dn']
+        if dn in nodes:
+            node = nodes[dn]
+            if dn in placeholders:
+                placeholders.discard(dn)
+                node['attributes'] = dict(body['attributes'])
+            else:
+                for key, value in body['attributes'].items():
+                    node['attributes'].setdefault(key, value)
+        else:
+            parent = self.container(nodes, placeholders,
+                                    '/'.join(split_dn(dn)[:-1]))
+            node = {'attributes': dict(body['attributes']), 'children': []}
+            parent['children'].append({aci_class: node})
+            nodes[dn] = node
+        for child in body.get('children', []):
+            [(child_class, child_body)] = child.items()
+            attributes = child_body.get('attributes', {})
+            if 'dn' in attributes or 'rn' in attributes:
+                child_body = dict(child_body)
+                child_body['attributes'] = dict(attributes)
+                child_body['attributes'].setdefault(
+                    'dn', dn + '/' + attributes.get('rn', ''))
+                self.merge(nodes, placeholders, child_class, child_body)
+            else:
+                node['children'].append(child)
+
+    def container(self, nodes, placeholders, dn):
+        if dn not in nodes:
+            parent = self.container(nodes, placeholders,
+                                    '/'.join(split_dn(dn)[:-1]))
+            node = {'attributes': {'dn': dn, 'status': 'modified'},
+                    'children': []}
+            aci_class = rn_classes[split_dn(dn)[-1].split('-')[0]]
+            parent['children'].append({aci_class: node})
+            nodes[dn] = node
+            placeholders.add(dn)
+        return nodes[dn]
+
+
+# Snapshot of the MIT, made of the results of the class queries keyed by
+# (apic, class, filter). Entries expire after MIT_CACHE_TTL seconds, and the
+# least recently used ones are evicted when more than MIT_CACHE_SIZE objects
+# are kept. With mit_cache_file, the snapshot is loaded the first time it is
+# used and written back when the program exits, as gzip compressed json
+# lines: a header, then one [apic, class, filter, time, imdata] per entry.
+# A POST toward an APIC (except the aaa ones) drops its entries which may
+# have changed, so that a script never reads back a state older than its own
+# changes (see invalidate_post). A script running with the cache disabled
+# does not touch the snapshot, the tools sharing it must not be run after
+# pushes made without the cache.
+class MitCache(object):
+    version = 1
+
+    def __init__(self, ttl=None, size=None, path=None):
+        # None means that the global option is used
+        self.ttl = ttl
+        self.size = size
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.objects = 0
+        self.loaded = False
+        self.dirty = False
+        self.lock = threading.Lock()
+        # counters useful for statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get_ttl(self):
+        return MIT_CACHE_TTL if self.ttl is None else self.ttl
+
+    def get_size(self):
+        return MIT_CACHE_SIZE if self.size is None else self.size
+
+    def get_path(self):
+        return mit_cache_file if self.path is None else self.path
+
+    def enabled(self):
+        return self.get_ttl() > 0
+
+    # Returns the cached imdata list, or None if missing or expired
+    def get(self, apic, aci_class, query_filter=''):
+        if not self.enabled():
+            return None
+        key = (apic, aci_class, query_filter)
+        with self.lock:
+            self.load()
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.get_ttl():
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, apic, aci_class, query_filter, imdata, timestamp=None):
+        if not self.enabled() or len(imdata) > self.get_size():
+            return
+        key = (apic, aci_class, query_filter)
+        with self.lock:
+            self.load()
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (timestamp or time.time(), imdata)
+            self.objects += len(imdata)
+            while self.objects > self.get_size():
+                self.remove(next(iter(self.entries)))
+            self.changed()
+
+    # Drops the entries of an APIC (all of them if apic is None), optionally
+    # only those of a class
+    def invalidate(self, apic=None, aci_class=None):
+        with self.lock:
+            self.load()
+            for key in [key for key in self.entries
+                        if (apic is None or key[0] == apic) and
+                           (aci_class is None or key[1] == aci_class)]:
+                self.remove(key)
+                self.changed()
+
+    # Drops the entries of an APIC which a POST of 'data' (json string) may
+    # have made stale. Classes belong to a package, the lowercase prefix of
+    # their name ('fv', 'infra' ...); the entries dropped are the ones whose
+    # class, or a class named in their filter (subtree queries), is in the
+    # package of a posted class, since the APIC creates children on its own
+    # (i.e. the fvRsCtx of a BD). A deletion drops all the entries of the
+    # APIC, the children deleted with an object can be of any package.
+    def invalidate_post(self, apic, data):
+        packages = set(class_packages(data, r'\s*:\s*\{'))
+        if not packages or re.search(r'"status"\s*:\s*"[^"]*deleted', data):
+            self.invalidate(apic)
+            return
+        with self.lock:
+            self.load()
+            for key in [key for key in self.entries if key[0] == apic and
+                        not packages.isdisjoint(class_packages(key[1] + ' ' +
+                                                               key[2]))]:
+                self.remove(key)
+                self.changed()
+
+    def remove(self, key):
+        self.objects -= len(self.entries.pop(key)[1])
+
+    # The snapshot is written when the program exits, if anything changed
+    def changed(self):
+        if not self.dirty and self.get_path() is not None:
+            atexit.register(self.save)
+        self.dirty = True
+
+    # Reads the persisted snapshot, expired entries are skipped
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        path = self.get_path()
+        if path is None or not os.path.exists(path):
+            return
+        now = time.time()
+        try:
+            with gzip.open(path, 'rt') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != self.version:
+                    return
+                for line in f:
+                    [apic, aci_class, query_filter, timestamp,
+                     imdata] = json.loads(line)
+                    if now - timestamp <= self.get_ttl():
+                        key = (apic, aci_class, query_filter)
+                        self.entries[key] = (timestamp, imdata)
+                        self.objects += len(imdata)
+        except (OSError, ValueError) as e:
+            print("Failed to load the MIT cache {}. Error: {}".format(path, e))
+            self.entries.clear()
+            self.objects = 0
+
+    # Writes the snapshot on disk, the file is replaced atomically so that
+    # another script never reads it half written
+    def save(self):
+        path = self.get_path()
+        if path is None or not self.dirty:
+            return
+        with self.lock:
+            tmp_path = path + '.tmp'
+            with gzip.open(tmp_path, 'wt') as f:
+                f.write(json.dumps({'version': self.version}) + '\n')
+                for (apic, aci_class, query_filter), (timestamp, imdata) in \
+                        self.entries.items():
+                    f.write(json.dumps([apic, aci_class, query_filter,
+                                        timestamp, imdata],
+                                       separators=(',', ':')) + '\n')
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    def clear(self):
+        with self.lock:
+            self.loaded = True
+            self.entries.clear()
+            self.objects = 0
+            self.changed()
+
+
+mit_cache = MitCache()
+
+
+# Class query urls, with the class name and the query string
+class_url = re.compile(r'/api/(?:node/)?class/([A-Za-z0-9]+)\.json(\?.*)?$')
+
+
+# Returns the packages of the class names in a text ('fv' for fvBD), after
+# is a regular expression which must follow the names (i.e. to match only
+# the json keys)
+def class_packages(text, after=''):
+    return re.findall(r'(?<![A-Za-z0-9])([a-z][a-z0-9]*)[A-Z][A-Za-z0-9]*"?' + after,
+                      text)
+
+
+# Applies the LOG_* options to the loggers of the toolkit, at every login
+def setup_logging():
+    aci_log.setup(LOG_LEVEL, LOG_FILE, LOG_PAYLOAD_SAMPLE, LOG_BACKGROUND)
+
+
+# Returns a logger of the toolkit, the LOG_* options are applied the first
+# time if no login did it
+def get_logger(name='aci'):
+    if not aci_log.configured:
+        setup_logging()
+    return logging.getLogger(name)
+
+
+# Function to execute HTTP Post
+def post(apic, payload, cookies, uri, section='', conn=None):
+    if PRINT_PAYLOAD or not PUSH_TO_APIC:
+        # the payload is formatted by the writer of the log, if ever
+        get_logger('aci.payload').info(
+            'Adding to the object: "%s" the following json string:', uri,
+            extra={'uri': uri, 'payload': payload})
+    if conn is None:
+        conn = get_connection(apic)
+    if not PUSH_TO_APIC:
         return 200
+    # connection errors and throttling are retried by the connection
+    try:
+        r = conn.post('/api/node/{}.json'.format(uri), payload,
+                      cookies=cookies, template=section or None)
+        status = r.status_code
+    except Exception as e:
+        get_logger().error("Method %s failed. Exception: %s", section[:-5], e,
+                           extra={'uri': uri})
+        return 666
+    if PRINT_RESPONSE_TEXT_ALWAYS:
+        get_logger('aci.response').info(r.text,
+                                        extra={'uri': uri, 'status': status})
+    elif status != 200 and PRINT_RESPONSE_TEXT_ON_FAIL:
+        get_logger('aci.response').warning(r.text,
+                                           extra={'uri': uri, 'status': status})
     return status
 
 
 # Class must be instantiated with APIC IP address, username, and password
 # the login method returns the APIC cookies.
 class FabLogin(object):
-    def __init__(self, apic, user, pword):
+    def __init__(self, apic, user, pword, pool_size=DEFAULT_POOL_SIZE):
         self.apic = apic
         self.user = user
         self.pword = pword
+        # the connection is shared with all the classes built on the same
+        # apic, it can also be passed explicitly with the conn argument
+        self.conn = get_connection(apic, pool_size)
 
-    def login(self):
+    # Posts the aaaLogin, returns the response
+    def post_login(self):
         # Load login json payload
         payload = '''
         {{
@@ -109,12 +1355,13 @@ class FabLogin(object):
         '''.format(user=self.user, pword=self.pword)
         payload = json.loads(payload,
                              object_pairs_hook=collections.OrderedDict)
-        s = requests.Session()
+        # Verify is disabled as there are issues if it is enabled
+        return self.conn.post('/api/mo/aaaLogin.json', json.dumps(payload))
+
+    def login(self):
         # Try the request, if exception, exit program w/ error
         try:
-            # Verify is disabled as there are issues if it is enabled
-            r = s.post('https://{}/api/mo/aaaLogin.json'.format(self.apic),
-                       data=json.dumps(payload), verify=False)
+            r = self.post_login()
             # Capture HTTP status code from the request
             status = r.status_code
             # Capture the APIC cookie for all other future calls
@@ -141,17 +1388,166 @@ class FabLogin(object):
             print("Something went wrong logging into the APIC - ABORT!")
             # Log exit reason somewhere
             raise LoginFailed(e)
+        self.refresh_timeout = token_timeout(r)
+        if getattr(self, 'session', None) is not None:
+            # a new login, the cookies of the previous one are updated so
+            # that the classes built with them keep working
+            replace_cookies(self.cookies, cookies)
+            self.session.logged_in(self.refresh_timeout)
+            return self.cookies
         self.cookies = cookies
+        self.session = None
+        if SESSION_KEEPALIVE:
+            self.session = FabSession(self)
+            self.session.start()
+        setup_logging()
+        if PRINT_REQUEST_STATS:
+            request_stats.enable()
+        if METRICS_PORT is not None:
+            # imported here, aci_metrics is built on this module
+            import aci_metrics
+            aci_metrics.start_exporter(METRICS_PORT)
         return cookies
 
+    # The new aaaLogin of a FabSession whose token has expired. Unlike
+    # login() it never exits the program: LoginFailed is raised when the
+    # APIC can not be reached or does not answer 200, the caller retries.
+    def login_again(self):
+        try:
+            r = self.post_login()
+        except Exception as e:
+            raise LoginFailed(e)
+        if r.status_code != 200:
+            raise LoginFailed('aaaLogin answered HTTP {}'.format(r.status_code))
+        self.refresh_timeout = token_timeout(r)
+        replace_cookies(self.cookies, r.cookies)
+        self.session.logged_in(self.refresh_timeout)
+        return self.cookies
+
+
+# Returns the seconds of validity of the token of an aaaLogin or aaaRefresh
+# response, 600 (the APIC default) if it can not be read
+def token_timeout(r):
+    try:
+        attributes = json.loads(r.text)['imdata'][0]['aaaLogin']['attributes']
+        return int(attributes['refreshTimeoutSeconds'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return 600
+
+
+# Updates in place the cookie jar with new cookies, dropping the old ones
+# with the same name set by another controller of the cluster
+def replace_cookies(jar, cookies):
+    names = set(cookie.name for cookie in cookies)
+    keys = set((cookie.domain, cookie.path, cookie.name) for cookie in cookies)
+    jar.update(cookies)
+    for cookie in list(jar):
+        if (cookie.name in names and
+                (cookie.domain, cookie.path, cookie.name) not in keys):
+            jar.clear(cookie.domain, cookie.path, cookie.name)
+
+
+# Keeps alive the token of a FabLogin for long running jobs: a background
+# timer calls aaaRefresh SESSION_REFRESH_MARGIN seconds before the token
+# expires, and the requests refused because the token expired anyway are
+# authenticated again (with a new aaaLogin) and sent again by the
+# connection. The cookie jar returned by login() is updated in place, so
+# all the classes built with it use the new token.
+class FabSession(object):
+    def __init__(self, login, margin=None):
+        self.login = login
+        self.conn = login.conn
+        self.margin = SESSION_REFRESH_MARGIN if margin is None else margin
+        self.lock = threading.Lock()
+        self.expires = 0
+        self.logged_in(login.refresh_timeout)
+        self.conn.auth = self
+        self.stopped = threading.Event()
+        self.thread = None
+        # counters useful for statistics
+        self.refreshes = 0
+        self.relogins = 0
+
+    def logged_in(self, timeout):
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+
+    # Seconds before the expiration when the token is refreshed, at most a
+    # third of its lifetime
+    def lead(self):
+        return min(self.margin, self.timeout / 3.0)
+
+    # True if the 403 response is due to an expired or invalid token
+    def token_expired(self, r):
+        return 'token' in r.text.lower()
+
+    # Calls aaaRefresh, returns True if the token has been refreshed
+    def refresh(self):
+        with self.lock:
+            try:
+                r = self.conn.get('/api/aaaRefresh.json',
+                                  cookies=self.login.cookies)
+            except Exception as e:
+                get_logger().warning("Token refresh failed. Exception: %s", e)
+                return False
+            if r.status_code != 200:
+                return False
+            replace_cookies(self.login.cookies, r.cookies)
+            self.logged_in(token_timeout(r))
+            self.refreshes += 1
+            return True
+
+    # A new aaaLogin, performed only once by concurrent requests failing
+    # with the same expired token. Raises LoginFailed if it is refused.
+    def relogin(self):
+        expires = self.expires
+        with self.lock:
+            if self.expires != expires:
+                return
+            get_logger().warning("APIC token expired, logging in again")
+            self.login.login_again()
+            self.relogins += 1
+
+    # The failed logins are retried with an exponential backoff, up to
+    # SESSION_REFRESH_MARGIN seconds between two attempts
+    def run(self):
+        failures = 0
+        wait = max(1, self.expires - self.lead() - time.monotonic())
+        while not self.stopped.wait(wait):
+            wait = max(1, self.expires - self.lead() - time.monotonic())
+            if self.expires - time.monotonic() > self.lead():
+                continue
+            if self.refresh():
+                failures = 0
+                continue
+            try:
+                self.relogin()
+                failures = 0
+            except LoginFailed as e:
+                wait = min(RETRY_BACKOFF * (2 ** failures),
+                           SESSION_REFRESH_MARGIN)
+                failures += 1
+                get_logger().warning("Login failed, retrying in %.0fs. "
+                                     "Error: %s", wait, e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
 # Class must be instantiated with APIC IP address and cookies
 class FabPodPol(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabPodPol/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabPodPol')
 
     # Method must be called with the following kwargs.
     # name: Name of the node being deployed
@@ -195,7 +1591,8 @@ class FabPodPol(object):
 
         # Handle request
         uri = 'mo/uni'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -219,7 +1616,8 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -251,7 +1649,8 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/dnsp-default'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
 
         template_file = "dns_profile.json"
         template = self.templateEnv.get_template(template_file)
@@ -259,7 +1658,8 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/dnsp-default/rsProfileToEpg'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -285,7 +1685,8 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/bgpInstP-default/as'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -312,7 +1713,8 @@ class FabPodPol(object):
 
         uri = 'mo/uni/fabric/bgpInstP-default/rr/node-{}'.format(
               templateVars['rr'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -334,7 +1736,8 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/funcprof'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
 
         template_file = "pod_pol_assign.json"
         template = self.templateEnv.get_template(template_file)
@@ -342,18 +1745,18 @@ class FabPodPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/podprof-default/pods-default-typ-ALL/rspodPGrp'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class FabAccPol(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabAccPol/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabAccPol')
 
     # Method must be called with the following kwargs.
     # name: The name of the CDP policy
@@ -376,7 +1779,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/cdpIfP-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -401,7 +1805,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/lldpIfP-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -428,7 +1833,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/hintfpol-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -455,7 +1861,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/lacplagp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -479,7 +1886,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/l2IfP-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -503,7 +1911,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/mcpIfP-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -522,7 +1931,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/mcpInstP-default'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -542,7 +1952,8 @@ class FabAccPol(object):
 
         uri = ('mo/uni/infra/edrErrDisRecoverPol-default/edrEventP-event-{}'
                .format(templateVars['event']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -581,7 +1992,8 @@ class FabAccPol(object):
 
         uri = ('mo/uni/infra/vlanns-[{}]-{}'
                .format(templateVars['name'], templateVars['mode']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -631,7 +2043,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/attentp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -655,7 +2068,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/l3dom-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -679,7 +2093,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/phys-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -703,7 +2118,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/attentp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -727,7 +2143,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/attentp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -767,7 +2184,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/protpol/expgep-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -810,7 +2228,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/nprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -841,7 +2260,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/nprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -879,7 +2299,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/funcprof/accbundle-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -913,7 +2334,8 @@ class FabAccPol(object):
 
         uri = ('mo/uni/infra/funcprof/accportgrp-{}'
                .format(templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -938,7 +2360,8 @@ class FabAccPol(object):
 
         uri = ('mo/uni/infra/funcprof/brkoutportgrp-{}'
                .format(templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -960,7 +2383,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/accportprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1015,7 +2439,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/accportprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1061,7 +2486,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/accportprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1115,7 +2541,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/accportprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1139,7 +2566,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/nprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1163,7 +2591,8 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/fexprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1222,7 +2651,8 @@ class FabAccPol(object):
 
         uri = ('mo/uni/infra/fexprof-{}/hports-{}-typ-range'
                .format(templateVars['name'], templateVars['port_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1279,18 +2709,18 @@ class FabAccPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/infra/accportprof-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class FabTnPol(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabTnPol/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabTnPol')
 
     # Method must be called with the following kwargs.
     # name: The name of the Tenant
@@ -1311,7 +2741,8 @@ class FabTnPol(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/tn-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1338,7 +2769,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/ctx-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1365,7 +2797,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/ctx-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1392,7 +2825,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/ctx-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1414,7 +2848,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/ctx-{}/any'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1456,7 +2891,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/BD-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1484,7 +2920,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/BD-{}/rsctx'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1516,7 +2953,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/BD-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1544,7 +2982,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/BD-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1606,7 +3045,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/flt-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1639,7 +3079,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/brc-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1664,7 +3105,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/ap-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1694,7 +3136,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1719,7 +3162,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1753,7 +3197,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1787,7 +3232,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1817,7 +3263,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}/rsprov-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name'], templateVars['contract']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1847,7 +3294,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}/rscons-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name'], templateVars['contract']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1904,7 +3352,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -1956,7 +3405,8 @@ class FabTnPol(object):
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name'], templateVars['pod'],
                        templateVars['sw1'], templateVars['port_channel']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2009,7 +3459,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2064,7 +3515,8 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2099,7 +3551,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/relayp-{}'
                .format(templateVars['tn_name'], templateVars['relay_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2134,7 +3587,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/relayp-{}'
                .format(templateVars['tn_name'], templateVars['relay_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2163,7 +3617,8 @@ class FabTnPol(object):
 
         uri = ('mo/uni/tn-{}/BD-{}'
                .format(templateVars['tn_name'], templateVars['bd_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2224,18 +3679,18 @@ class FabTnPol(object):
         uri = ('mo/uni/tn-{}/ap-{}/epg-{}'
                .format(templateVars['tn_name'], templateVars['ap_name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class FabL3Pol(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabL3Pol/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabL3Pol')
 
     # Method must be called with the following kwargs.
     # tn_name: Name of the Tenant
@@ -2263,7 +3718,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2292,7 +3748,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2317,7 +3774,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2372,7 +3830,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2417,7 +3876,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2469,7 +3929,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/lnodep-{}/lifp-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'], templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2528,7 +3989,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/lnodep-{}/lifp-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'], templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2590,7 +4052,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/lnodep-{}/lifp-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'], templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2646,7 +4109,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/lnodep-{}/lifp-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'], templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2700,7 +4164,8 @@ class FabL3Pol(object):
                        templateVars['node_name'], templateVars['int_profile'],
                        templateVars['pod'], templateVars['sw1'],
                        templateVars['sw2'], templateVars['vpc']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2734,7 +4199,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/instP-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2773,7 +4239,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/ospfIfPol-{}'
                .format(templateVars['tn_name'], templateVars['pol_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2808,7 +4275,8 @@ class FabL3Pol(object):
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'],
                        templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2851,7 +4319,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2913,7 +4382,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/out-{}'
                .format(templateVars['tn_name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -2979,7 +4449,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/lnodep-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['node_name'], templateVars['int_profile']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # tn_name: Name of the Tenant
@@ -3008,7 +4479,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/instP-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # tn_name: Name of the Tenant
@@ -3037,7 +4509,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/out-{}/instP-{}'
                .format(templateVars['tn_name'], templateVars['name'],
                        templateVars['epg_name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # tn_name: Name of the Tenant
@@ -3062,7 +4535,8 @@ class FabL3Pol(object):
 
         uri = ('mo/uni/tn-{}/ctx-{}'
                .format(templateVars['tn_name'], templateVars['vrf']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # tn_name: Name of the Tenant
@@ -3089,7 +4563,8 @@ class FabL3Pol(object):
         uri = ('mo/uni/tn-{}/ctx-{}/pimctxp/staticrp/staticrpent-[{}]'
                .format(templateVars['tn_name'], templateVars['vrf'],
                        templateVars['rp']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # tn_name: Name of the Tenant
@@ -3112,18 +4587,18 @@ class FabL3Pol(object):
         payload = template.render(templateVars)
         uri = ('mo/uni/tn-{}/out-{}/'
                .format(templateVars['tn_name'], templateVars['l3_out']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class TshootPol(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'TshootPol/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('TshootPol')
 
     # Method must be called with the following kwargs.
     # tn_name: Name of the Tenant (for source of SPAN)
@@ -3157,7 +4632,8 @@ class TshootPol(object):
 
         uri = ('mo/uni/tn-{}/srcgrp-{}-Group'
                .format(templateVars['name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3196,24 +4672,29 @@ class TshootPol(object):
 
         uri = ('mo/uni/tn-{}/destgrp-{}-Group'
                .format(templateVars['name'], templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class Query(object):
-    def __init__(self, apic, cookies):
+    # The class queries are served by the MIT snapshot cache when enabled,
+    # a different MitCache can be passed with the cache argument.
+    def __init__(self, apic, cookies, conn=None, cache=None):
         self.apic = apic
         self.cookies = cookies
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.cache = cache if cache is not None else mit_cache
 
     # Method must be called with the following kwargs.
     # dn: DN of object you would like to query
     # Returns status code and json payload of query
     def query_dn(self, dn, query_filter=''):
-        s = requests.Session()
+        payload = None
         try:
-            r = s.get('https://{}/api/node/mo/{}.json{}'.format(self.apic, dn,
-                      query_filter), cookies=self.cookies, verify=False)
+            r = self.conn.get('/api/node/mo/{}.json{}'.format(dn, query_filter),
+                              cookies=self.cookies)
             status = r.status_code
             payload = json.loads(r.text)
         except Exception as e:
@@ -3222,33 +4703,127 @@ class Query(object):
         return (status, payload)
 
     def query_class(self, query_class, query_filter=''):
-        s = requests.Session()
+        imdata = self.cache.get(self.apic, query_class, query_filter)
+        if imdata is not None:
+            return (200, {'totalCount': str(len(imdata)), 'imdata': imdata})
+        payload = None
         try:
-            r = s.get('https://{}/api/node/class/{}.json{}'.format(self.apic,
-                      query_class, query_filter), cookies=self.cookies,
-                      verify=False)
+            r = self.conn.get('/api/node/class/{}.json{}'.format(query_class,
+                              query_filter), cookies=self.cookies)
             status = r.status_code
             payload = json.loads(r.text)
         except Exception as e:
             print("Failed to query Class. Exception: {}".format(e))
             status = 666
+        if status == 200:
+            self.cache.put(self.apic, query_class, query_filter,
+                           payload['imdata'])
         return (status, payload)
     
     # Method must be called with the following kwargs.
     # url: the url of the objectquery, for example /api/mo/...
     # Returns status code and json payload of query
+    # Class queries (/api/node/class/<class>.json?...) are served by the MIT
+    # snapshot cache as query_class does, with the query string as filter.
     def query_url(self, url):
-        s = requests.Session()
+        reg = class_url.match(url)
+        if reg is None:
+            return self.get_url(url)
+        query_class = reg.group(1)
+        query_filter = reg.group(2) or ''
+        imdata = self.cache.get(self.apic, query_class, query_filter)
+        if imdata is not None:
+            return (200, {'totalCount': str(len(imdata)), 'imdata': imdata})
+        [status, payload] = self.get_url(url)
+        if status == 200:
+            self.cache.put(self.apic, query_class, query_filter,
+                           payload['imdata'])
+        return (status, payload)
+
+    # Same as query_url, never served by the cache
+    def get_url(self, url):
+        payload = None
         try:
-            r = s.get('https://'+str(self.apic)+url,
-                      cookies=self.cookies, verify=False)
+            r = self.conn.get(url, cookies=self.cookies)
             status = r.status_code
             payload = json.loads(r.text)
         except Exception as e:
             print("Failed to query Class. Exception: {}".format(e))
             status = 666
         return (status, payload)
-    
+
+    # Iterator on all the objects of a class, retrieved page by page with the
+    # APIC page and page-size parameters: objects are yielded as every page
+    # arrives, so that huge classes (fvCEp, fvRsPathAtt ...) can be processed
+    # with bounded memory. For example:
+    #
+    #   for obj in req.iter_class('fvRsPathAtt'):
+    #       dn = obj['fvRsPathAtt']['attributes']['dn']
+    #
+    # query_filter is the same of query_class, i.e. '?query-target-filter=...'
+    # With parallel > 1, up to 'parallel' pages are retrieved at the same
+    # time. Raises QueryFailed if a page can not be retrieved.
+    # When the MIT snapshot cache is enabled, the objects are also collected
+    # and cached once all the pages have been read (unless they are more
+    # than the cache size).
+    def iter_class(self, query_class, query_filter='',
+                   page_size=DEFAULT_PAGE_SIZE, parallel=1):
+        imdata = self.cache.get(self.apic, query_class, query_filter)
+        if imdata is not None:
+            for obj in imdata:
+                yield obj
+            return
+        url = '/api/node/class/{}.json{}'.format(query_class, query_filter)
+        objects = [] if self.cache.enabled() else None
+        for obj in self.iter_url(url, page_size, parallel,
+                                 order_by=query_class + '.dn'):
+            if objects is not None:
+                objects.append(obj)
+                if len(objects) > self.cache.get_size():
+                    objects = None
+            yield obj
+        if objects is not None:
+            self.cache.put(self.apic, query_class, query_filter, objects)
+
+    # Same as iter_class, for any query url. Pages are stable only if the
+    # objects are sorted, order_by is passed as the APIC order-by parameter.
+    def iter_url(self, url, page_size=DEFAULT_PAGE_SIZE, parallel=1,
+                 order_by=None):
+        url += '&' if '?' in url else '?'
+        if order_by is not None:
+            url += 'order-by={}&'.format(order_by)
+        page_url = url + 'page={}&page-size=' + str(page_size)
+
+        def get_page(page):
+            # the pages are not cached, iter_class caches all the objects
+            [status, payload] = self.get_url(page_url.format(page))
+            if status != 200:
+                raise QueryFailed('Page {} of {} failed with status {}'
+                                  .format(page, url, status))
+            return payload
+
+        # the first page also tells how many objects there are in total
+        payload = get_page(0)
+        total = int(payload.get('totalCount', 0))
+        pages = (total + page_size - 1) // page_size
+        for obj in payload['imdata']:
+            yield obj
+        if parallel <= 1:
+            for page in range(1, pages):
+                for obj in get_page(page)['imdata']:
+                    yield obj
+            return
+        # at most 'parallel' pages are in flight or waiting to be consumed
+        with concurrent.futures.ThreadPoolExecutor(parallel) as executor:
+            futures = collections.deque()
+            next_page = 1
+            while next_page < pages or futures:
+                while next_page < pages and len(futures) < parallel:
+                    futures.append(executor.submit(get_page, next_page))
+                    next_page += 1
+                for obj in futures.popleft().result()['imdata']:
+                    yield obj
+
     # Queries the fabric to retrieve information about the ports,
     # and returns them in a dictionary of dictionaries. The array is made in this way:
     #
@@ -3259,8 +4834,22 @@ class Query(object):
     # node_data[node_id]['ports'][intf]['descr']        
     # node_data[node_id]['swProf'][switchProf][swSel]              contains all swSelectors
     # node_data[node_id]['intProf'][intProf]                       --> father's switch profile
-    def query_ports (self):
+    #
+    # To avoid scanning all the nodes and ports for every object, a few
+    # indexes are built while the data is read:
+    #
+    # prof_nodes[switchProf] = set of the node IDs of the switch profile
+    # intProf_nodes[intProf] = set of the node IDs using the interface profile
+    # sel_ports[(intProf, intSel)] = list of (node_id, intf) selected
+    #
+    # The per-port dump at the end is printed if verbose is True, by default
+    # it depends on the PRINT_QUERY_PORTS global option.
+    def query_ports (self, verbose=None):
+        if verbose is None:
+            verbose = PRINT_QUERY_PORTS
         node_data = {}
+        prof_nodes = {}
+        sel_ports = {}
         query = '/api/node/class/infraNodeP.json?query-target=subtree&target-subtree-class=infraNodeBlk'
         [status, payload] = self.query_url(query)
         if status != 200:
@@ -3273,11 +4862,13 @@ class Query(object):
             # could be multiple switch selectors, not just one.
             #
             # uni/infra/nprof-<Leaf_Prof>/leaves-<Switch_Selector>-typ-range/nodeblk-1fd76fa26065f27f            
-            reg = re.search('nprof-(.*?)\/leaves-(.*?)-typ-range\/nodeblk', dn)
+            reg = NODE_BLK_DN.search(dn)
             switchProf = reg.group(1)
-            swSel = reg.group(2)
+            swSel = selector_name(reg.group(2))
             nodeFrom = (int)(obj['infraNodeBlk']['attributes']['from_'])
             nodeTo = (int)(obj['infraNodeBlk']['attributes']['to_'])
+            if not switchProf in prof_nodes:
+                prof_nodes[switchProf] = set()
             for node_id in range(nodeFrom, nodeTo+1):
                 if not node_id in node_data:
                     node_data[node_id] = {}
@@ -3287,7 +4878,11 @@ class Query(object):
                 if not switchProf in node_data[node_id]['swProf']:
                     node_data[node_id]['swProf'][switchProf] = {}
                 node_data[node_id]['swProf'][switchProf][swSel] = 1
+                prof_nodes[switchProf].add(node_id)
 
+        # the interface profiles are indexed as well, they get all the nodes
+        # of the switch profiles they are associated to.
+        intProf_nodes = {}
         query = '/api/node/class/infraNodeP.json?query-target=subtree&target-subtree-class=infraRsAccPortP'
         [status, payload] = self.query_url(query)
         if status != 200:
@@ -3298,84 +4893,103 @@ class Query(object):
             # here we obtain the relationship between the switch profile and the interface profile
             #
             # uni/infra/nprof-<Leaf_Prof>/rsaccPortP-[uni/infra/accportprof-<if_Prof>] 
-            reg = re.search('nprof-(.*?)\/.*\[uni/infra/accportprof-(.*)\]', dn)
+            reg = ACC_PORT_P_DN.search(dn)
             switchProf = reg.group(1)
             intProf = reg.group(2)
-            for node_id in node_data:
-                if switchProf in node_data[node_id]['swProf']:
-                    node_data[node_id]['intProf'][intProf] = switchProf
+            if not intProf in intProf_nodes:
+                intProf_nodes[intProf] = set()
+            for node_id in prof_nodes.get(switchProf, ()):
+                node_data[node_id]['intProf'][intProf] = switchProf
+                intProf_nodes[intProf].add(node_id)
 
         # From this query, you get the port ranges for all the interface selectors, the dn 
         # of the object contains also the interface profile to which the selectors belong to.
         #
         # uni/infra/accportprof-<if_Prof>/hports-<if_Selector>-typ-range/portblk-4e72096af1945b11
-        [status, payload] = self.query_class('infraPortBlk')
-        if status != 200:
+        # the class can be huge, objects are processed page by page
+        try:
+            for obj in self.iter_class('infraPortBlk'):
+                dn = obj['infraPortBlk']['attributes']['dn']
+                module = (int)(obj['infraPortBlk']['attributes']['fromCard'])
+                fromPort = (int)(obj['infraPortBlk']['attributes']['fromPort'])
+                toPort = (int)(obj['infraPortBlk']['attributes']['toPort'])
+                descr = obj['infraPortBlk']['attributes']['descr']
+                reg = PORT_SEL_DN.search(dn)
+                intProf = reg.group(1)
+                intSel = selector_name(reg.group(2))
+                if not (intProf, intSel) in sel_ports:
+                    sel_ports[(intProf, intSel)] = []
+                # only the nodes that have that intSelection profile get the ports
+                for node_id in intProf_nodes.get(intProf, ()):
+                    ports = node_data[node_id]['ports']
+                    for port_id in range(fromPort,toPort+1):
+                        port = str(module)+'/'+str(port_id)
+                        if not port in ports:
+                            ports[port] = {}
+                        ports[port]['intSel'] = intSel
+                        ports[port]['descr'] = descr
+                        ports[port]['intProf'] = intProf
+                        sel_ports[(intProf, intSel)].append((node_id, port))
+        except QueryFailed:
             return None
-        json_data = payload['imdata']
-        for obj in json_data:
-            dn = obj['infraPortBlk']['attributes']['dn']
-            module = (int)(obj['infraPortBlk']['attributes']['fromCard'])
-            fromPort = (int)(obj['infraPortBlk']['attributes']['fromPort'])
-            toPort = (int)(obj['infraPortBlk']['attributes']['toPort'])
-            descr = obj['infraPortBlk']['attributes']['descr']
-            reg = re.search('accportprof-(.*?)\/hports-(.*?)-typ-range\/portblk', dn)
-            intProf = reg.group(1)
-            intSel = reg.group(2)
-            # we now cycle on the nodes that have that intSelection profile, and add all the ports
-            for node_id in node_data:
-                for prof in node_data[node_id]['intProf']:
-                    if intProf == prof:
-                        # here all intProf should be there
-                        for port_id in range(fromPort,toPort+1):
-                            port = str(module)+'/'+str(port_id)
-                            if not port in node_data[node_id]['ports']:
-                                node_data[node_id]['ports'][port] = {}
-                            node_data[node_id]['ports'][port]['intSel'] = intSel
-                            node_data[node_id]['ports'][port]['descr'] = descr
-                            node_data[node_id]['ports'][port]['intProf'] = intProf
 
         # for every intSelector, we have the sum of the range of ports PLUS the policy group
         #
         # uni/infra/accportprof-<if_Prof>/hports-<if_Selector>-typ-range/rsaccBaseGrp
-        [status, payload] = self.query_class('infraRsAccBaseGrp')
-        if status != 200:
+        # the class can be huge, objects are processed page by page
+        try:
+            for obj in self.iter_class('infraRsAccBaseGrp'):
+                dn = obj['infraRsAccBaseGrp']['attributes']['dn']
+                reg = PORT_SEL_DN.search(dn)
+                intProf = reg.group(1)
+                intSel = selector_name(reg.group(2))
+                # uni/infra/funcprof/accbundle-<pol_Grp>
+                polGrp_dn = obj['infraRsAccBaseGrp']['attributes']['tDn']
+                reg = POL_GRP_DN.search(polGrp_dn)
+                polGrp = reg.group(2).strip()
+                if reg.group(1) == 'bundle':
+                    port_type = 'bundle'
+                else:
+                    port_type = 'access'
+
+                # a port could have been selected again by a later block of
+                # another selector, in this case it belongs to the last one.
+                for node_id, intf in sel_ports.get((intProf, intSel), ()):
+                    port = node_data[node_id]['ports'][intf]
+                    if port['intSel'] == intSel and port['intProf'] == intProf:
+                        port['polGrp'] = polGrp
+                        port['type'] = port_type
+        except QueryFailed:
             return None
-        json_data = payload['imdata']
-        for obj in json_data:
-            dn = obj['infraRsAccBaseGrp']['attributes']['dn']
-            reg = re.search('accportprof-(.*?)\/hports-(.*?)-typ-range', dn)
-            intProf = reg.group(1)
-            intSel = reg.group(2)
-            # uni/infra/funcprof/accbundle-<pol_Grp>
-            polGrp_dn = obj['infraRsAccBaseGrp']['attributes']['tDn']
-            reg = re.search('acc(bundle|portgrp)-(.*)', polGrp_dn)
-            polGrp = reg.group(2).strip()
-            if reg.group(1) == 'bundle':
-                port_type = 'bundle'
-            else:
-                port_type = 'access'
-    
-            for node_id in node_data:
-                for intf in node_data[node_id]['ports']:
-                    if node_data[node_id]['ports'][intf]['intSel'] == intSel:
-                        node_data[node_id]['ports'][intf]['polGrp'] = polGrp
-                        node_data[node_id]['ports'][intf]['type'] = port_type
-        # uncomment to print out all retrieved data
-        
+
+        if not verbose:
+            return node_data
+
+        logger = get_logger('aci.ports')
+        if not logger.isEnabledFor(logging.INFO):
+            return node_data
         for node_id in sorted(node_data):
             for intf in sorted(node_data[node_id]['ports']):
                 intProf = node_data[node_id]['ports'][intf]['intProf']
                 intSel = node_data[node_id]['ports'][intf]['intSel']
-                polGrp = node_data[node_id]['ports'][intf]['polGrp']
+                polGrp = node_data[node_id]['ports'][intf].get('polGrp', '')
                 descr = node_data[node_id]['ports'][intf]['descr']
-                port_type = node_data[node_id]['ports'][intf]['type']
+                port_type = node_data[node_id]['ports'][intf].get('type', '')
                 swProf = node_data[node_id]['intProf'][intProf]
-                print('Node '+str(node_id)+' interface "'+intf+'":')
-                print(' ---> selected by "'+intSel+'" is used by "'+intProf+'"')
-                print(' ---> "'+intProf+'\" is used by "'+swProf+'"')
-                print(' ---> "'+swProf+'" swSel sons are "'+(','.join(node_data[node_id]['swProf'][swProf]))+'"')
-                print(' ---> attached polGrp "'+polGrp+'" description "'+descr+'" mode "'+port_type+'"\n')
+                swSels = ','.join(node_data[node_id]['swProf'][swProf])
+                # a single record per port, with the data as fields
+                logger.info('Node %s interface "%s":\n'
+                            ' ---> selected by "%s" is used by "%s"\n'
+                            ' ---> "%s" is used by "%s"\n'
+                            ' ---> "%s" swSel sons are "%s"\n'
+                            ' ---> attached polGrp "%s" description "%s" mode "%s"\n',
+                            node_id, intf, intSel, intProf, intProf, swProf,
+                            swProf, swSels, polGrp, descr, port_type,
+                            extra={'fields': {'node': node_id, 'interface': intf,
+                                              'intSel': intSel, 'intProf': intProf,
+                                              'swProf': swProf, 'swSel': swSels,
+                                              'polGrp': polGrp, 'descr': descr,
+                                              'mode': port_type}})
         
         return node_data
     
@@ -3393,17 +5007,108 @@ class Query(object):
     # 
     # the third and fourth row are used to easily get the vrf to which a certain
     # BD is associated, without searching on the data tree built in the first row.
-    def query_all_tenants(self):
+    #
+    # Two modes are available, by default QUERY_TENANTS_MODE is used:
+    # 'classes': one query for every class in tenant_classes, the tenant and
+    #            the fathers of every object are read from the DN
+    # 'subtree': a single fvTenant query with rsp-subtree=full, the data is
+    #            read from the nested children, without parsing any DN
+    tenant_classes = ['fvCtx', 'fvAp', 'fvRsCtx', 'fvSubnet', 'fvAEPg']
+    tenant_subtree_classes = ['fvCtx', 'fvBD', 'fvRsCtx', 'fvSubnet', 'fvAp',
+                              'fvAEPg']
+
+    def query_all_tenants(self, mode=None):
+        if mode is None:
+            mode = QUERY_TENANTS_MODE
+        if mode == 'subtree':
+            [status, payload] = self.query_class('fvTenant',
+                '?rsp-subtree=full&rsp-subtree-class=' +
+                ','.join(self.tenant_subtree_classes))
+            if (status != 200):
+                return None
+            return self.build_tenants_subtree(payload['imdata'])
+        payloads = {}
+        for aci_class in self.tenant_classes:
+            [status, payload] = self.query_class(aci_class)
+            if (status != 200):
+                return None
+            payloads[aci_class] = payload['imdata']
+        return self.build_all_tenants(payloads)
+
+    # Same as query_all_tenants, but the five class queries are independent
+    # and are performed at the same time through the asyncio engine.
+    # In subtree mode there is a single query, which is simply awaited.
+    async def query_all_tenants_async(self, client=None, mode=None):
+        if client is None:
+            client = get_async_client(self.apic)
+        if (mode or QUERY_TENANTS_MODE) == 'subtree':
+            return await client.run(self.query_all_tenants, 'subtree')
+        results = await asyncio.gather(*[client.run(self.query_class, aci_class)
+                                         for aci_class in self.tenant_classes])
+        payloads = {}
+        for aci_class, [status, payload] in zip(self.tenant_classes, results):
+            if (status != 200):
+                return None
+            payloads[aci_class] = payload['imdata']
+        return self.build_all_tenants(payloads)
+
+    # Builds the apic_data dictionary from the fvTenant objects retrieved with
+    # rsp-subtree=full: every object is found under its father, so names are
+    # read from the attributes. Unlike the 'classes' mode, tenants without
+    # any vrf are also there, and the vrf of a BD can belong to another
+    # tenant (i.e. common), in this case it is added to the vrf_list too.
+    def build_tenants_subtree(self, tenants):
+        apic_data = {}
+        for tenant in tenants:
+            ten_name = tenant['fvTenant']['attributes']['name']
+            apic_data[ten_name] = {}
+            apic_data[ten_name]['vrf_list'] = {}
+            apic_data[ten_name]['anp_list'] = {}
+            apic_data[ten_name]['bd_list'] = {}
+            children = tenant['fvTenant'].get('children', [])
+            # vrf first, BDs are added under their vrf
+            for child in children:
+                if 'fvCtx' in child:
+                    vrf = child['fvCtx']['attributes']['name'].strip()
+                    apic_data[ten_name]['vrf_list'][vrf] = {}
+            for child in children:
+                if 'fvBD' in child:
+                    bd_name = child['fvBD']['attributes']['name']
+                    bd_children = child['fvBD'].get('children', [])
+                    vrf = None
+                    for bd_child in bd_children:
+                        if 'fvRsCtx' in bd_child:
+                            vrf = bd_child['fvRsCtx']['attributes']['tnFvCtxName'].strip()
+                    # as in 'classes' mode, only BDs with a vrf are considered
+                    if vrf is None:
+                        continue
+                    ips = [bd_child['fvSubnet']['attributes']['ip']
+                           for bd_child in bd_children if 'fvSubnet' in bd_child]
+                    if not vrf in apic_data[ten_name]['vrf_list']:
+                        apic_data[ten_name]['vrf_list'][vrf] = {}
+                    apic_data[ten_name]['vrf_list'][vrf][bd_name] = {}
+                    apic_data[ten_name]['vrf_list'][vrf][bd_name]['ip'] = list(ips)
+                    apic_data[ten_name]['bd_list'][bd_name] = {}
+                    apic_data[ten_name]['bd_list'][bd_name]['vrf'] = vrf
+                    apic_data[ten_name]['bd_list'][bd_name]['ip'] = list(ips)
+                elif 'fvAp' in child:
+                    app = child['fvAp']['attributes']['name'].strip()
+                    apic_data[ten_name]['anp_list'][app] = {}
+                    for ap_child in child['fvAp'].get('children', []):
+                        if 'fvAEPg' in ap_child:
+                            epg = ap_child['fvAEPg']['attributes']['name'].strip()
+                            apic_data[ten_name]['anp_list'][app][epg] = {}
+        return apic_data
+
+    # Builds the apic_data dictionary from the 'imdata' of every class
+    # in tenant_classes, the payloads dictionary is keyed by class name.
+    def build_all_tenants(self, payloads):
         apic_data = {}
         
         # TENANTS and VRF
-        [status, payload] = self.query_class('fvCtx')
-        if (status != 200):
-            return None
-        json_data = payload['imdata']
-        for obj in json_data:
+        for obj in payloads['fvCtx']:
             dn = obj['fvCtx']['attributes']['dn']
-            reg = re.search('\/tn-(.*?)\/ctx-(.*)', dn)
+            reg = CTX_DN.search(dn)
             ten_name = reg.group(1)
             vrf = reg.group(2).strip()
             if not ten_name in apic_data:
@@ -3414,29 +5119,22 @@ class Query(object):
             apic_data[ten_name]['vrf_list'][vrf]={}
         
         # APPLICATION PROFILES
-        [status, payload] = self.query_class('fvAp')
-        if (status != 200):
-            return None
-        json_data = payload['imdata']
-        for obj in json_data:
+        for obj in payloads['fvAp']:
             dn = obj['fvAp']['attributes']['dn']
-            reg = re.search('uni\/tn-(.*?)\/ap-(.*)', dn)
+            reg = AP_DN.search(dn)
             ten_name = reg.group(1)
             app = reg.group(2).strip()
             apic_data[ten_name]['anp_list'][app]={}
         
         # BRIDGE DOMAINS, we query all bridge domains for which a vrf has been configured
-        [status, payload] = self.query_class('fvRsCtx')
-        if (status != 200):
-            return None
-        json_data = payload['imdata']
-        for obj in json_data:
+        for obj in payloads['fvRsCtx']:
             dn = obj['fvRsCtx']['attributes']['dn']
-            reg = re.search('\/tn-(.*?)\/BD-(.*?)\/rsctx', dn)
+            reg = RS_CTX_DN.search(dn)
             ten_name = reg.group(1)
             bd_name = reg.group(2)
             tdn = obj['fvRsCtx']['attributes']['tDn']
-            vrf = re.search('uni\/tn-(.*?)\/ctx-(.*)', tdn).group(2).strip()
+            # the tDn of the relation is the same for all the BD of a vrf
+            vrf = parse_dn(tdn)['ctx'].strip()
             apic_data[ten_name]['vrf_list'][vrf][bd_name]={}
             # there can be multiple ip subnets associated to a BD
             apic_data[ten_name]['vrf_list'][vrf][bd_name]['ip'] = []
@@ -3446,38 +5144,26 @@ class Query(object):
             apic_data[ten_name]['bd_list'][bd_name]['ip'] = []
         
         # BRIDGE DOMAIN SUBNETS
-        [status, payload] = self.query_class('fvSubnet')
-        if (status != 200):
-            return None
-        json_data = payload['imdata']
-        for obj in json_data:
+        for obj in payloads['fvSubnet']:
             dn = obj['fvSubnet']['attributes']['dn']
             # uni/tn-<tn_name>/BD-<bd_name>/subnet-[<subnet>]
             # there are also the following objects, we skip them
             #  uni/tn-<tn_name>/ap-<anp_name>/epg-<epg_name>/subnet-[<subnet>]
-            reg = re.search('\/tn-(.*?)\/BD-(.*?)\/subnet-\[(.*)\]', dn)
-            if reg == None:
+            reg = BD_SUBNET_DN.search(dn)
+            if reg is None:
                 continue
-            ten_name = reg.group(1)
-            bd_name = reg.group(2)
-            ip = reg.group(3)
+            [ten_name, bd_name, ip] = reg.group(1, 2, 3)
             # here we easily retrieve the vrf associated to the bd
             vrf = apic_data[ten_name]['bd_list'][bd_name]['vrf']
             apic_data[ten_name]['vrf_list'][vrf][bd_name]['ip'].append(ip)
             apic_data[ten_name]['bd_list'][bd_name]['ip'].append(ip)
         
         # EPG
-        [status, payload] = self.query_class('fvAEPg')
-        if (status != 200):
-            return None
-        json_data = payload['imdata']
-        for obj in json_data:
+        for obj in payloads['fvAEPg']:
             dn = obj['fvAEPg']['attributes']['dn']
             # uni/tn-<tn_name>/ap-<anp_name>/epg-<epg_name>
-            reg = re.search('\/tn-(.*?)\/ap-(.*?)\/epg-(.*)', dn)
-            ten_name = reg.group(1)
-            anp_prof = reg.group(2)
-            epg = reg.group(3).strip()
+            [ten_name, anp_prof, epg] = EPG_DN.search(dn).group(1, 2, 3)
+            epg = epg.strip()
             apic_data[ten_name]['anp_list'][anp_prof][epg]={}
         '''
         for ten_name in apic_data:
@@ -3496,31 +5182,91 @@ class Query(object):
     # This function performs queries to the fabric and retrieves the configured
     # vPC, and return an hash where the key is the policy group applied to the
     # channel/vpc, and the value is its DN.
+    #
+    # All the fabricProtPathEpCont are retrieved together with their
+    # fabricPathEp children in a single (paged) query. In case it fails, every
+    # container is queried on its own: containers whose query fails are
+    # skipped with an error message, and the vPC of all the others are returned.
     def query_vpc (self):
+        vpc_dn = {}
+        try:
+            for res in self.iter_class('fabricProtPathEpCont',
+                                       '?rsp-subtree=children'
+                                       '&rsp-subtree-class=fabricPathEp'):
+                for elem in res['fabricProtPathEpCont'].get('children', []):
+                    dn = elem['fabricPathEp']['attributes']['dn']
+                    vpc_dn[PATHEP_DN.search(dn).group(1)] = dn
+            return vpc_dn
+        except QueryFailed as e:
+            print("vPC subtree query failed, querying every container. "
+                  "Error: {}".format(e))
+
         [status, payload] = self.query_url('/api/class/fabricProtPathEpCont.json')
         if status != 200:
             return None
         json_data = payload['imdata']
-        vpc_dn = {}
         for res in json_data:
             dn = res['fabricProtPathEpCont']['attributes']['dn']
             [status, payload] = self.query_url('/api/mo/'+dn+'.json?query-target=children')
             if status != 200:
-                return None
+                print("Failed to query vPC container {}, status {}".format(dn, status))
+                continue
             vpc_data = payload['imdata']
             for elem in vpc_data:
                 dn = elem['fabricPathEp']['attributes']['dn']
-                vpc_dn[re.search("pathep-\[(.*)\]",dn).group(1)] = dn
+                vpc_dn[PATHEP_DN.search(dn).group(1)] = dn
         return vpc_dn
-    
+
+    # Returns the set of the physical interfaces of the nodes, as (pod, node,
+    # interface id) tuples, i.e. ('1', '101', 'eth1/1'). nodes is a list of
+    # (pod, node) couples, the l1PhysIf of every node are retrieved with a
+    # single query, up to 'parallel' nodes at the same time. The nodes which
+    # can not be queried are printed and have no interfaces.
+    def query_phys_ifs(self, nodes, parallel=DEFAULT_CONCURRENCY):
+        def get_node(node):
+            return self.query_url('/api/mo/topology/pod-{}/node-{}.json'
+                                  '?query-target=subtree'
+                                  '&target-subtree-class=l1PhysIf'.format(*node))
+
+        phys_ifs = set()
+        nodes = sorted(set((str(pod), str(node)) for pod, node in nodes))
+        with concurrent.futures.ThreadPoolExecutor(max(1, parallel)) as executor:
+            for node, [status, payload] in zip(nodes,
+                                               executor.map(get_node, nodes)):
+                if status != 200:
+                    print("Failed to query the interfaces of pod {} node {}, "
+                          "status {}".format(node[0], node[1], status))
+                    continue
+                for obj in payload['imdata']:
+                    phys_ifs.add(node + (obj['l1PhysIf']['attributes']['id'],))
+        return phys_ifs
+
+    # Returns the EPG static paths indexed by (path, encap), where path is
+    # the pathep of the fvRsPathAtt (interface or bundle name):
+    #
+    # path_encaps[('eth1/1', 'vlan-10')] = [epg, ...]
+    #
+    # All the fvRsPathAtt are retrieved at once, returns None on failure.
+    def query_path_encaps(self):
+        path_encaps = {}
+        try:
+            for obj in self.iter_class('fvRsPathAtt'):
+                attributes = obj['fvRsPathAtt']['attributes']
+                reg = PATH_ATT_DN.search(attributes['dn'])
+                key = (reg.group(2).strip(), attributes['encap'])
+                path_encaps.setdefault(key, []).append(reg.group(1).strip())
+        except QueryFailed as e:
+            print("Failed to query fvRsPathAtt. Error: {}".format(e))
+            return None
+        return path_encaps
+
 # Class must be instantiated with APIC IP address and cookies
 class FabCfgMgmt(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabCfgMgmt/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabCfgMgmt')
 
     # Method must be called with the following kwargs. Note only supports
     # SCP at this time (could easily add SFTP or FTP if needed though)
@@ -3552,7 +5298,8 @@ class FabCfgMgmt(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/path-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3578,7 +5325,8 @@ class FabCfgMgmt(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/configexp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3599,7 +5347,8 @@ class FabCfgMgmt(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/configimp-{}'.format(templateVars['name'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3617,18 +5366,18 @@ class FabCfgMgmt(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/fabric/configimp-default'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class FabAdminMgmt(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabAdminMgmt/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabAdminMgmt')
 
     # Method must be called with the following kwargs.
     # user: Username for user to be created/modified
@@ -3651,7 +5400,8 @@ class FabAdminMgmt(object):
         payload = template.render(templateVars)
 
         uri = 'mo/uni/userext/user-{}'.format(templateVars['user'])
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3685,7 +5435,8 @@ class FabAdminMgmt(object):
 
         payload = template.render(templateVars)
         uri = 'mo/uni/tn-mgmt'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3712,7 +5463,8 @@ class FabAdminMgmt(object):
 
         payload = template.render(templateVars)
         uri = 'mo/uni/tn-mgmt'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3735,7 +5487,8 @@ class FabAdminMgmt(object):
 
         payload = template.render(templateVars)
         uri = 'mo/uni/tn-mgmt'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3758,7 +5511,8 @@ class FabAdminMgmt(object):
 
         payload = template.render(templateVars)
         uri = 'mo/uni/tn-mgmt'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3792,18 +5546,18 @@ class FabAdminMgmt(object):
 
         payload = template.render(templateVars)
         uri = 'mo/uni/tn-mgmt'
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class FabVMM(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'FabVMM/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('FabVMM')
 
     # Method must be called with the following kwargs.
     # name: The name of the VMware VMM Domain to create
@@ -3835,7 +5589,8 @@ class FabVMM(object):
         uri = ('mo/uni/vmmp-VMware/dom-{}'
                .format(templateVars['name']))
 
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3861,7 +5616,8 @@ class FabVMM(object):
         uri = ('mo/uni/infra/attentp-{}'
                .format(templateVars['aep']))
 
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3887,18 +5643,18 @@ class FabVMM(object):
         uri = ('mo/uni/vmmp-VMware/dom-{}'
                .format(templateVars['name']))
 
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
 
 # Class must be instantiated with APIC IP address and cookies
 class Mpod(object):
-    def __init__(self, apic, cookies):
+    def __init__(self, apic, cookies, conn=None):
         self.apic = apic
         self.cookies = cookies
-        self.templateLoader = jinja2.FileSystemLoader(
-            searchpath=(json_path + 'Mpod/'))
-        self.templateEnv = jinja2.Environment(loader=self.templateLoader)
+        self.conn = conn if conn is not None else get_connection(apic)
+        self.templateEnv = template_registry.section('Mpod')
 
     # Method must be called with the following kwargs.
     # name: name of the spine policy group
@@ -3926,7 +5682,8 @@ class Mpod(object):
 
         uri = ('mo/uni/infra/funcprof/spaccportgrp-{}'
                .format(templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -3976,7 +5733,8 @@ class Mpod(object):
 
         uri = ('mo/uni/infra/spaccportprof-{}'
                .format(templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -4009,7 +5767,8 @@ class Mpod(object):
 
         uri = ('mo/uni/infra/spprof-{}'
                .format(templateVars['name']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -4038,7 +5797,8 @@ class Mpod(object):
 
         uri = ('mo/uni/controller/setuppol/setupp-{}'
                .format(templateVars['pod_id']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -4079,7 +5839,8 @@ class Mpod(object):
 
         uri = ('mo/uni/tn-infra/fabricExtConnP-{}'
                .format(templateVars['conn_id']))
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
 
     # Method must be called with the following kwargs.
@@ -4124,5 +5885,6 @@ class Mpod(object):
         payload = template.render(templateVars)
 
         uri = ('mo/uni/tn-infra/out-multipod')
-        status = post(self.apic, payload, self.cookies, uri, template_file)
+        status = post(self.apic, payload, self.cookies, uri, template_file,
+                      self.conn)
         return status
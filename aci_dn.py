@@ -0,0 +1,133 @@
+# DN parsing for the ACI objects, used by the toolkit and the scripts in place
+# of the many re.search calls on every DN. A DN is split in its RN, and every
+# RN in a (class prefix, key) couple:
+#
+#   uni/tn-Tenant/BD-Vlan10_BD/subnet-[10.0.0.1/24]
+#   --> ('uni', ''), ('tn', 'Tenant'), ('BD', 'Vlan10_BD'), ('subnet', '10.0.0.1/24')
+#
+# Brackets are honoured, the slashes inside 'pathep-[eth1/1]' are not RN
+# separators, and keys fully enclosed in brackets are returned without them.
+# Keys that are DN themselves (rsaccPortP-[uni/infra/accportprof-...]) can be
+# parsed again with parse_dn. Parsed DN are kept in a LRU cache, since the
+# same DN are usually parsed many times (i.e. tDn of relations).
+#
+#   dn = parse_dn('uni/tn-Tenant/ap-App/epg-Web')
+#   dn['tn'], dn['ap'], dn['epg']        --> 'Tenant', 'App', 'Web'
+#   dn.get('BD')                         --> None
+#
+# The loops over the objects of a class parse every DN only once, the cache
+# would always miss there and parsing all the RN is slower than a regular
+# expression: they use the compiled expressions below, single pass.
+import functools
+import re
+
+# Number of parsed DN kept in the LRU cache
+DN_CACHE_SIZE = 65536
+
+
+# Returns the list of the RN of a DN, brackets are honoured so that the
+# slashes inside 'pathep-[eth1/1]' are not considered RN separators.
+def split_dn(dn):
+    if '[' not in dn:
+        return dn.split('/')
+    # the pieces of an RN split inside brackets are joined back, until the
+    # brackets are balanced again
+    rns = []
+    pending = None
+    depth = 0
+    for piece in dn.split('/'):
+        if pending is None:
+            pending = piece
+        else:
+            pending += '/' + piece
+        depth += piece.count('[') - piece.count(']')
+        if depth == 0:
+            rns.append(pending)
+            pending = None
+    if pending is not None:
+        rns.append(pending)
+    return rns
+
+
+# Returns the (class prefix, key) of a RN, i.e. ('tn', 'Tenant') for
+# 'tn-Tenant' and ('rsctx', '') for 'rsctx'.
+def split_rn(rn):
+    prefix, sep, key = rn.partition('-')
+    if key[:1] == '[' and key[-1:] == ']':
+        key = key[1:-1]
+    return (prefix, key)
+
+
+# Compiled expressions of the DN read by the loops over the objects of a
+# class (Query.query_ports, build_all_tenants, query_vpc and
+# query_path_encaps), where every DN is parsed only once. Names never contain
+# a slash, keys in brackets are DN or addresses.
+NODE_BLK_DN = re.compile(r'/nprof-([^/]*)/leaves-([^/]*)/nodeblk-')
+ACC_PORT_P_DN = re.compile(r'/nprof-([^/]*)/rsaccPortP-\[.*/accportprof-([^/]*)\]$')
+# infraPortBlk and infraRsAccBaseGrp
+PORT_SEL_DN = re.compile(r'/accportprof-([^/]*)/hports-([^/]*)/')
+POL_GRP_DN = re.compile(r'/acc(bundle|portgrp)-([^/]*)$')
+CTX_DN = re.compile(r'/tn-([^/]*)/ctx-([^/]*)$')
+AP_DN = re.compile(r'/tn-([^/]*)/ap-([^/]*)$')
+RS_CTX_DN = re.compile(r'/tn-([^/]*)/BD-([^/]*)/rsctx$')
+# the subnets of the EPG do not match
+BD_SUBNET_DN = re.compile(r'/tn-([^/]*)/BD-([^/]*)/subnet-\[(.*)\]$')
+EPG_DN = re.compile(r'/tn-([^/]*)/ap-([^/]*)/epg-([^/]*)$')
+PATH_ATT_DN = re.compile(r'/epg-([^/]*)/rspathAtt-\[.*/pathep-\[(.*)\]\]$')
+PATHEP_DN = re.compile(r'/pathep-\[(.*)\]$')
+
+
+# Returns the name of an interface or switch selector from the key of its RN,
+# i.e. 'Sel_1' for 'hports-Sel_1-typ-range'. The RN is '<name>-typ-<type>',
+# only the last '-typ-' is the separator: a name containing '-typ-' is kept
+# whole (the regular expressions used before split the rsaccBaseGrp DN at the
+# first '-typ-range' and the portblk ones at the last one).
+def selector_name(key):
+    return key.rpartition('-typ-')[0] or key
+
+
+class Dn(object):
+    __slots__ = ('dn', 'rns', 'keys')
+
+    def __init__(self, dn):
+        self.dn = dn
+        rns = []
+        # the first key of every prefix, prefixes are rarely repeated in a DN
+        keys = {}
+        for rn in split_dn(dn):
+            prefix, key = split_rn(rn)
+            rns.append((prefix, key))
+            if prefix not in keys:
+                keys[prefix] = key
+        self.rns = tuple(rns)
+        self.keys = keys
+
+    # Returns the key of the first RN with that class prefix, or default
+    def get(self, prefix, default=None):
+        return self.keys.get(prefix, default)
+
+    def __getitem__(self, prefix):
+        return self.keys[prefix]
+
+    def __contains__(self, prefix):
+        return prefix in self.keys
+
+    # Class prefix of the last RN, i.e. 'subnet' for a BD subnet
+    @property
+    def prefix(self):
+        return self.rns[-1][0]
+
+    @property
+    def parent(self):
+        return '/'.join(split_dn(self.dn)[:-1])
+
+    def __str__(self):
+        return self.dn
+
+    def __repr__(self):
+        return 'Dn({!r})'.format(self.dn)
+
+
+@functools.lru_cache(maxsize=DN_CACHE_SIZE)
+def parse_dn(dn):
+    return Dn(dn)
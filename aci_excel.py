@@ -0,0 +1,135 @@
+# Excel ingestion for the scripts: the workbook is opened in read-only mode
+# and every row is read only once, as a tuple of values, then parsed into a
+# compact row record. Columns are found by their name in the first line, so
+# they can be swapped and new columns (also beyond 'Z') can be inserted.
+#
+# The cells are never changed while reading: colors and the values filled
+# by the scripts are collected by a SheetWriter, which applies them to a
+# copy of the workbook in a separate step at the end.
+#
+#   rows = read_vlan_rows(excel_dir + file_name, 'ACI translate')
+#   writer = SheetWriter(excel_dir + file_name, 'ACI translate')
+#   for xls in rows:
+#       writer.color(status, xls.row, 'tenant')
+#   writer.save(out_file)
+import re
+import openpyxl
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+
+# yellow: no need to perform the query, green: ok, red: failure
+COLOR_SKIPPED = 'FFFF00'
+COLOR_OK = '00FF00'
+COLOR_FAILED = 'FF1100'
+
+
+# Returns the value of a cell as a stripped string, None if it is empty
+def cell_text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value if value != '' else None
+
+
+# Returns a dictionary with the index of every column, from its name in
+# the first line, and an iterator on the (row number, values) of the other
+# lines. Completely empty lines are skipped.
+def read_sheet(file_name, sheet_name):
+    workbook = openpyxl.load_workbook(file_name, read_only=True, data_only=True)
+    sheet = workbook[sheet_name]
+    lines = sheet.iter_rows(values_only=True)
+    header = next(lines, ())
+    columns = {}
+    for index, name in enumerate(header):
+        if name is not None:
+            columns[str(name).strip()] = index
+
+    def rows():
+        try:
+            for row, values in enumerate(lines, 2):
+                if any(value is not None for value in values):
+                    yield (row, values)
+        finally:
+            workbook.close()
+    return (columns, rows())
+
+
+# A line of the 'ACI translate' sheet. Empty cells are None, the other
+# ones are stripped strings; vlan_id is the number in 'Vlan<id>' (None if
+# the vlan_number is wrong) and interfaces the list of the lines of the
+# interfaces cell.
+class VlanRow(object):
+    __slots__ = ('row', 'apparato', 'tenant', 'vrf', 'vlan_number', 'vlan_id',
+                 'l2_vlan_name', 'app_profile', 'epg', 'ip_addr', 'route_type',
+                 'descr', 'interfaces')
+    fields = ('apparato', 'tenant', 'vrf', 'vlan_number', 'l2_vlan_name',
+              'app_profile', 'epg', 'ip_addr', 'route_type', 'descr')
+
+    def __init__(self, row, values, columns):
+        self.row = row
+        for field in self.fields:
+            index = columns.get(field)
+            value = values[index] if index is not None and index < len(values) \
+                else None
+            setattr(self, field, cell_text(value))
+        self.vlan_id = None
+        if self.vlan_number is not None:
+            reg = re.search(r'Vlan(\d+)', self.vlan_number)
+            if reg:
+                self.vlan_id = reg.group(1)
+        index = columns.get('interfaces')
+        interfaces = values[index] if index is not None and index < len(values) \
+            else None
+        interfaces = cell_text(interfaces)
+        self.interfaces = interfaces.splitlines() if interfaces else []
+
+    def __repr__(self):
+        return 'VlanRow({})'.format(', '.join(
+            '{}={!r}'.format(field, getattr(self, field))
+            for field in ('row',) + self.fields))
+
+
+# Returns the list of the VlanRow of the sheet
+def read_vlan_rows(file_name, sheet_name):
+    [columns, rows] = read_sheet(file_name, sheet_name)
+    return [VlanRow(row, values, columns) for row, values in rows]
+
+
+# Collects the colors and the values to be written on the sheet, and
+# applies them all when the output file is saved.
+class SheetWriter(object):
+    def __init__(self, file_name, sheet_name):
+        self.file_name = file_name
+        self.sheet_name = sheet_name
+        # (row, column name) -> color or value
+        self.colors = {}
+        self.values = {}
+
+    # status None means that no query was needed (yellow), 200 a successful
+    # query (green), anything else a failure (red)
+    def color(self, status, row, column):
+        if status is None:
+            self.colors[(row, column)] = COLOR_SKIPPED
+        elif status == 200:
+            self.colors[(row, column)] = COLOR_OK
+        else:
+            self.colors[(row, column)] = COLOR_FAILED
+
+    def set_value(self, row, column, value):
+        self.values[(row, column)] = value
+
+    # Writes the collected changes on a copy of the workbook, columns are
+    # found by name as in read_sheet
+    def save(self, out_file):
+        workbook = openpyxl.load_workbook(self.file_name)
+        sheet = workbook[self.sheet_name]
+        letters = {}
+        for cell in sheet[1]:
+            if cell.value is not None:
+                letters[str(cell.value).strip()] = get_column_letter(cell.column)
+        for (row, column), value in self.values.items():
+            sheet[letters[column] + str(row)].value = value
+        for (row, column), color in self.colors.items():
+            sheet[letters[column] + str(row)].fill = PatternFill(
+                'solid', fgColor=color)
+        workbook.save(out_file)
@@ -0,0 +1,86 @@
+# Checkpoint journal of a push run, so that an interrupted run can be
+# resumed without pushing again what has already been committed. The
+# journal is an append-only file of json lines, written and flushed one
+# line at a time:
+#
+#   {"planned": ["tenant", "T1"]}                every object to be pushed
+#   {"key": ["tenant", "T1"], "status": 200}     the result of every push
+#
+# Objects are identified by the keys of the PushScheduler tasks (tuples,
+# saved as json lists). The planned objects are written once, when a new
+# run starts: a resumed run pushes only the planned objects which have not
+# been committed (status 200) yet, objects never planned were already on
+# the APIC at the first run.
+import json
+import os
+import threading
+import time
+
+
+# json turns tuples into lists, keys must be tuples again to be hashable
+def key_from_json(key):
+    if isinstance(key, list):
+        return tuple(key_from_json(item) for item in key)
+    return key
+
+
+class PushJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self.planned = set()
+        # key -> last status recorded
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Reads the journal of a previous run. A last line truncated by a crash
+    # is ignored.
+    def load(self):
+        if not self.exists():
+            return self
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if 'planned' in entry:
+                    self.planned.add(key_from_json(entry['planned']))
+                elif 'key' in entry:
+                    self.statuses[key_from_json(entry['key'])] = entry['status']
+        return self
+
+    # Opens the journal for writing: a new run starts from an empty journal,
+    # a resumed one appends to it
+    def open(self, resume=False):
+        if not resume:
+            self.planned = set()
+            self.statuses = {}
+        self.file = open(self.path, 'a' if resume else 'w')
+        return self
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def plan(self, keys):
+        for key in keys:
+            if key not in self.planned:
+                self.planned.add(key)
+                self.write({'planned': key})
+
+    def record(self, key, status):
+        self.statuses[key] = status
+        self.write({'key': key, 'status': status, 'time': round(time.time(), 3)})
+
+    def committed(self, key):
+        return self.statuses.get(key) == 200
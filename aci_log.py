@@ -0,0 +1,152 @@
+# Logging of the toolkit: the payloads posted, the answers of the failed
+# requests, the retries, failovers and token renewals of the connections and
+# the per-port dump of Query.query_ports go through the 'aci' loggers instead
+# of print, so that a bulk run is not slowed down by the console. The records
+# are:
+#
+# - filtered by level: payloads and port dumps are INFO, answers of failed
+#   requests, retries, failovers and token renewals WARNING, exceptions
+#   ERROR; below the level nothing is formatted
+# - sampled: only one payload out of 'payload_sample' is logged
+# - written by a background thread, the caller only puts the record in a
+#   queue: payloads are formatted (json.dumps) by the writer, not by the run
+# - written on the console as before, and optionally as json lines in a file
+#   with their structured fields (uri, payload, node, port ...)
+#
+#   setup(level='INFO', log_file='run.jsonl', payload_sample=10)
+#   logging.getLogger('aci.payload').info('...', extra={'payload': payload})
+#
+# The console output follows sys.stdout, also when it is redirected after the
+# setup. Records are written in order, but they can be printed after later
+# output of the script not going through the loggers: flush() waits for all
+# the records queued to be written.
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Fields of the records written in the json lines, when they are there
+RECORD_FIELDS = ('uri', 'status', 'payload', 'fields')
+
+configured = False
+listener = None
+log_queue = None
+
+
+# Keeps one record out of 'rate' among the ones of the logger it is added to
+class Sampler(logging.Filter):
+    def __init__(self, rate=1):
+        logging.Filter.__init__(self)
+        self.rate = max(1, rate)
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return next(self.counter) % self.rate == 0
+
+
+# Writes on the current sys.stdout, not on the one of the setup
+class ConsoleHandler(logging.StreamHandler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+# The message, followed by the payload as the toolkit has always printed it
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        payload = getattr(record, 'payload', None)
+        if payload is None:
+            return message
+        if not isinstance(payload, str):
+            payload = json.dumps(payload, indent=4)
+        return message + '\n' + payload
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': round(record.created, 3),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        for field in RECORD_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+# The standard QueueHandler formats the record in the thread of the caller,
+# here it is left to the writer thread. The arguments of the records (i.e.
+# the payloads) must not be modified once logged.
+class BackgroundHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Configures the 'aci' loggers, it can be called again to change the
+# configuration. level is a name or a logging level, log_file the json lines
+# file (appended, None for none), payload_sample the sampling rate of the
+# 'aci.payload' logger. With background=False records are written by the
+# caller.
+def setup(level='INFO', log_file=None, payload_sample=1, background=True):
+    global configured, listener, log_queue
+    stop()
+    logger = logging.getLogger('aci')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(level)
+    logger.propagate = False
+    handlers = [ConsoleHandler()]
+    handlers[0].setFormatter(ConsoleFormatter())
+    if log_file is not None:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+        handlers[-1].setFormatter(JsonFormatter())
+    if background:
+        log_queue = queue.Queue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers)
+        listener.start()
+        logger.addHandler(BackgroundHandler(log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+    payload_logger = logging.getLogger('aci.payload')
+    payload_logger.filters = []
+    if payload_sample > 1:
+        payload_logger.addFilter(Sampler(payload_sample))
+    if not configured:
+        atexit.register(stop)
+    configured = True
+    return logger
+
+
+# Waits for the records queued to be written
+def flush():
+    if log_queue is not None:
+        log_queue.join()
+    for handler in logging.getLogger('aci').handlers:
+        handler.flush()
+
+
+# Writes the records still queued and stops the writer thread
+def stop():
+    global listener, log_queue
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+        log_queue = None
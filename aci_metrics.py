@@ -0,0 +1,283 @@
+# Metrics exporter for the long running jobs (push runs, fabric_runner,
+# subscriptions): the requests toward the APIC and the push batches are
+# counted as they happen and served on a local HTTP port, to be scraped by
+# Prometheus or any OpenMetrics collector. Only the standard library is used,
+# there is nothing to install.
+#
+#   aci_requests_total{apic,method,aci_class,template}   requests, by the class
+#                                                         and json template
+#   aci_request_errors_total{apic,status}                 requests not answered
+#                                                         200 ('exception' if
+#                                                         no answer at all)
+#   aci_request_retries_total{apic}                       retries (429, 5xx,
+#                                                         expired tokens ...)
+#   aci_request_sent_bytes_total{apic}                    payloads posted
+#   aci_request_received_bytes_total{apic}                answers received
+#   aci_request_duration_seconds{method,aci_class}        latency histogram
+#   aci_mit_cache_hits_total / _misses_total              MIT snapshot cache
+#   aci_mit_cache_objects                                 objects in the cache
+#   aci_batches_in_flight{kind}                           FabBatch.commit and
+#                                                         PushScheduler.run
+#                                                         running right now
+#   aci_batch_objects_total{kind}                         objects pushed by them
+#   aci_batch_duration_seconds{kind}                      their duration
+#
+# The exporter is fed by the request and batch hooks of Aci_Cal_Toolkit.py,
+# it is started by FabLogin.login when METRICS_PORT is set in the toolkit, or
+# explicitly:
+#
+#   exporter = start_exporter(9464)
+#   ... curl http://127.0.0.1:9464/metrics
+#
+# The Prometheus text format is served by default, the OpenMetrics one when
+# the scraper asks for it in the Accept header.
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Aci_Cal_Toolkit import add_request_hook, remove_request_hook, \
+    add_batch_hook, remove_batch_hook, mit_cache
+
+# The usual port of the exporters of this kind, 0 picks a free one
+DEFAULT_PORT = 9464
+# Only local scrapers by default, '0.0.0.0' to be scraped from elsewhere
+DEFAULT_HOST = '127.0.0.1'
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# Upper bounds (seconds) of the buckets of the batch duration histograms
+BATCH_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')) for name, value in pairs) + '}'
+
+
+# The metrics are not thread safe by themselves, the exporter updates and
+# renders them under its lock. Values are kept by the tuple of the values of
+# their labels.
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, key=(), value=1):
+        self.values[key] = self.values.get(key, 0) + value
+
+    # The name of the metric family in the Prometheus text format, the
+    # OpenMetrics one has no '_total'
+    def family(self, openmetrics):
+        return self.name if openmetrics else self.name + '_total'
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name + '_total', list(zip(self.labels, key)), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, key=(), value=0):
+        self.values[key] = value
+
+    def family(self, openmetrics):
+        return self.name
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Counter.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # values: key -> [count of every bucket and of +Inf, sum]
+    def observe(self, key, value):
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def family(self, openmetrics):
+        return self.name
+
+    def samples(self):
+        for key, counts in self.values.items():
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       pairs + [('le', format_value(bound))], cumulative)
+            yield self.name + '_count', pairs, cumulative
+            yield self.name + '_sum', pairs, counts[-1]
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    exporter = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' in \
+            self.headers.get('Accept', '')
+        data = self.exporter.render(openmetrics).encode()
+        self.send_response(200)
+        self.send_header('Content-Type',
+                         OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsExporter(object):
+    def __init__(self, port=DEFAULT_PORT, host=DEFAULT_HOST, cache=None):
+        self.port = port
+        self.host = host
+        self.cache = cache if cache is not None else mit_cache
+        self.server = None
+        self.lock = threading.Lock()
+        self.requests = Counter('aci_requests', 'Requests toward the APIC',
+                                ('apic', 'method', 'aci_class', 'template'))
+        self.errors = Counter('aci_request_errors',
+                              'Requests not answered with HTTP 200',
+                              ('apic', 'status'))
+        self.retries = Counter('aci_request_retries',
+                               'Requests sent again after a failure', ('apic',))
+        self.sent = Counter('aci_request_sent_bytes',
+                            'Bytes of the payloads posted', ('apic',))
+        self.received = Counter('aci_request_received_bytes',
+                                'Bytes of the answers received', ('apic',))
+        self.latency = Histogram('aci_request_duration_seconds',
+                                 'Duration of the requests, retries included',
+                                 ('method', 'aci_class'))
+        self.cache_hits = Counter('aci_mit_cache_hits',
+                                  'Class queries served by the MIT cache')
+        self.cache_misses = Counter('aci_mit_cache_misses',
+                                    'Class queries not found in the MIT cache')
+        self.cache_objects = Gauge('aci_mit_cache_objects',
+                                   'Objects kept in the MIT cache')
+        self.in_flight = Gauge('aci_batches_in_flight',
+                               'Push batches running', ('kind',))
+        self.batch_objects = Counter('aci_batch_objects',
+                                     'Objects of the push batches', ('kind',))
+        self.batch_latency = Histogram('aci_batch_duration_seconds',
+                                       'Duration of the push batches',
+                                       ('kind',), BATCH_BUCKETS)
+        self.metrics = [self.requests, self.errors, self.retries, self.sent,
+                        self.received, self.latency, self.cache_hits,
+                        self.cache_misses, self.cache_objects, self.in_flight,
+                        self.batch_objects, self.batch_latency]
+
+    # Request hook, see RequestInfo
+    def on_request(self, info):
+        with self.lock:
+            self.requests.inc((info.apic, info.method, info.aci_class or '',
+                               info.template or ''))
+            if info.error is not None or info.status != 200:
+                self.errors.inc((info.apic, str(info.status)
+                                 if info.status is not None else 'exception'))
+            if info.retries:
+                self.retries.inc((info.apic,), info.retries)
+            self.sent.inc((info.apic,), info.payload_bytes)
+            self.received.inc((info.apic,), info.response_bytes or 0)
+            self.latency.observe((info.method, info.aci_class or ''),
+                                 info.latency)
+
+    # Batch hooks
+    def on_batch_start(self, kind, objects):
+        with self.lock:
+            self.in_flight.inc((kind,))
+
+    def on_batch_end(self, kind, objects, elapsed):
+        with self.lock:
+            self.in_flight.inc((kind,), -1)
+            self.batch_objects.inc((kind,), objects)
+            self.batch_latency.observe((kind,), elapsed)
+
+    # The cache keeps its own counters, they are read at every scrape
+    def collect(self):
+        self.cache_hits.values[()] = self.cache.hits
+        self.cache_misses.values[()] = self.cache.misses
+        self.cache_objects.values[()] = self.cache.objects
+
+    def render(self, openmetrics=False):
+        lines = []
+        with self.lock:
+            self.collect()
+            for metric in self.metrics:
+                family = metric.family(openmetrics)
+                lines.append('# HELP {} {}'.format(family, metric.help))
+                lines.append('# TYPE {} {}'.format(family, metric.kind))
+                for name, pairs, value in metric.samples():
+                    lines.append('{}{} {}'.format(name, format_labels(pairs),
+                                                  format_value(value)))
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    # Registers the hooks and serves the metrics from a daemon thread,
+    # returns the url of the metrics
+    def start(self):
+        handler = type('MetricsHandler', (MetricsHandler,), {'exporter': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        add_request_hook(after=self.on_request)
+        add_batch_hook(after=self.on_batch_end, before=self.on_batch_start)
+        return self.url()
+
+    def url(self):
+        return 'http://{}:{}/metrics'.format(self.host, self.port)
+
+    def stop(self):
+        remove_request_hook(self.on_request)
+        remove_batch_hook(self.on_batch_start)
+        remove_batch_hook(self.on_batch_end)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+exporter = None
+
+
+# Starts the exporter of the process, once: the following calls return
+# the one already running
+def start_exporter(port=DEFAULT_PORT, host=DEFAULT_HOST):
+    global exporter
+    if exporter is None:
+        exporter = MetricsExporter(port, host)
+        exporter.start()
+    return exporter
@@ -0,0 +1,179 @@
+# Dependency-aware scheduler for the configuration pushes. Every object to
+# be configured is a task identified by a key, with the keys of the objects
+# it depends on (i.e. an EPG depends on its BD and application profile, a BD
+# on its vrf, a vrf on its tenant). Adding the same key twice returns the
+# task already there, so objects shared by many rows are pushed only once.
+#
+# Tasks are run by a thread pool as soon as all their dependencies have been
+# pushed successfully, with at most 'concurrency' pushes in flight and at
+# most 'group_limit' in flight for the same group (the tenant). Ready tasks
+# are always started in the order they were added. When a task fails, the
+# tasks depending on it are not run and get the SKIPPED status.
+#
+#   sched = PushScheduler(concurrency=8)
+#   sched.add(('tenant', 'T1'), tnConf.tenant, group='T1', name='T1', status='created')
+#   sched.add(('vrf', 'T1', 'VRF'), tnConf.vrf, depends=[('tenant', 'T1')],
+#             group='T1', tn_name='T1', name='VRF', ...)
+#   statuses = sched.run()
+#
+# Dependencies on keys which are not tasks (objects already on the APIC)
+# are considered satisfied.
+#
+# With a PushJournal (see aci_journal.py) all the tasks are written in the
+# journal before starting, and the status of every push as soon as it
+# completes. A resumed run (resume=True) does not push again the tasks the
+# journal records as committed, and drops the tasks which were not planned
+# by the first run (the objects were already on the APIC).
+import concurrent.futures
+import heapq
+from Aci_Cal_Toolkit import DEFAULT_CONCURRENCY, start_batch, end_batch
+
+# Status of the tasks not run because a dependency failed
+SKIPPED = 0
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class PushTask(object):
+    __slots__ = ('key', 'func', 'kwargs', 'depends', 'group', 'seq', 'status')
+
+    def __init__(self, key, func, kwargs, depends, group, seq):
+        self.key = key
+        self.func = func
+        self.kwargs = kwargs
+        self.depends = depends
+        self.group = group
+        self.seq = seq
+        self.status = None
+
+
+class PushScheduler(object):
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, group_limit=None,
+                 journal=None, resume=False):
+        self.concurrency = concurrency
+        self.group_limit = group_limit
+        self.journal = journal
+        self.resume = resume
+        self.tasks = {}
+        # number of tasks not pushed again, as committed in the journal
+        self.resumed = 0
+
+    # Adds a task, func(**kwargs) must return the status of the push.
+    # Returns the key; if the key is already there the task is not added
+    # again (the first one wins).
+    def add(self, key, func, depends=(), group=None, **kwargs):
+        if key not in self.tasks:
+            self.tasks[key] = PushTask(key, func, kwargs, list(depends), group,
+                                       len(self.tasks))
+        return key
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    # Status of a task after run(), None if there is no such task
+    def status(self, key):
+        task = self.tasks.get(key)
+        return task.status if task is not None else None
+
+    def execute(self, task):
+        try:
+            status = task.func(**task.kwargs)
+        except Exception as e:
+            print("Push of {} failed. Exception: {}".format(task.key, e))
+            status = 666
+        if self.journal is not None:
+            self.journal.record(task.key, status)
+        return status
+
+    # Applies the journal before running: the plan of a new run is written,
+    # a resumed run forgets the tasks not planned and marks the committed ones
+    def apply_journal(self):
+        if self.journal is None:
+            return
+        if not self.resume:
+            self.journal.plan(sorted(self.tasks, key=lambda k: self.tasks[k].seq))
+            return
+        for key in list(self.tasks):
+            if key not in self.journal.planned:
+                del self.tasks[key]
+        for task in self.tasks.values():
+            if self.journal.committed(task.key):
+                task.func = None
+                self.resumed += 1
+
+    # Runs all the tasks, returns a dictionary key -> status
+    def run(self):
+        self.apply_journal()
+        start = start_batch('PushScheduler', len(self.tasks))
+        try:
+            return self.run_tasks()
+        finally:
+            end_batch('PushScheduler', len(self.tasks), start)
+
+    def run_tasks(self):
+        waiting = {}
+        dependents = {}
+        for task in self.tasks.values():
+            depends = [key for key in task.depends if key in self.tasks]
+            waiting[task.key] = len(depends)
+            for key in depends:
+                dependents.setdefault(key, []).append(task)
+        ready = [(task.seq, task.key) for task in self.tasks.values()
+                 if waiting[task.key] == 0]
+        heapq.heapify(ready)
+        # tasks which can not start yet because their group is full
+        parked = []
+        in_flight = {}
+        groups = {}
+        done = 0
+
+        def finish(task, status):
+            task.status = status
+            for child in dependents.get(task.key, []):
+                waiting[child.key] -= 1
+                if status != 200:
+                    # the failure is propagated once all the dependencies
+                    # of the child are known
+                    child.status = SKIPPED
+                if waiting[child.key] == 0:
+                    heapq.heappush(ready, (child.seq, child.key))
+
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            while done < len(self.tasks):
+                while ready and len(in_flight) < self.concurrency:
+                    task = self.tasks[heapq.heappop(ready)[1]]
+                    if task.status == SKIPPED:
+                        finish(task, SKIPPED)
+                        done += 1
+                        continue
+                    if task.func is None:
+                        # committed by a previous run
+                        finish(task, 200)
+                        done += 1
+                        continue
+                    if (self.group_limit is not None and
+                            groups.get(task.group, 0) >= self.group_limit):
+                        parked.append((task.seq, task.key))
+                        continue
+                    groups[task.group] = groups.get(task.group, 0) + 1
+                    in_flight[executor.submit(self.execute, task)] = task
+                for item in parked:
+                    heapq.heappush(ready, item)
+                parked = []
+                if not in_flight:
+                    if ready:
+                        continue
+                    if done < len(self.tasks):
+                        raise SchedulerError('Dependency cycle between the '
+                                             'tasks not run')
+                    break
+                finished = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+                for future in finished:
+                    task = in_flight.pop(future)
+                    groups[task.group] -= 1
+                    finish(task, future.result())
+                    done += 1
+        return dict((key, task.status) for key, task in self.tasks.items())
@@ -0,0 +1,372 @@
+# Subscription manager: keeps an in-memory index of some ACI classes always
+# up to date with the events sent by the APIC on its websocket, instead of
+# querying again the whole class every time a fresh state is needed.
+#
+# Every class is loaded once with Query.query_class and '?subscription=yes',
+# then the created, modified and deleted objects notified on the websocket
+# are applied to the index. Subscriptions expire on the APIC if they are not
+# refreshed, a background thread refreshes them every 'refresh' seconds.
+# It can be used in the following way:
+#
+#   subs = SubscriptionManager(apic_ip, cookies)
+#   subs.subscribe('fvBD')
+#   subs.start()
+#   ...
+#   if subs.exists('fvBD', 'uni/tn-Tenant/BD-Vlan10_BD'):
+#       ...
+#   subs.stop()
+#
+# Only the python standard library is used: the websocket client below
+# implements the minimal subset of RFC 6455 the APIC needs (text frames,
+# ping/pong and close).
+import base64
+import hashlib
+import json
+import os
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+from Aci_Cal_Toolkit import Query, MitCache, get_connection
+
+# Seconds between two refreshes of the subscriptions, the APIC drops the
+# subscriptions which are not refreshed within 90 seconds.
+SUBSCRIPTION_REFRESH = 30
+# Longest pause (seconds) between two attempts to reconnect the websocket,
+# the pause starts at 1s and doubles at every failed attempt
+RECONNECT_MAX_WAIT = 60
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class WebSocketClosed(Exception):
+    pass
+
+
+# Returns the Sec-WebSocket-Accept value for a Sec-WebSocket-Key
+def ws_accept_key(key):
+    digest = hashlib.sha1((key + WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+# Encodes a single websocket frame. Frames sent by a client must be masked,
+# frames sent by a server must not.
+def ws_encode(payload, opcode=OP_TEXT, mask=True):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    header = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header += bytes([mask_bit | length])
+    elif length < 65536:
+        header += bytes([mask_bit | 126]) + struct.pack('!H', length)
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack('!Q', length)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+def recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise WebSocketClosed('Connection closed by the peer')
+        data += chunk
+    return data
+
+
+# Reads a single websocket frame, returns (fin, opcode, payload)
+def ws_read_frame(sock):
+    [byte0, byte1] = recv_exact(sock, 2)
+    length = byte1 & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', recv_exact(sock, 8))[0]
+    key = recv_exact(sock, 4) if byte1 & 0x80 else None
+    payload = recv_exact(sock, length)
+    if key is not None:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return (bool(byte0 & 0x80), byte0 & 0x0F, payload)
+
+
+# Minimal websocket client, url is in the form
+# wss://<apic>/socket<token> or ws://127.0.0.1:8000/socket<token>
+class WebSocket(object):
+    def __init__(self, url, timeout=30):
+        [scheme, rest] = url.split('://', 1)
+        [netloc, path] = rest.split('/', 1) if '/' in rest else (rest, '')
+        if ':' in netloc:
+            [host, port] = netloc.rsplit(':', 1)
+            port = int(port)
+        else:
+            host = netloc
+            port = 443 if scheme == 'wss' else 80
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if scheme == 'wss':
+            # certificates are not verified, as for the REST calls
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=host)
+        self.sock = sock
+        self.lock = threading.Lock()
+        # the socket is closed if the handshake fails, the caller retries
+        try:
+            self.handshake(path, netloc)
+        except Exception:
+            sock.close()
+            raise
+
+    def handshake(self, path, netloc):
+        sock = self.sock
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = ('GET /{} HTTP/1.1\r\n'
+                   'Host: {}\r\n'
+                   'Upgrade: websocket\r\n'
+                   'Connection: Upgrade\r\n'
+                   'Sec-WebSocket-Key: {}\r\n'
+                   'Sec-WebSocket-Version: 13\r\n\r\n').format(path, netloc, key)
+        sock.sendall(request.encode())
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(1)
+            if not chunk:
+                raise WebSocketClosed('Handshake failed, connection closed')
+            response += chunk
+        lines = response.decode(errors='replace').split('\r\n')
+        if ' 101 ' not in lines[0] + ' ':
+            raise WebSocketClosed('Handshake failed: ' + lines[0])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                [name, value] = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        if headers.get('sec-websocket-accept') != ws_accept_key(key):
+            raise WebSocketClosed('Handshake failed, wrong accept key')
+
+    def send(self, payload, opcode=OP_TEXT):
+        with self.lock:
+            self.sock.sendall(ws_encode(payload, opcode))
+
+    # Returns the next text message, or None if nothing arrives within
+    # timeout seconds. Ping frames are answered, a close frame raises
+    # WebSocketClosed.
+    def recv(self, timeout=None):
+        message = b''
+        while True:
+            pending = isinstance(self.sock, ssl.SSLSocket) and self.sock.pending()
+            if not message and not pending:
+                ready = select.select([self.sock], [], [], timeout)[0]
+                if not ready:
+                    return None
+            [fin, opcode, payload] = ws_read_frame(self.sock)
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                raise WebSocketClosed('Connection closed by the peer')
+            message += payload
+            if fin:
+                return message.decode()
+
+    def close(self):
+        try:
+            self.send(b'', OP_CLOSE)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class SubscriptionManager(object):
+    def __init__(self, apic, cookies, refresh=SUBSCRIPTION_REFRESH, conn=None):
+        if conn is None:
+            # subscriptions live on a single controller of a cluster, the
+            # queries, the refreshes and the websocket must all go there
+            apic = get_connection(apic).preferred()
+        self.apic = apic
+        self.cookies = cookies
+        self.refresh = refresh
+        # the subscription queries must always reach the APIC, they are
+        # never served by the MIT snapshot cache
+        self.query = Query(apic, cookies, conn=conn, cache=MitCache(ttl=0))
+        self.conn = self.query.conn
+        self.websocket = None
+        # index[aci_class][dn] = attributes
+        self.index = {}
+        # subscription id -> (aci_class, query_filter)
+        self.subscriptions = {}
+        self.lock = threading.Condition()
+        self.thread = None
+        self.running = False
+        # set by stop(), interrupts the pauses between the reconnections
+        self.stopping = threading.Event()
+        self.last_refresh = time.time()
+        # number of events applied to the index, useful for statistics
+        self.events = 0
+
+    def socket_url(self):
+        token = self.cookies.get('APIC-cookie')
+        if '://' in self.apic:
+            return self.apic.replace('http', 'ws', 1) + '/socket' + token
+        return 'wss://{}/socket{}'.format(self.apic, token)
+
+    def connect(self):
+        if self.websocket is None:
+            self.websocket = WebSocket(self.socket_url())
+
+    # Loads all the objects of a class in the index and subscribes to their
+    # changes, returns the number of objects loaded or None on failure.
+    # The websocket must be open before subscribing, otherwise the APIC
+    # does not deliver the events.
+    def subscribe(self, aci_class, query_filter=''):
+        self.connect()
+        url_filter = query_filter + ('&' if query_filter else '?') + \
+            'subscription=yes'
+        [status, payload] = self.query.query_class(aci_class, url_filter)
+        if status != 200 or 'subscriptionId' not in payload:
+            print("Failed to subscribe to class {}, status {}".format(
+                aci_class, status))
+            return None
+        objects = {}
+        for obj in payload['imdata']:
+            attributes = obj[aci_class]['attributes']
+            objects[attributes['dn']] = attributes
+        with self.lock:
+            self.index[aci_class] = objects
+            self.subscriptions[payload['subscriptionId']] = (aci_class,
+                                                             query_filter)
+        return len(objects)
+
+    # Applies the events of a websocket message to the index
+    def apply(self, message):
+        data = json.loads(message)
+        with self.lock:
+            for obj in data.get('imdata', []):
+                for aci_class, body in obj.items():
+                    objects = self.index.get(aci_class)
+                    if objects is None:
+                        continue
+                    attributes = dict(body['attributes'])
+                    dn = attributes['dn']
+                    status = attributes.pop('status', 'modified')
+                    if status == 'deleted':
+                        objects.pop(dn, None)
+                    elif dn in objects and status != 'created':
+                        objects[dn].update(attributes)
+                    else:
+                        objects[dn] = attributes
+                    self.events += 1
+            self.lock.notify_all()
+
+    # Refreshes all the subscriptions, the failed ones are subscribed again
+    def refresh_subscriptions(self):
+        self.last_refresh = time.time()
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        for sub_id, (aci_class, query_filter) in subscriptions:
+            [status, payload] = self.query.query_url(
+                '/api/subscriptionRefresh.json?id={}'.format(sub_id))
+            if status != 200:
+                print("Subscription {} to class {} expired, subscribing "
+                      "again".format(sub_id, aci_class))
+                with self.lock:
+                    del self.subscriptions[sub_id]
+                self.subscribe(aci_class, query_filter)
+
+    # After a websocket failure all the classes are loaded and subscribed
+    # again, the events received meanwhile are lost. A subscription is
+    # replaced only once it has been subscribed again: if the websocket
+    # cannot be opened (the exception is raised) or a class fails, the old
+    # ones are kept for the next attempt.
+    def reconnect(self):
+        if self.websocket is not None:
+            self.websocket.close()
+            self.websocket = None
+        self.connect()
+        with self.lock:
+            subscriptions = list(self.subscriptions.items())
+        for sub_id, (aci_class, query_filter) in subscriptions:
+            if self.subscribe(aci_class, query_filter) is not None:
+                with self.lock:
+                    self.subscriptions.pop(sub_id, None)
+
+    def run(self):
+        wait = 1
+        while self.running:
+            try:
+                if self.websocket is None:
+                    self.reconnect()
+                    wait = 1
+                message = self.websocket.recv(timeout=1)
+                if message is not None:
+                    self.apply(message)
+                if time.time() - self.last_refresh >= self.refresh:
+                    self.refresh_subscriptions()
+            except (WebSocketClosed, OSError, ValueError) as e:
+                if not self.running:
+                    break
+                if self.websocket is not None:
+                    print("Websocket failed, subscribing again. "
+                          "Error: {}".format(e))
+                    self.websocket.close()
+                    self.websocket = None
+                else:
+                    print("Websocket reconnection failed, retrying in {}s. "
+                          "Error: {}".format(wait, e))
+                self.stopping.wait(wait)
+                wait = min(wait * 2, RECONNECT_MAX_WAIT)
+
+    # Starts the background thread receiving the events and refreshing
+    # the subscriptions
+    def start(self):
+        self.connect()
+        self.stopping.clear()
+        self.running = True
+        self.last_refresh = time.time()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.websocket is not None:
+            self.websocket.close()
+            self.websocket = None
+
+    # Waits until at least 'events' events have been applied, returns False
+    # on timeout
+    def wait_events(self, events, timeout=None):
+        with self.lock:
+            return self.lock.wait_for(lambda: self.events >= events, timeout)
+
+    # Lookups on the index, no query is sent to the APIC
+    def get(self, aci_class, dn):
+        with self.lock:
+            return self.index.get(aci_class, {}).get(dn)
+
+    def exists(self, aci_class, dn):
+        with self.lock:
+            return dn in self.index.get(aci_class, {})
+
+    def objects(self, aci_class):
+        with self.lock:
+            return list(self.index.get(aci_class, {}).values())
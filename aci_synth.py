@@ -0,0 +1,244 @@
+# Seeded generator of synthetic data sets, to test the toolkit and the scripts
+# at scale without a live fabric. The same seed and sizes always give the same
+# data, so that two runs (or two versions of the toolkit) can be compared:
+#
+# - the fabric: leaves with their physical ports, switch and interface profiles,
+#   interface selectors with port blocks and policy groups, vPC pairs with their
+#   paths, tenants with vrf, BD (subnet and vrf relationship), application
+#   profiles and EPG. populate(mock) fills a MockApic (see mock_apic.py).
+# - the legacy vlans to be migrated: write_vlan_sheet() writes them as the
+#   'ACI translate' sheet read by from_vlan_list_to_aci.py, every vlan bound to
+#   vPC or access ports of the fabric, and write_nexus_configs() as the Nexus
+#   running configurations read by from_Nexus_to_excel_vlan_list.py.
+#
+# The default sizes are about the ones of a real fabric today, 'scale'
+# multiplies the leaves, the tenants and the vlans:
+#
+#   synth = SyntheticFabric(seed=1, scale=10)
+#   mock = MockApic()
+#   synth.populate(mock)
+#   synth.write_vlan_sheet('ACI_vlan_list.xlsx')
+#   synth.write_nexus_configs('configs/')
+#
+# or from the command line, the files are written in the output directory:
+#
+#   python aci_synth.py <output_dir> [scale] [seed]
+import os
+import random
+import sys
+import openpyxl
+
+# vlan ids usable on a Nexus, every device carries at most this many vlans
+VLANS_PER_DEVICE = 4000
+
+
+class SyntheticFabric(object):
+    def __init__(self, seed=0, scale=1, leaves=20, ports=48, selectors=24,
+                 tenants=10, vrfs=2, bds=20, vlans=50):
+        self.seed = seed
+        self.scale = scale
+        # leaves are always an even number, consecutive leaves are vPC pairs
+        self.leaves = max(2, (leaves * scale) // 2 * 2)
+        self.ports = ports
+        # every selector takes two ports
+        self.selectors = min(selectors, ports // 2)
+        self.tenants = tenants * scale
+        self.vrfs = vrfs
+        self.bds = bds
+        self.vlans = vlans * scale
+        self.rng = random.Random(seed)
+        self.nodes = [101 + i for i in range(self.leaves)]
+        # (node, port) of the access ports and vPC policy group names, the
+        # vlans to be migrated are bound to them
+        self.access_ports = []
+        self.vpcs = []
+        self.profiles = []
+        for i, node in enumerate(self.nodes):
+            self.profiles.append(('Leaf-{}'.format(node), node, node))
+            if i % 2:
+                self.profiles.append(('Leaf-{}-{}'.format(node - 1, node),
+                                      node - 1, node))
+        for name, node_from, node_to in self.profiles:
+            for sel in self.profile_selectors(node_from, node_to):
+                if node_from == node_to:
+                    self.access_ports.append((node_from, 2 * sel + 1))
+                else:
+                    self.vpcs.append('vPC_{}_{}'.format(name, sel))
+        self.legacy = self.legacy_vlans()
+
+    # The single leaf profiles have the even selectors, with access ports,
+    # the vPC pair profiles the odd ones, with a vPC each
+    def profile_selectors(self, node_from, node_to):
+        return range(0 if node_from == node_to else 1, self.selectors, 2)
+
+    # The objects of the fabric as (class name, attributes)
+    def objects(self):
+        for node in self.nodes:
+            yield ('fabricNode', {'dn': 'topology/pod-1/node-{}'.format(node),
+                                  'id': str(node), 'role': 'leaf',
+                                  'name': 'Leaf{}'.format(node)})
+            for port in range(1, self.ports + 1):
+                yield ('l1PhysIf', {'dn': 'topology/pod-1/node-{}/sys/phys-'
+                                          '[eth1/{}]'.format(node, port),
+                                    'id': 'eth1/{}'.format(port)})
+        for name, node_from, node_to in self.profiles:
+            nprof = 'uni/infra/nprof-{}_LeafProf'.format(name)
+            accportprof = 'uni/infra/accportprof-{}_IntProf'.format(name)
+            yield ('infraNodeP', {'dn': nprof, 'name': name + '_LeafProf'})
+            yield ('infraNodeBlk', {'dn': nprof + '/leaves-{}_SwSel-typ-range'
+                                    '/nodeblk-1'.format(name),
+                                    'from_': str(node_from), 'to_': str(node_to)})
+            yield ('infraRsAccPortP', {'dn': nprof + '/rsaccPortP-[{}]'.format(
+                accportprof)})
+            yield ('infraAccPortP', {'dn': accportprof, 'name': name + '_IntProf'})
+            for sel in self.profile_selectors(node_from, node_to):
+                hports = accportprof + '/hports-{}_{}-typ-range'.format(name, sel)
+                yield ('infraHPortS', {'dn': hports,
+                                       'name': '{}_{}'.format(name, sel)})
+                yield ('infraPortBlk', {'dn': hports + '/portblk-1',
+                                        'fromCard': '1', 'toCard': '1',
+                                        'fromPort': str(2 * sel + 1),
+                                        'toPort': str(2 * sel + 2),
+                                        'descr': 'server {} {}'.format(name, sel)})
+                if node_from != node_to:
+                    pol_grp = 'uni/infra/funcprof/accbundle-vPC_{}_{}_PolGrp' \
+                        .format(name, sel)
+                else:
+                    pol_grp = 'uni/infra/funcprof/accportgrp-Access_PolGrp'
+                yield ('infraRsAccBaseGrp', {'dn': hports + '/rsaccBaseGrp',
+                                             'tDn': pol_grp})
+            if node_from != node_to:
+                cont = 'topology/pod-1/protpaths-{}-{}'.format(node_from, node_to)
+                yield ('fabricProtPathEpCont', {'dn': cont})
+                for sel in self.profile_selectors(node_from, node_to):
+                    yield ('fabricPathEp', {'dn': cont + '/pathep-[vPC_{}_{}_PolGrp]'
+                                            .format(name, sel)})
+        for t in range(self.tenants):
+            tn = 'uni/tn-Tenant{}'.format(t)
+            yield ('fvTenant', {'dn': tn, 'name': 'Tenant{}'.format(t)})
+            for v in range(self.vrfs):
+                vrf = 'VRF_{}'.format(v + 1)
+                yield ('fvCtx', {'dn': tn + '/ctx-' + vrf, 'name': vrf})
+                yield ('fvAp', {'dn': tn + '/ap-{}_ANP'.format(vrf),
+                                'name': vrf + '_ANP'})
+            for b in range(self.bds):
+                vrf = 'VRF_{}'.format(b % self.vrfs + 1)
+                name = 'BD_{}_{}'.format(t, b)
+                bd = tn + '/BD-{}_BD'.format(name)
+                yield ('fvBD', {'dn': bd, 'name': name + '_BD'})
+                yield ('fvRsCtx', {'dn': bd + '/rsctx', 'tnFvCtxName': vrf,
+                                   'tDn': tn + '/ctx-' + vrf})
+                index = t * self.bds + b
+                subnet = '172.{}.{}.1/24'.format(16 + index // 256 % 16,
+                                                 index % 256)
+                yield ('fvSubnet', {'dn': bd + '/subnet-[{}]'.format(subnet),
+                                    'ip': subnet})
+                yield ('fvAEPg', {'dn': tn + '/ap-{}_ANP/epg-{}_EPG'.format(
+                    vrf, name), 'name': name + '_EPG'})
+
+    # Fills the mock MIT, returns the number of objects added
+    def populate(self, mock):
+        count = 0
+        for aci_class, attributes in self.objects():
+            mock.add(aci_class, attributes)
+            count += 1
+        return count
+
+    # The legacy vlans to be migrated, as dictionaries. About one vlan out
+    # of four is L2 only, all of them are bound to one or two vPC or to an
+    # access port of the fabric.
+    def legacy_vlans(self):
+        vlans = []
+        for n in range(self.vlans):
+            vlan_id = 2 + n % VLANS_PER_DEVICE
+            l3 = self.rng.random() > 0.25
+            interfaces = []
+            for i in range(self.rng.choice((1, 1, 2))):
+                if self.rng.random() < 0.7 or not self.access_ports:
+                    interfaces.append(self.rng.choice(self.vpcs) + '_PolGrp')
+                else:
+                    [node, port] = self.rng.choice(self.access_ports)
+                    interfaces.append('eth,1,{},1,{}'.format(node, port))
+            vlans.append({'device': 'Nexus_config_{}.txt'.format(
+                              n // VLANS_PER_DEVICE + 1),
+                          'tenant': 'Tenant{}'.format(
+                              self.rng.randrange(self.tenants)),
+                          'vrf': 'VRF_{}'.format(self.rng.randrange(self.vrfs) + 1),
+                          'vlan': vlan_id,
+                          'name': 'VLAN_{}'.format(n),
+                          'ip': '10.{}.{}.1/24'.format(n // 256 % 256, n % 256)
+                                if l3 else None,
+                          'hsrp': n % 256,
+                          'descr': 'legacy vlan {}'.format(n),
+                          'interfaces': sorted(set(interfaces))})
+        return vlans
+
+    # Writes the 'ACI translate' sheet of from_vlan_list_to_aci.py
+    def write_vlan_sheet(self, file_name, sheet_name='ACI translate'):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = sheet_name
+        sheet.append(['tenant', 'vrf', 'vlan_number', 'l2_vlan_name',
+                      'app_profile', 'ip_addr', 'route_type', 'descr', 'epg',
+                      'interfaces'])
+        for vlan in self.legacy:
+            sheet.append([vlan['tenant'], vlan['vrf'],
+                          'Vlan{}'.format(vlan['vlan']), vlan['name'], None,
+                          vlan['ip'], None, vlan['descr'], None,
+                          '\n'.join(vlan['interfaces'])])
+        workbook.save(file_name)
+        return len(self.legacy)
+
+    # Writes the running configurations of the Nexus carrying the legacy
+    # vlans, returns the list of the file names
+    def write_nexus_configs(self, config_dir):
+        devices = {}
+        for vlan in self.legacy:
+            devices.setdefault(vlan['device'], []).append(vlan)
+        for device, vlans in devices.items():
+            with open(os.path.join(config_dir, device), 'w') as f:
+                f.write('hostname {}\n\nfeature hsrp\nfeature interface-vlan\n\n'
+                        .format(device[:-4]))
+                for vlan in vlans:
+                    f.write('vlan {}\n  name {}\n\n'.format(vlan['vlan'],
+                                                             vlan['name']))
+                for vlan in vlans:
+                    if vlan['ip'] is None:
+                        continue
+                    address = vlan['ip'].split('/')
+                    real_ip = address[0].rsplit('.', 1)[0] + '.2'
+                    f.write('interface Vlan{}\n'
+                            '  description {}\n'
+                            '  no shutdown\n'
+                            '  vrf member {}\n'
+                            '  ip address {}/{}\n'
+                            '  hsrp {}\n'
+                            '    ip {}\n\n'.format(vlan['vlan'], vlan['descr'],
+                                                   vlan['vrf'], real_ip,
+                                                   address[1], vlan['hsrp'],
+                                                   address[0]))
+                trunk = ','.join(str(vlan['vlan']) for vlan in vlans[:100])
+                for port in range(1, 5):
+                    f.write('interface Ethernet1/{}\n'
+                            '  description uplink {}\n'
+                            '  switchport mode trunk\n'
+                            '  switchport trunk allowed vlan {}\n\n'
+                            .format(port, port, trunk))
+        return sorted(devices)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python aci_synth.py <output_dir> [scale] [seed]')
+        exit(1)
+    output_dir = sys.argv[1]
+    scale = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    os.makedirs(output_dir, exist_ok=True)
+    synth = SyntheticFabric(seed=seed, scale=scale)
+    rows = synth.write_vlan_sheet(os.path.join(output_dir, 'ACI_vlan_list.xlsx'))
+    configs = synth.write_nexus_configs(output_dir)
+    print('{} leaves, {} vPC, {} tenants, {} vlans: ACI_vlan_list.xlsx and {} '
+          'Nexus configurations written in {}'.format(
+              synth.leaves, len(synth.vpcs), synth.tenants, rows, len(configs),
+              output_dir))
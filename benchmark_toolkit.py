@@ -0,0 +1,1123 @@
+# This python script measures the toolkit against the local mock APIC (see
+# mock_apic.py), no live fabric is needed. Every benchmark prints the wall
+# clock time of the serial implementation and of the faster one, checking
+# that both of them return the same data.
+#
+# The latency of the mock simulates the round trip time toward the APIC,
+# which is what makes serial queries slow on a real fabric.
+#
+# Every benchmark also records its measures, with --json <file> they are
+# saved as a json document to track the regressions between two versions:
+#
+#   python benchmark_toolkit.py --json results.json
+#   python benchmark_toolkit.py --json results.json query_ports push
+#
+# The names after the options select the benchmarks to be run (the name of
+# the bench_ function without 'bench_'), all of them by default. The script
+# exits with status 1 if any benchmark returned wrong data.
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import types
+import jinja2
+import Aci_Cal_Toolkit
+import aci_log
+from Aci_Cal_Toolkit import FabLogin, Query, FabTnPol
+from aci_dn import parse_dn, PATH_ATT_DN
+from aci_subscription import SubscriptionManager
+from aci_scheduler import PushScheduler
+from aci_synth import SyntheticFabric
+from mock_apic import MockApic
+
+JSON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'jsondata') + '/'
+LATENCY = 0.05
+TENANTS = 10
+BD_PER_TENANT = 20
+# seed and sizes (times today's fabric) of the synthetic data sets
+SEED = 1
+SCALES = (1, 10)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) + '/'
+
+# Measures of the benchmarks run, see record()
+results = []
+
+
+# Records the measures of a benchmark (times in seconds)
+def record(benchmark, **measures):
+    results.append(dict(benchmark=benchmark, **measures))
+
+
+# Prints an error and records it, the benchmark returned wrong data
+def error(benchmark, message):
+    print('ERROR ' + message)
+    record(benchmark, error=message)
+
+
+# Fills the mock MIT with tenants, vrf, application profiles, BD with
+# their subnet and vrf relationship, and one EPG for every BD.
+def populate_tenants(mock, tenants=TENANTS, bds=BD_PER_TENANT):
+    for t in range(tenants):
+        tn = 'uni/tn-Tenant{}'.format(t)
+        mock.add('fvTenant', {'dn': tn, 'name': 'Tenant{}'.format(t)})
+        mock.add('fvCtx', {'dn': tn + '/ctx-VRF', 'name': 'VRF'})
+        mock.add('fvAp', {'dn': tn + '/ap-VRF_ANP', 'name': 'VRF_ANP'})
+        for b in range(bds):
+            bd = tn + '/BD-Vlan{}_BD'.format(b)
+            mock.add('fvBD', {'dn': bd, 'name': 'Vlan{}_BD'.format(b)})
+            mock.add('fvRsCtx', {'dn': bd + '/rsctx', 'tnFvCtxName': 'VRF',
+                                 'tDn': tn + '/ctx-VRF'})
+            subnet = '10.{}.{}.1/24'.format(t, b)
+            mock.add('fvSubnet', {'dn': bd + '/subnet-[{}]'.format(subnet),
+                                  'ip': subnet})
+            mock.add('fvAEPg', {'dn': tn + '/ap-VRF_ANP/epg-Vlan{}_EPG'.format(b),
+                                'name': 'Vlan{}_EPG'.format(b)})
+
+
+# Fills the mock MIT with the access policies of 'leaves' leaf switches:
+# a switch profile and an interface profile for every leaf and for every
+# pair of consecutive leaves, with 'selectors' interface selectors of two
+# ports each, half of them with an access policy group and half with a vPC.
+def populate_ports(mock, leaves=20, selectors=24):
+    profiles = [('Leaf-{}'.format(101 + i), 101 + i, 101 + i)
+                for i in range(leaves)]
+    profiles += [('Leaf-{}-{}'.format(101 + i, 102 + i), 101 + i, 102 + i)
+                 for i in range(0, leaves - 1, 2)]
+    for name, node_from, node_to in profiles:
+        nprof = 'uni/infra/nprof-{}_LeafProf'.format(name)
+        mock.add('infraNodeP', {'dn': nprof, 'name': name + '_LeafProf'})
+        mock.add('infraNodeBlk', {'dn': nprof + '/leaves-{}_SwSel-typ-range'
+                                  '/nodeblk-1'.format(name),
+                                  'from_': str(node_from), 'to_': str(node_to)})
+        mock.add('infraRsAccPortP', {'dn': nprof + '/rsaccPortP-[uni/infra/'
+                                     'accportprof-{}_IntProf]'.format(name)})
+        accportprof = 'uni/infra/accportprof-{}_IntProf'.format(name)
+        mock.add('infraAccPortP', {'dn': accportprof,
+                                   'name': name + '_IntProf'})
+        for sel in range(selectors):
+            hports = accportprof + '/hports-{}_{}-typ-range'.format(name, sel)
+            mock.add('infraPortBlk', {'dn': hports + '/portblk-1',
+                                      'fromCard': '1', 'descr': 'sel {}'.format(sel),
+                                      'fromPort': str(2 * sel + 1),
+                                      'toPort': str(2 * sel + 2)})
+            if sel % 2:
+                polGrp = 'uni/infra/funcprof/accbundle-vPC_{}_{}'.format(name, sel)
+            else:
+                polGrp = 'uni/infra/funcprof/accportgrp-Access_PolGrp'
+            mock.add('infraRsAccBaseGrp', {'dn': hports + '/rsaccBaseGrp',
+                                           'tDn': polGrp})
+
+
+# Fills the mock with 'pairs' vPC containers (fabricProtPathEpCont), each
+# of them with 'vpcs' fabricPathEp children.
+def populate_vpc(mock, pairs=50, vpcs=4):
+    for i in range(pairs):
+        cont = 'topology/pod-1/protpaths-{}-{}'.format(101 + 2 * i, 102 + 2 * i)
+        mock.add('fabricProtPathEpCont', {'dn': cont})
+        for v in range(vpcs):
+            mock.add('fabricPathEp', {'dn': cont + '/pathep-[vPC_{}_{}_PolGrp]'
+                                      .format(i, v)})
+
+
+# The original query_vpc, one query for the containers plus one query for
+# the children of every container.
+def query_vpc_reference(req):
+    vpc_dn = {}
+    payload = req.query_url('/api/class/fabricProtPathEpCont.json')[1]
+    for res in payload['imdata']:
+        dn = res['fabricProtPathEpCont']['attributes']['dn']
+        payload = req.query_url('/api/mo/'+dn+'.json?query-target=children')[1]
+        for elem in payload['imdata']:
+            dn = elem['fabricPathEp']['attributes']['dn']
+            vpc_dn[re.search(r"pathep-\[(.*)\]", dn).group(1)] = dn
+    return vpc_dn
+
+
+# query_vpc: N+1 serial queries against the single subtree query
+def bench_query_vpc(pairs=50):
+    mock = MockApic(latency=LATENCY)
+    populate_vpc(mock, pairs)
+    req = Query(mock.start(), None)
+    start = time.perf_counter()
+    reference = query_vpc_reference(req)
+    reference_time = time.perf_counter() - start
+    requests = mock.requests
+    start = time.perf_counter()
+    vpc_dn = req.query_vpc()
+    single_time = time.perf_counter() - start
+    requests = mock.requests - requests
+    mock.stop()
+    if not vpc_dn or vpc_dn != reference:
+        error('query_vpc', 'query_vpc returned different data from the reference')
+    print('query_vpc {} pairs: {} queries {:.3f}s, {} query {:.3f}s'
+          .format(pairs, pairs + 1, reference_time, requests, single_time))
+    record('query_vpc', pairs=pairs, reference_time=reference_time,
+           reference_requests=pairs + 1, time=single_time, requests=requests)
+
+
+# The original query_ports algorithm, which scans all the nodes for every
+# port block and all the nodes and ports for every policy group. It is kept
+# here as the reference for the output of the indexed Query.query_ports.
+def query_ports_reference(req):
+    node_data = {}
+    payload = req.query_url('/api/node/class/infraNodeP.json?query-target='
+                            'subtree&target-subtree-class=infraNodeBlk')[1]
+    for obj in payload['imdata']:
+        attr = obj['infraNodeBlk']['attributes']
+        reg = re.search(r'nprof-(.*?)\/leaves-(.*?)-typ-range\/nodeblk', attr['dn'])
+        for node_id in range(int(attr['from_']), int(attr['to_']) + 1):
+            if not node_id in node_data:
+                node_data[node_id] = {'swProf': {}, 'intProf': {}, 'ports': {}}
+            node_data[node_id]['swProf'].setdefault(reg.group(1), {})
+            node_data[node_id]['swProf'][reg.group(1)][reg.group(2)] = 1
+    payload = req.query_url('/api/node/class/infraNodeP.json?query-target='
+                            'subtree&target-subtree-class=infraRsAccPortP')[1]
+    for obj in payload['imdata']:
+        dn = obj['infraRsAccPortP']['attributes']['dn']
+        reg = re.search(r'nprof-(.*?)\/.*\[uni/infra/accportprof-(.*)\]', dn)
+        for node_id in node_data:
+            if reg.group(1) in node_data[node_id]['swProf']:
+                node_data[node_id]['intProf'][reg.group(2)] = reg.group(1)
+    for obj in req.iter_class('infraPortBlk'):
+        attr = obj['infraPortBlk']['attributes']
+        reg = re.search(r'accportprof-(.*?)\/hports-(.*?)-typ-range\/portblk', attr['dn'])
+        for node_id in node_data:
+            for prof in node_data[node_id]['intProf']:
+                if reg.group(1) == prof:
+                    for port_id in range(int(attr['fromPort']), int(attr['toPort']) + 1):
+                        port = attr['fromCard'] + '/' + str(port_id)
+                        ports = node_data[node_id]['ports']
+                        ports.setdefault(port, {})
+                        ports[port]['intSel'] = reg.group(2)
+                        ports[port]['descr'] = attr['descr']
+                        ports[port]['intProf'] = reg.group(1)
+    for obj in req.iter_class('infraRsAccBaseGrp'):
+        attr = obj['infraRsAccBaseGrp']['attributes']
+        intSel = re.search(r'accportprof-(.*?)\/hports-(.*?)-typ-range', attr['dn']).group(2)
+        reg = re.search('acc(bundle|portgrp)-(.*)', attr['tDn'])
+        for node_id in node_data:
+            for intf in node_data[node_id]['ports']:
+                if node_data[node_id]['ports'][intf]['intSel'] == intSel:
+                    node_data[node_id]['ports'][intf]['polGrp'] = reg.group(2).strip()
+                    node_data[node_id]['ports'][intf]['type'] = (
+                        'bundle' if reg.group(1) == 'bundle' else 'access')
+    return node_data
+
+
+# query_ports: the reference nested scans against the indexed implementation,
+# the mock has no latency here since the CPU time is what is measured.
+def bench_query_ports(leaves=40, selectors=48):
+    mock = MockApic()
+    populate_ports(mock, leaves, selectors)
+    req = Query(mock.start(), None)
+    start = time.perf_counter()
+    reference = query_ports_reference(req)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    node_data = req.query_ports(verbose=False)
+    indexed_time = time.perf_counter() - start
+    mock.stop()
+    if not node_data or node_data != reference:
+        error('query_ports', 'query_ports returned different data from the reference')
+    print('query_ports {} leaves: nested scans {:.3f}s, indexed {:.3f}s'
+          .format(leaves, reference_time, indexed_time))
+    record('query_ports', leaves=leaves, selectors=selectors,
+           reference_time=reference_time, time=indexed_time)
+
+
+# query_all_tenants: five serial class queries against the same five
+# class queries performed at the same time by the asyncio engine.
+def bench_query_all_tenants(apic_ip, cookies):
+    req = Query(apic_ip, cookies)
+    start = time.perf_counter()
+    serial = req.query_all_tenants()
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concurrent = asyncio.run(req.query_all_tenants_async())
+    async_time = time.perf_counter() - start
+
+    if serial != concurrent:
+        error('query_all_tenants', 'query_all_tenants_async returned different data')
+    print('query_all_tenants serial {:.3f}s, async {:.3f}s, saved {:.0f}%'
+          .format(serial_time, async_time,
+                  100 * (serial_time - async_time) / serial_time))
+    record('query_all_tenants', serial_time=serial_time, async_time=async_time)
+
+
+# query_all_tenants 'classes' mode (five class queries, DN regex parsing)
+# against the 'subtree' mode (one fvTenant query with nested children):
+# round trips and bytes are counted by the mock, parse time is the json
+# decoding of the answers plus the building of apic_data.
+def bench_query_all_tenants_modes(apic_ip, cookies, mock):
+    req = Query(apic_ip, cookies)
+    data = {}
+    for mode in ('classes', 'subtree'):
+        requests = mock.requests
+        bytes_out = mock.bytes_out
+        start = time.perf_counter()
+        data[mode] = req.query_all_tenants(mode=mode)
+        wall_time = time.perf_counter() - start
+        requests = mock.requests - requests
+        bytes_out = mock.bytes_out - bytes_out
+        # the answers are retrieved again to time the local processing only
+        if mode == 'classes':
+            texts = [req.conn.get('/api/node/class/{}.json'.format(aci_class)).text
+                     for aci_class in req.tenant_classes]
+            start = time.perf_counter()
+            req.build_all_tenants(dict(zip(req.tenant_classes,
+                [json.loads(text)['imdata'] for text in texts])))
+        else:
+            text = req.conn.get('/api/node/class/fvTenant.json?rsp-subtree=full'
+                                '&rsp-subtree-class=' +
+                                ','.join(req.tenant_subtree_classes)).text
+            start = time.perf_counter()
+            req.build_tenants_subtree(json.loads(text)['imdata'])
+        parse_time = time.perf_counter() - start
+        print('query_all_tenants {}: {} round trips, {} bytes, wall {:.3f}s, '
+              'parse {:.4f}s'.format(mode, requests, bytes_out, wall_time,
+                                     parse_time))
+        record('query_all_tenants_modes', mode=mode, requests=requests,
+               bytes=bytes_out, time=wall_time, parse_time=parse_time)
+    if data['classes'] != data['subtree']:
+        error('query_all_tenants_modes',
+              'query_all_tenants modes returned different data')
+
+
+# Template rendering: a new jinja2 environment and get_template() for every
+# payload (the old behaviour of every class) against the shared registry,
+# compiled from scratch and loaded from the bytecode cache.
+def bench_templates(renders=2000):
+    template_vars = {'tn_name': 'Tenant', 'name': 'Vlan10_BD', 'arp': 'no',
+                     'mdest': 'bd-flood', 'mcast': 'flood', 'unicast': 'yes',
+                     'unk_unicast': 'proxy', 'status': 'created',
+                     'limitlearn': 'yes', 'multicast': 'no', 'descr': ''}
+    start = time.perf_counter()
+    for i in range(renders):
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(
+            searchpath=JSON_PATH + 'FabTnPol/'))
+        env.get_template('bd.json').render(template_vars)
+    old_time = time.perf_counter() - start
+
+    registry = Aci_Cal_Toolkit.template_registry
+    start = time.perf_counter()
+    for i in range(renders):
+        registry.get_template('FabTnPol/bd.json').render(template_vars)
+    new_time = time.perf_counter() - start
+    print('{} bd.json renders: per-call environment {:.3f}s, registry {:.3f}s'
+          .format(renders, old_time, new_time))
+    record('templates', renders=renders, environment_time=old_time,
+           registry_time=new_time)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        Aci_Cal_Toolkit.template_cache_dir = cache_dir
+        timings = []
+        for run in ('compile', 'bytecode'):
+            registry.reset()
+            start = time.perf_counter()
+            count = registry.precompile()
+            timings.append(time.perf_counter() - start)
+        Aci_Cal_Toolkit.template_cache_dir = None
+        registry.reset()
+    print('precompile {} templates: {:.3f}s, from bytecode cache {:.3f}s'
+          .format(count, timings[0], timings[1]))
+    record('templates_precompile', templates=count, compile_time=timings[0],
+           bytecode_time=timings[1])
+
+
+# Payload building: jinja2 text (and the json.loads needed to inspect or
+# merge it) against the dictionaries built by DictTemplate.
+def bench_payloads(renders=20000):
+    template_vars = {'tn_name': 'Tenant', 'ap_name': 'VRF_ANP',
+                     'epg_name': 'Vlan10_EPG', 'sw1': '101', 'sw2': '102',
+                     'vpc': 'vPC_101_102_PolGrp', 'encap': '10',
+                     'deploy': 'immediate', 'mode': 'regular',
+                     'status': 'created', 'pod': '1'}
+    registry = Aci_Cal_Toolkit.template_registry
+    name = 'FabTnPol/static_path_vpc.json'
+    timings = []
+    for build in (lambda: registry.get_template(name).render(template_vars),
+                  lambda: json.loads(registry.get_template(name)
+                                     .render(template_vars)),
+                  lambda: registry.get_dict_template(name)
+                                  .render(template_vars)):
+        start = time.perf_counter()
+        for i in range(renders):
+            build()
+        timings.append(renders / (time.perf_counter() - start))
+    print('payloads/s: jinja2 text {:.0f}, jinja2 + json.loads {:.0f}, '
+          'dict {:.0f}'.format(*timings))
+    record('payloads', renders=renders, text_per_second=timings[0],
+           text_loads_per_second=timings[1], dict_per_second=timings[2])
+
+
+
+# Parses synthetic fvRsPathAtt DN with the regular expression the scripts
+# used to have, with PATH_ATT_DN (used on the loops over a class), and with the
+# DN parser without and with its cache. Every DN is unique, as the DN of the
+# objects of a class are: the cache always misses.
+def bench_dn(total=200000):
+    dns = ['uni/tn-Tenant{}/ap-ANP/epg-Vlan{}_EPG/rspathAtt-[topology/pod-1/'
+           'paths-{}/pathep-[eth1/{}]]'.format(i % 10, i, 101 + i % 40,
+                                               i % 48 + 1)
+           for i in range(total)]
+    parsers = [('re.search', lambda dn: re.search(
+                   r'\/epg-(.*?)\/.*\/pathep-\[(.*?)\]', dn).group(1, 2)),
+               ('PATH_ATT_DN', lambda dn: PATH_ATT_DN.search(dn).group(1, 2)),
+               ('parse_dn uncached', lambda dn: (
+                   lambda reg: (reg['epg'],
+                                parse_dn.__wrapped__(reg['rspathAtt'])['pathep']))(
+                   parse_dn.__wrapped__(dn))),
+               ('parse_dn', lambda dn: (
+                   lambda reg: (reg['epg'],
+                                parse_dn(reg['rspathAtt'])['pathep']))(
+                   parse_dn(dn)))]
+    parsed = []
+    parse_dn.cache_clear()
+    for name, parser in parsers:
+        start = time.perf_counter()
+        result = [parser(dn) for dn in dns]
+        elapsed = time.perf_counter() - start
+        parsed.append(result)
+        print('{} unique DN with {}: {:.2f}s'.format(total, name, elapsed))
+        record('dn', parser=name, dns=total, time=elapsed)
+    if any(result != parsed[0] for result in parsed[1:]):
+        error('dn', 'the DN parsers returned different data')
+    parse_dn.cache_clear()
+
+
+
+# Checks if every BD of the fabric exists, polling the fvBD class every time
+# and with the index of the subscription manager. Then a BD is created,
+# modified and deleted, and its events must reach the index. At last the
+# subscription expires on the APIC, then the websocket is dropped and the
+# first reconnection refused: every time the manager must subscribe again
+# and keep its index up to date.
+def bench_subscription(apic_ip, cookies, mock, lookups=20):
+    req = Query(apic_ip, cookies)
+    subs = SubscriptionManager(apic_ip, cookies, refresh=1)
+    subs.subscribe('fvBD')
+    subs.start()
+    bds = [obj['dn'] for obj in subs.objects('fvBD')][:lookups]
+    start = time.perf_counter()
+    polled = 0
+    for dn in bds:
+        [status, payload] = req.query_class('fvBD')
+        polled += any(obj['fvBD']['attributes']['dn'] == dn
+                      for obj in payload['imdata'])
+    polling = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = sum(subs.exists('fvBD', dn) for dn in bds)
+    index_time = time.perf_counter() - start
+    print('{} BD lookups: polling {:.3f}s, subscription index {:.6f}s'.format(
+        len(bds), polling, index_time))
+    record('subscription', lookups=len(bds), polling_time=polling,
+           index_time=index_time)
+    if not bds or polled != len(bds) or indexed != len(bds):
+        error('subscription', '{} BD of {} found polling, {} in the '
+              'index'.format(polled, len(bds), indexed))
+
+    def post_bd(dn, **attributes):
+        events = subs.events
+        attributes['dn'] = dn
+        req.conn.post('/api/node/mo/{}.json'.format(dn),
+                      {'fvBD': {'attributes': attributes}}, cookies=cookies)
+        return subs.wait_events(events + 1, timeout=5)
+
+    # wait for at least one refresh of the subscription
+    time.sleep(1.5)
+    dn = 'uni/tn-Tenant0/BD-Subscribed_BD'
+    post_bd(dn, name='Subscribed_BD', status='created')
+    if not subs.exists('fvBD', dn):
+        error('subscription', 'the BD created is not in the index')
+    post_bd(dn, descr='modified')
+    if (subs.get('fvBD', dn) or {}).get('descr') != 'modified':
+        error('subscription', 'the BD modified is not updated in the index')
+    post_bd(dn, status='deleted')
+    if subs.exists('fvBD', dn):
+        error('subscription', 'the BD deleted is still in the index')
+    # the subscription expires on the APIC, then the websocket is dropped
+    for failure in ('expired subscription', 'websocket failure'):
+        with subs.lock:
+            failed = set(subs.subscriptions)
+        if failure == 'expired subscription':
+            with mock.lock:
+                mock.subscriptions.clear()
+        else:
+            mock.refuse_sockets = 1
+            mock.drop_sockets()
+        deadline = time.time() + 15
+        while time.time() < deadline:
+            with subs.lock:
+                renewed = subs.subscriptions and \
+                    not failed & set(subs.subscriptions)
+            if renewed and subs.websocket is not None:
+                break
+            time.sleep(0.1)
+        dn = 'uni/tn-Tenant0/BD-{}_BD'.format(failure.split()[1].title())
+        post_bd(dn, name=dn.split('/BD-')[1], status='created')
+        if not subs.thread.is_alive() or not subs.exists('fvBD', dn):
+            error('subscription', 'the index is not up to date after the {} '
+                  '(thread alive: {}, subscriptions: {})'.format(
+                      failure, subs.thread.is_alive(), subs.subscriptions))
+    subs.stop()
+
+
+# Pushes the objects of 'rows' spreadsheet rows (tenant, vrf, BD, application
+# profile and EPG, spread on a few tenants) row by row as the original push
+# loop, and through the dependency-aware scheduler. Both runs must leave
+# the same objects in the MIT.
+def bench_push(rows=60, tenants=4):
+    timings = []
+    mits = []
+    for scheduled in (False, True):
+        mock = MockApic(latency=LATENCY)
+        apic_ip = mock.start()
+        cookies = FabLogin(apic_ip, 'admin', 'password').login()
+        tnConf = FabTnPol(apic_ip, cookies)
+        sched = PushScheduler(concurrency=8, group_limit=4)
+        start = time.perf_counter()
+        for row in range(rows):
+            tn = 'Tenant{}'.format(row % tenants)
+            objects = [(('tenant', tn), tnConf.tenant, [],
+                        dict(name=tn, status='created')),
+                       (('vrf', tn), tnConf.vrf, [('tenant', tn)],
+                        dict(tn_name=tn, name='VRF', enforce='enforced',
+                             status='created')),
+                       (('bd', tn, row), tnConf.bd, [('vrf', tn)],
+                        dict(tn_name=tn, name='Vlan{}_BD'.format(row),
+                             arp='yes', mdest='bd-flood', mcast='flood',
+                             unicast='no', unk_unicast='flood',
+                             status='created', vrf='VRF', descr='')),
+                       (('app', tn), tnConf.app_profile, [('tenant', tn)],
+                        dict(tn_name=tn, name='VRF_ANP', status='created')),
+                       (('epg', tn, row), tnConf.epg,
+                        [('app', tn), ('bd', tn, row)],
+                        dict(tn_name=tn, ap_name='VRF_ANP',
+                             name='Vlan{}_EPG'.format(row),
+                             bd='Vlan{}_BD'.format(row), status='created'))]
+            for key, func, depends, kwargs in objects:
+                if scheduled:
+                    sched.add(key, func, depends=depends, group=tn, **kwargs)
+                elif key not in sched:
+                    # the serial loop skips the objects already created
+                    sched.add(key, func)
+                    func(**kwargs)
+        if scheduled:
+            sched.run()
+        timings.append(time.perf_counter() - start)
+        mits.append(sorted(mock.mit))
+        mock.stop()
+    if mits[0] != mits[1]:
+        error('push', 'the scheduler pushed different objects')
+    print('push {} rows: row by row {:.3f}s, scheduler {:.3f}s'.format(
+        rows, *timings))
+    record('push', rows=rows, serial_time=timings[0], time=timings[1])
+
+
+
+# Pushes 'objects' tenants with 'concurrency' threads toward a mock APIC
+# throttling the client above 'max_rate' requests per second, without and
+# with the adaptive rate limiter. Throttled requests are retried in both
+# cases, the limiter avoids most of them.
+def bench_rate_limit(objects=600, max_rate=60, concurrency=8):
+    for adaptive in (False, True):
+        mock = MockApic(latency=0.005, max_rate=max_rate)
+        apic_ip = mock.start()
+        cookies = FabLogin(apic_ip, 'admin', 'password').login()
+        tnConf = FabTnPol(apic_ip, cookies)
+        tnConf.conn.limiter.adaptive = adaptive
+        sched = PushScheduler(concurrency=concurrency)
+        for i in range(objects):
+            sched.add(i, tnConf.tenant, name='Tenant{}'.format(i),
+                      status='created')
+        start = time.perf_counter()
+        statuses = sched.run()
+        elapsed = time.perf_counter() - start
+        mock.stop()
+        if any(status != 200 for status in statuses.values()):
+            error('rate_limit', 'some tenants have not been pushed')
+        rate = tnConf.conn.limiter.rate
+        print('push {} objects, APIC limit {}/s, {}: {:.2f}s, {} throttled, '
+              'final rate {}'.format(objects, max_rate,
+                                     'AIMD limiter' if adaptive else 'no limiter',
+                                     elapsed, mock.throttled,
+                                     'unlimited' if rate is None
+                                     else '{:.0f}/s'.format(rate)))
+        record('rate_limit', objects=objects, max_rate=max_rate,
+               adaptive=adaptive, time=elapsed, throttled=mock.throttled,
+               final_rate=rate)
+
+
+# Queries the tenants for 'duration' seconds from a mock APIC whose tokens
+# expire every 'token_timeout' seconds, without and with the FabSession
+# refreshing the token. Half way the token is also dropped by the mock, as
+# after an APIC reload, to check the re-authentication on 403.
+def bench_session(token_timeout=6, duration=15, interval=0.5):
+    keepalive = Aci_Cal_Toolkit.SESSION_KEEPALIVE
+    for enabled in (False, True):
+        Aci_Cal_Toolkit.SESSION_KEEPALIVE = enabled
+        mock = MockApic(latency=0.005, token_timeout=token_timeout)
+        populate_tenants(mock, tenants=2, bds=2)
+        apic_ip = mock.start()
+        apic = FabLogin(apic_ip, 'admin', 'password')
+        cookies = apic.login()
+        req = Query(apic_ip, cookies, cache=Aci_Cal_Toolkit.MitCache(ttl=0))
+        failed = 0
+        queries = 0
+        start = time.monotonic()
+        dropped = False
+        while time.monotonic() - start < duration:
+            if not dropped and time.monotonic() - start > duration / 2:
+                with mock.lock:
+                    mock.tokens.clear()
+                dropped = True
+            [status, payload] = req.query_class('fvTenant')
+            queries += 1
+            if status != 200:
+                failed += 1
+            time.sleep(interval)
+        print('{:.0f}s of queries, token timeout {}s, {}: {} of {} failed, '
+              '{} logins, {} refreshes'.format(
+                  duration, token_timeout,
+                  'session keepalive' if enabled else 'no keepalive',
+                  failed, queries, mock.logins, mock.refreshes))
+        record('session', keepalive=enabled, queries=queries, failed=failed,
+               logins=mock.logins, refreshes=mock.refreshes)
+        if enabled and failed:
+            error('session', '{} of {} queries failed with the session '
+                  'keepalive'.format(failed, queries))
+        if enabled:
+            check_session_relogin(apic, mock, req)
+        if apic.session is not None:
+            apic.session.stop()
+        mock.stop()
+    Aci_Cal_Toolkit.SESSION_KEEPALIVE = keepalive
+
+
+# The token of a session kept alive expires and the next logins are refused
+# (401 then 503): the keepalive thread must keep retrying until it logs in.
+def check_session_relogin(apic, mock, req, timeout=20):
+    session = apic.session
+    relogins = session.relogins
+    with mock.lock:
+        mock.refused_logins = [401, 503]
+        mock.tokens.clear()
+    deadline = time.monotonic() + timeout
+    while session.relogins == relogins and time.monotonic() < deadline:
+        time.sleep(0.2)
+    [status, payload] = req.query_class('fvTenant')
+    if not session.thread.is_alive() or session.relogins == relogins or \
+            status != 200:
+        error('session', 'the keepalive did not log in again after the '
+              'refused logins (thread alive: {}, query status {})'.format(
+                  session.thread.is_alive(), status))
+
+
+# Runs the tenant queries against a mock cluster of 'controllers' APIC, one
+# of them is stopped half way. Prints how the queries have been spread on
+# the controllers and checks that none of them failed, and that the stopped
+# controller is not queried anymore once failed over.
+def bench_cluster(controllers=3, queries=60, concurrency=8):
+    mock = MockApic(latency=LATENCY)
+    populate_tenants(mock, tenants=2, bds=2)
+    urls = [mock.start() for i in range(controllers)]
+    apic_ip = ','.join(urls)
+    cookies = FabLogin(apic_ip, 'admin', 'password').login()
+    req = Query(apic_ip, cookies, cache=Aci_Cal_Toolkit.MitCache(ttl=0))
+
+    def query(i):
+        if i == queries // 2:
+            mock.stop_controller(urls[-1])
+        return req.query_class('fvTenant')[0]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        statuses = list(executor.map(query, range(queries)))
+    elapsed = time.perf_counter() - start
+    # once failed over, the stopped controller must not be queried anymore
+    stopped = req.conn.stats()['controllers'][urls[-1]]
+    statuses += [req.query_class('fvTenant')[0] for i in range(controllers)]
+    stats = req.conn.stats()
+    req.conn.close()
+    mock.stop()
+    failed = sum(1 for status in statuses if status != 200)
+    print('{} queries on {} controllers, one stopped: {:.3f}s, {} failed, '
+          '{} failovers, per controller {}'.format(
+              queries, controllers, elapsed, failed, stats['failovers'],
+              list(stats['controllers'].values())))
+    record('cluster', controllers=controllers, queries=queries, time=elapsed,
+           failed=failed, failovers=stats['failovers'],
+           per_controller=list(stats['controllers'].values()))
+    if failed or stats['failovers'] != 1:
+        error('cluster', '{} queries failed, {} failovers'.format(
+            failed, stats['failovers']))
+    if stats['controllers'][urls[-1]] != stopped:
+        error('cluster', 'the stopped controller was queried {} times after '
+              'the failover'.format(stats['controllers'][urls[-1]] - stopped))
+
+
+# Starts the metrics exporter, pushes 'tenants' tenants with the scheduler,
+# queries them twice with the MIT cache and asks for an unknown url, then
+# scrapes the exporter in both formats and checks the counters against
+# what was done. Reports the time taken by a scrape.
+def bench_metrics(tenants=20):
+    import aci_metrics
+    import requests
+    mock = MockApic(latency=LATENCY)
+    apic_ip = mock.start()
+    exporter = aci_metrics.MetricsExporter(port=0)
+    url = exporter.start()
+    try:
+        cookies = FabLogin(apic_ip, 'admin', 'password').login()
+        tnConf = FabTnPol(apic_ip, cookies)
+        sched = PushScheduler(concurrency=8)
+        for t in range(tenants):
+            sched.add(('tenant', t), tnConf.tenant, name='Tenant{}'.format(t),
+                      status='created')
+        sched.run()
+        cache = Aci_Cal_Toolkit.MitCache(ttl=60)
+        exporter.cache = cache
+        req = Query(apic_ip, cookies, cache=cache)
+        req.query_class('fvTenant')
+        req.query_class('fvTenant')
+        req.query_url('/api/unknown.json')
+        start = time.perf_counter()
+        text = requests.get(url).text
+        elapsed = time.perf_counter() - start
+        r = requests.get(url, headers={'Accept': 'application/openmetrics-text'})
+    finally:
+        exporter.stop()
+        mock.stop()
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            [name, value] = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    expected = {
+        'aci_requests_total{{apic="{}",method="POST",aci_class="fvTenant",'
+        'template="tenant.json"}}'.format(apic_ip): tenants,
+        'aci_requests_total{{apic="{}",method="GET",aci_class="fvTenant",'
+        'template=""}}'.format(apic_ip): 1,
+        'aci_request_errors_total{{apic="{}",status="400"}}'.format(apic_ip): 1,
+        'aci_mit_cache_hits_total': 1,
+        'aci_mit_cache_misses_total': 1,
+        'aci_batches_in_flight{kind="PushScheduler"}': 0,
+        'aci_batch_objects_total{kind="PushScheduler"}': tenants,
+        'aci_batch_duration_seconds_count{kind="PushScheduler"}': 1,
+    }
+    for name, value in expected.items():
+        if samples.get(name) != value:
+            error('metrics', '{} is {}, expected {}'.format(
+                name, samples.get(name), value))
+    if samples.get('aci_request_sent_bytes_total{{apic="{}"}}'.format(
+            apic_ip), 0) <= 0:
+        error('metrics', 'no bytes sent counted')
+    if not r.headers['Content-Type'].startswith(
+            'application/openmetrics-text') or \
+            not r.text.endswith('# EOF\n'):
+        error('metrics', 'the OpenMetrics format is not served')
+    print('metrics: {} samples scraped in {:.3f}s'.format(len(samples), elapsed))
+    record('metrics', samples=len(samples), time=elapsed)
+
+
+# Time taken by 'posts' posts of a BD in a dry run (PUSH_TO_APIC False, the
+# payloads are always logged) with the console redirected to a file: logged
+# by the caller, by the background writer, sampled with a json lines file,
+# and below the level. The time for the writer to catch up is reported apart.
+def bench_logging(posts=2000):
+    mock = MockApic()
+    apic_ip = mock.start()
+    cookies = FabLogin(apic_ip, 'admin', 'password').login()
+    tnConf = FabTnPol(apic_ip, cookies)
+    modes = [('caller', dict(background=False)),
+             ('background', dict()),
+             ('sampled', dict(payload_sample=10, log_file='bench_log.jsonl')),
+             ('warning', dict(level='WARNING'))]
+    push_to_apic = Aci_Cal_Toolkit.PUSH_TO_APIC
+    Aci_Cal_Toolkit.PUSH_TO_APIC = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            for name, options in modes:
+                aci_log.setup(**options)
+                with open('console.txt', 'w') as console:
+                    with contextlib.redirect_stdout(console):
+                        start = time.perf_counter()
+                        for i in range(posts):
+                            tnConf.bd(tn_name='Tenant', name='Vlan{}_BD'.format(i),
+                                      arp='yes', mdest='bd-flood', mcast='flood',
+                                      unicast='no', unk_unicast='flood',
+                                      status='created', vrf='VRF', descr='')
+                        elapsed = time.perf_counter() - start
+                        aci_log.flush()
+                        drained = time.perf_counter() - start
+                    size = console.tell()
+                print('logging {} posts {}: {:.3f}s, written after {:.3f}s, '
+                      '{} KB of console'.format(posts, name, elapsed, drained,
+                                                size // 1024))
+                record('logging_' + name, posts=posts, time=elapsed,
+                       drained=drained, console_bytes=size)
+        finally:
+            # back to the logging of the LOG_* options of the toolkit
+            Aci_Cal_Toolkit.setup_logging()
+            os.chdir(cwd)
+            Aci_Cal_Toolkit.PUSH_TO_APIC = push_to_apic
+            mock.stop()
+
+
+# Runs 'queries' class queries with a RequestStats collecting them, checks
+# the counts and the percentiles of known lists, reports the overhead of
+# the hook on the queries.
+def bench_request_stats(queries=200):
+    checks = [([1, 2, 3, 4, 5], 50, 3), ([1, 2, 3], 50, 2), ([1, 2], 50, 1),
+              ([1, 2, 3, 4], 50, 2), (list(range(1, 101)), 95, 95),
+              (list(range(1, 101)), 99, 99), (list(range(1, 11)), 95, 10),
+              ([7], 99, 7), ([1, 2, 3], 0, 1), ([1, 2, 3], 100, 3)]
+    for values, p, expected in checks:
+        if Aci_Cal_Toolkit.percentile(values, p) != expected:
+            error('request_stats', 'percentile({}, {}) is {}, expected {}'.format(
+                values, p, Aci_Cal_Toolkit.percentile(values, p), expected))
+    mock = MockApic()
+    populate_tenants(mock, tenants=2, bds=2)
+    apic_ip = mock.start()
+    cookies = FabLogin(apic_ip, 'admin', 'password').login()
+    req = Query(apic_ip, cookies, cache=Aci_Cal_Toolkit.MitCache(ttl=0))
+    timings = []
+    stats = Aci_Cal_Toolkit.RequestStats()
+    for hooked in (False, True):
+        if hooked:
+            Aci_Cal_Toolkit.add_request_hook(after=stats)
+        start = time.perf_counter()
+        for i in range(queries):
+            req.query_class('fvTenant')
+        timings.append(time.perf_counter() - start)
+    Aci_Cal_Toolkit.remove_request_hook(stats)
+    mock.stop()
+    summary = stats.summary(by_class=True).get('GET fvTenant')
+    if summary is None or summary['count'] != queries:
+        error('request_stats', 'the queries collected are {}'.format(summary))
+    print('request_stats {} queries: without hook {:.3f}s, with {:.3f}s'.format(
+        queries, *timings))
+    record('request_stats', queries=queries, time=timings[1],
+           unhooked_time=timings[0])
+
+
+# The objects of 'rows' rows (BD and EPG) in 'tenants' tenants, with their
+# tenant, vrf and application profile, as (method name, kwargs)
+def tenant_rows(rows, tenants):
+    objects = []
+    for t in range(tenants):
+        tn = 'Tenant{}'.format(t)
+        objects.append(('tenant', dict(name=tn, status='created')))
+        objects.append(('vrf', dict(tn_name=tn, name='VRF', enforce='enforced',
+                                    status='created')))
+        objects.append(('app_profile', dict(tn_name=tn, name='VRF_ANP',
+                                            status='created')))
+    for row in range(rows):
+        tn = 'Tenant{}'.format(row % tenants)
+        objects.append(('bd', dict(tn_name=tn, name='Vlan{}_BD'.format(row),
+                                   arp='yes', mdest='bd-flood', mcast='flood',
+                                   unicast='no', unk_unicast='flood',
+                                   status='created', vrf='VRF', descr='')))
+        objects.append(('epg', dict(tn_name=tn, ap_name='VRF_ANP',
+                                    name='Vlan{}_EPG'.format(row),
+                                    bd='Vlan{}_BD'.format(row),
+                                    status='created')))
+    return objects
+
+
+# Pushes the same tenant objects with a POST each and with FabBatch: the
+# MIT must be the same, every object committed, and the batch must take a
+# single POST per tenant (the objects of a tenant are less than 'size').
+def bench_batch(rows=60, tenants=4, size=50):
+    objects = tenant_rows(rows, tenants)
+    timings = []
+    mits = []
+    for batched in (False, True):
+        mock = MockApic(latency=LATENCY)
+        # the root of the trees posted by the batch, always on the APIC
+        mock.add('polUni', {'dn': 'uni'})
+        apic_ip = mock.start()
+        cookies = FabLogin(apic_ip, 'admin', 'password').login()
+        conn = Aci_Cal_Toolkit.get_connection(apic_ip)
+        batch = Aci_Cal_Toolkit.FabBatch(conn, cookies, size=size)
+        tnConf = FabTnPol(apic_ip, cookies, conn=batch if batched else conn)
+        requests = mock.requests
+        start = time.perf_counter()
+        for method, kwargs in objects:
+            getattr(tnConf, method)(**kwargs)
+        if batched:
+            results = batch.commit()
+        timings.append(time.perf_counter() - start)
+        posts = mock.requests - requests
+        mits.append(sorted(mock.mit.items()))
+        mock.stop()
+    if mits[0] != mits[1]:
+        error('batch', 'the batch committed different objects')
+    if len(results) != len(objects) or \
+            any(status != 200 for uri, status in results):
+        error('batch', 'not every object was committed: {}'.format(
+            [result for result in results if result[1] != 200]))
+    if posts != tenants or batch.posts != tenants:
+        error('batch', '{} POST for {} tenants'.format(posts, tenants))
+    print('batch {} objects: a POST each {:.3f}s, {} batched POST {:.3f}s'.format(
+        len(objects), timings[0], posts, timings[1]))
+    record('batch', objects=len(objects), serial_time=timings[0],
+           time=timings[1], posts=posts)
+
+
+# Pushes the same tenant objects and queries their classes one after the
+# other and with AsyncFab, at most 'concurrency' requests in flight: the
+# MIT and the answers must be the same.
+def bench_async(rows=60, tenants=4, concurrency=8):
+    objects = tenant_rows(rows, tenants)
+    classes = ['fvTenant', 'fvCtx', 'fvAp', 'fvBD', 'fvAEPg', 'fvRsCtx']
+    timings = []
+    mits = []
+    answers = []
+    for parallel in (False, True):
+        mock = MockApic(latency=LATENCY)
+        apic_ip = mock.start()
+        cookies = FabLogin(apic_ip, 'admin', 'password').login()
+        tnConf = FabTnPol(apic_ip, cookies)
+        req = Query(apic_ip, cookies, cache=Aci_Cal_Toolkit.MitCache(ttl=0))
+        start = time.perf_counter()
+        if parallel:
+            client = Aci_Cal_Toolkit.AsyncFabClient(apic_ip, concurrency)
+            async_tn = Aci_Cal_Toolkit.AsyncFab(tnConf, client)
+            async_req = Aci_Cal_Toolkit.AsyncFab(req, client)
+
+            async def push_and_query():
+                # the tenants first, every other object depends on them
+                statuses = []
+                for step in (objects[:3 * tenants], objects[3 * tenants:]):
+                    statuses += await asyncio.gather(
+                        *[getattr(async_tn, method)(**kwargs)
+                          for method, kwargs in step])
+                queries = await asyncio.gather(
+                    *[async_req.query_class(aci_class) for aci_class in classes])
+                return statuses, queries
+            [statuses, queries] = asyncio.run(push_and_query())
+            client.close()
+        else:
+            statuses = [getattr(tnConf, method)(**kwargs)
+                        for method, kwargs in objects]
+            queries = [req.query_class(aci_class) for aci_class in classes]
+        timings.append(time.perf_counter() - start)
+        mits.append(sorted(mock.mit.items()))
+        answers.append([(status, sorted(obj[aci_class]['attributes']['dn']
+                                        for obj in payload['imdata']))
+                        for aci_class, [status, payload] in zip(classes, queries)])
+        mock.stop()
+        if any(status != 200 for status in statuses):
+            error('async', 'failed pushes, parallel {}'.format(parallel))
+    if mits[0] != mits[1] or answers[0] != answers[1]:
+        error('async', 'AsyncFab pushed or read different objects')
+    print('async {} objects and {} queries: serial {:.3f}s, AsyncFab {:.3f}s'
+          .format(len(objects), len(classes), *timings))
+    record('async', objects=len(objects), queries=len(classes),
+           serial_time=timings[0], time=timings[1])
+
+
+# Runs a script of this directory against the mock APIC, with the
+# credentials of the mock in place of credentials.py and its output
+# discarded. 'replace' maps strings of the source (i.e. the paths
+# configured at the beginning of the script) to their replacement.
+# Returns the wall clock time of the run.
+def run_script(script, apic_ip, replace=None):
+    credentials = types.ModuleType('credentials')
+    credentials.apic_ip = apic_ip
+    credentials.apic_user = 'admin'
+    credentials.apic_pwd = 'password'
+    saved = sys.modules.get('credentials')
+    sys.modules['credentials'] = credentials
+    with open(SCRIPT_DIR + script) as f:
+        source = f.read()
+    for old, new in (replace or {}).items():
+        source = source.replace(old, new)
+    code = compile(source, script, 'exec')
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                try:
+                    exec(code, {'__name__': '__main__'})
+                finally:
+                    aci_log.flush()
+    finally:
+        if saved is not None:
+            sys.modules['credentials'] = saved
+        else:
+            del sys.modules['credentials']
+    return time.perf_counter() - start
+
+
+# create_switch_profiles.py on a fabric of 'leaves' leaf switches without
+# any profile, all of them are created
+def bench_create_switch_profiles(leaves=40):
+    mock = MockApic(latency=LATENCY)
+    for i in range(leaves):
+        mock.add('fabricNode', {'dn': 'topology/pod-1/node-{}'.format(101 + i),
+                                'id': str(101 + i), 'role': 'leaf',
+                                'name': 'Leaf{}'.format(101 + i)})
+    apic_ip = mock.start()
+    elapsed = run_script('create_switch_profiles.py', apic_ip)
+    mock.stop()
+    profiles = sum(1 for dn in mock.mit if '/accportprof-' in dn)
+    if profiles != leaves + leaves // 2:
+        error('create_switch_profiles', 'create_switch_profiles.py created '
+              '{} interface profiles instead of {}'.format(
+                  profiles, leaves + leaves // 2))
+    print('create_switch_profiles.py {} leaves: {:.3f}s, {} requests'.format(
+        leaves, elapsed, mock.requests))
+    record('create_switch_profiles', leaves=leaves, time=elapsed,
+           requests=mock.requests, objects=len(mock.mit))
+
+
+# Runs from_vlan_list_to_aci.py against the mock on the sheet of the
+# synthetic fabric, returns the wall clock time
+def run_from_vlan_list(synth, apic_ip):
+    with tempfile.TemporaryDirectory() as excel_dir:
+        synth.write_vlan_sheet(os.path.join(excel_dir, 'ACI_vlan_list.xlsx'))
+        out_file = os.path.join(excel_dir, 'ACI_vlan_list_out.xlsx')
+        return run_script('from_vlan_list_to_aci.py', apic_ip, {
+            'C:/path_to_excel_data/': excel_dir + '/',
+            'C:/Users/601787621/Documenti/Snam/ACI e VMWare/'
+            'ACI_vlan_list_out.xlsx': out_file})
+
+
+# Counts the EPG of the legacy vlans pushed to the mock
+def pushed_epgs(synth, mock):
+    return sum(1 for vlan in synth.legacy
+               if 'uni/tn-{}/ap-{}_ANP/epg-{}_EPG'.format(
+                   vlan['tenant'], vlan['vrf'], vlan['name']) in mock.mit)
+
+
+# A synthetic run of from_vlan_list_to_aci.py: the 'rows' legacy vlans of
+# a synthetic fabric (see aci_synth.py) are checked and pushed to it
+def bench_from_vlan_list(rows=200):
+    synth = SyntheticFabric(seed=SEED, leaves=8, tenants=4, vlans=rows)
+    mock = MockApic(latency=LATENCY)
+    synth.populate(mock)
+    apic_ip = mock.start()
+    requests = mock.requests
+    elapsed = run_from_vlan_list(synth, apic_ip)
+    requests = mock.requests - requests
+    mock.stop()
+    epgs = pushed_epgs(synth, mock)
+    if epgs != rows:
+        error('from_vlan_list', 'from_vlan_list_to_aci.py created {} EPG '
+              'instead of {}'.format(epgs, rows))
+    print('from_vlan_list_to_aci.py {} rows: {:.3f}s, {} requests'.format(
+        rows, elapsed, requests))
+    record('from_vlan_list', rows=rows, time=elapsed, requests=requests)
+
+
+# Runs from_Nexus_to_excel_vlan_list.py on the Nexus configurations of the
+# synthetic fabric, returns the wall clock time
+def run_from_nexus(synth):
+    with tempfile.TemporaryDirectory() as work_dir:
+        configs = synth.write_nexus_configs(work_dir)
+        return run_script('from_Nexus_to_excel_vlan_list.py', None, {
+            'C:/Users/my_output_directory/': work_dir + '/',
+            'C:/Users/customer_configurations_path/': work_dir + '/',
+            '["Nexus_config_1.txt", "Nexus_config_2.txt", '
+            '"Nexus_config_3.txt"]': repr(configs)})
+
+
+# The same runs on synthetic data sets 'scales' times bigger than today's
+# fabric, without latency since the CPU time is what grows: query_ports on
+# the whole fabric, the Nexus configurations parsing and the validation and
+# push of from_vlan_list_to_aci.py.
+def bench_scale(scales=SCALES):
+    for scale in scales:
+        synth = SyntheticFabric(seed=SEED, scale=scale)
+        mock = MockApic()
+        objects = synth.populate(mock)
+        apic_ip = mock.start()
+        req = Query(apic_ip, None, cache=Aci_Cal_Toolkit.MitCache(ttl=0))
+        start = time.perf_counter()
+        node_data = req.query_ports(verbose=False)
+        ports_time = time.perf_counter() - start
+        nexus_time = run_from_nexus(synth)
+        requests = mock.requests
+        vlan_time = run_from_vlan_list(synth, apic_ip)
+        requests = mock.requests - requests
+        mock.stop()
+        epgs = pushed_epgs(synth, mock)
+        if len(node_data) != synth.leaves or epgs != len(synth.legacy):
+            error('scale', 'scale {}: {} leaves of {} in query_ports, {} EPG '
+                  'of {} pushed'.format(scale, len(node_data), synth.leaves,
+                                        epgs, len(synth.legacy)))
+        print('scale {}x ({} objects, {} leaves, {} vlans): query_ports '
+              '{:.3f}s, Nexus parsing {:.3f}s, from_vlan_list_to_aci.py '
+              '{:.3f}s ({} requests)'.format(scale, objects, synth.leaves,
+                                             len(synth.legacy), ports_time,
+                                             nexus_time, vlan_time, requests))
+        record('scale', scale=scale, objects=objects, leaves=synth.leaves,
+               vlans=len(synth.legacy), query_ports_time=ports_time,
+               nexus_time=nexus_time, from_vlan_list_time=vlan_time,
+               from_vlan_list_requests=requests)
+
+
+# The benchmarks sharing the populated mock of main()
+def bench_tenants():
+    mock = MockApic(latency=LATENCY)
+    populate_tenants(mock)
+    apic_ip = mock.start()
+    apic = FabLogin(apic_ip, 'admin', 'password')
+    cookies = apic.login()
+    bench_query_all_tenants(apic_ip, cookies)
+    bench_query_all_tenants_modes(apic_ip, cookies, mock)
+    bench_subscription(apic_ip, cookies, mock)
+    mock.stop()
+
+
+benchmarks = ['templates', 'payloads', 'dn', 'query_ports', 'query_vpc',
+              'tenants', 'create_switch_profiles', 'from_vlan_list', 'batch',
+              'async', 'push', 'rate_limit', 'session', 'cluster', 'metrics',
+              'logging', 'request_stats', 'scale']
+
+
+if __name__ == '__main__':
+    Aci_Cal_Toolkit.PRINT_PAYLOAD = False
+    Aci_Cal_Toolkit.PRINT_QUERY_PORTS = False
+    # only the local mock APIC is used
+    Aci_Cal_Toolkit.PUSH_TO_APIC = True
+    Aci_Cal_Toolkit.json_path = JSON_PATH
+    args = sys.argv[1:]
+    json_file = None
+    if '--json' in args:
+        json_file = args[args.index('--json') + 1]
+        del args[args.index('--json'):args.index('--json') + 2]
+    for name in args:
+        if name not in benchmarks:
+            print('Unknown benchmark {}, available: {}'.format(
+                name, ' '.join(benchmarks)))
+            exit(1)
+    start = time.perf_counter()
+    for name in args or benchmarks:
+        globals()['bench_' + name]()
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'latency': LATENCY,
+                       'elapsed': time.perf_counter() - start,
+                       'results': results}, f, indent=4)
+        print('Results saved in ' + json_file)
+    # the checks of the benchmarks gate the changes, any error fails the run
+    errors = [result for result in results if 'error' in result]
+    if errors:
+        print('{} errors in the benchmarks: {}'.format(
+            len(errors), ', '.join(sorted(set(
+                result['benchmark'] for result in errors)))))
+        exit(1)
@@ -1,4 +1,6 @@
 # centralized apic credentials
+# apic_ip can also list all the controllers of the cluster, separated by
+# commas: "x.y.z.t,x.y.z.u,x.y.z.v"
 apic_ip = "x.y.z.t"
 apic_url = "https://x.y.z.t"
 apic_user = "apic_usr"
@@ -0,0 +1,164 @@
+# This python script runs the same job against several ACI fabrics at the same
+# time, instead of editing credentials.py and running the script once per fabric.
+# Every fabric is handled by a separate worker process, the results and the time
+# spent on every fabric are collected into a single report.
+#
+#   python fabric_runner.py create_switch_profiles.py
+#   python fabric_runner.py ACI_class_to_excel.py fabrics.json
+#   python fabric_runner.py my_module:my_function
+#
+# The inventory is a json file with the list of the fabrics, 'apic_ip' can
+# also list all the controllers of the cluster separated by commas. The optional
+# 'options' are set on the toolkit before running the job, i.e. PUSH_TO_APIC:
+#
+#   [{"name": "DC1", "apic_ip": "10.1.0.1", "apic_user": "admin", "apic_pwd": "...",
+#     "options": {"PUSH_TO_APIC": true}},
+#    {"name": "DC2", "apic_ip": "10.2.0.1,10.2.0.2,10.2.0.3", ...}]
+#
+# A job is either a script of this directory, run as it is with the credentials
+# of the fabric in place of credentials.py, or a 'module:function' called with
+# the dictionary of the fabric, whose return value ends up in the report.
+# Every fabric runs in its own directory under 'output_dir' (where relative
+# output files are saved), the output of the job goes to '<name>.log' there.
+import concurrent.futures
+import contextlib
+import importlib
+import json
+import os
+import runpy
+import sys
+import time
+import types
+from tabulate import tabulate
+
+inventory_file = "fabrics.json"
+output_dir = "fabric_runs/"
+report_file = "fabric_report.json"
+
+# maximum number of fabrics handled at the same time, one process each
+fanout_processes = 4
+
+
+# Runs the job against a single fabric, in a worker process. Never raises,
+# failures are reported in the returned dictionary.
+def run_job(job, fabric, output_dir=output_dir):
+    import Aci_Cal_Toolkit
+    import aci_log
+    name = fabric['name']
+    fabric_dir = os.path.abspath(os.path.join(output_dir, name))
+    os.makedirs(fabric_dir, exist_ok=True)
+    log_file = os.path.join(fabric_dir, name + '.log')
+    result = {'fabric': name, 'apic': fabric['apic_ip'], 'status': 'ok',
+              'error': None, 'result': None, 'requests': 0, 'log': log_file}
+    # the scripts import their credentials from credentials.py
+    credentials = types.ModuleType('credentials')
+    credentials.apic_ip = fabric['apic_ip']
+    credentials.apic_url = 'https://' + fabric['apic_ip'].split(',')[0]
+    credentials.apic_user = fabric['apic_user']
+    credentials.apic_pwd = fabric['apic_pwd']
+    sys.modules['credentials'] = credentials
+    # the worker process is reused, options are restored at the end
+    saved = {}
+    for option, value in fabric.get('options', {}).items():
+        saved[option] = getattr(Aci_Cal_Toolkit, option)
+        setattr(Aci_Cal_Toolkit, option, value)
+    script = job.endswith('.py')
+    if script:
+        job = os.path.abspath(job)
+    else:
+        [module, function] = job.rsplit(':', 1)
+        target = getattr(importlib.import_module(module), function)
+    cwd = os.getcwd()
+    start = time.perf_counter()
+    with open(log_file, 'w') as log:
+        with contextlib.redirect_stdout(log):
+            try:
+                os.chdir(fabric_dir)
+                if script:
+                    runpy.run_path(job, run_name='__main__')
+                else:
+                    result['result'] = target(fabric)
+            except SystemExit as e:
+                # the scripts and the toolkit only exit on failures (login
+                # refused, errors in the input data ...), even with exit(0)
+                result['status'] = 'failed'
+                result['error'] = 'exit {}'.format(e.code)
+            except Exception as e:
+                result['status'] = 'failed'
+                result['error'] = '{}: {}'.format(type(e).__name__, e)
+            finally:
+                # the records still queued belong to the log of the fabric
+                aci_log.flush()
+                os.chdir(cwd)
+                for option, value in saved.items():
+                    setattr(Aci_Cal_Toolkit, option, value)
+    if result['status'] == 'failed' and result['error'].startswith('exit'):
+        # the reason is the last message of the job
+        message = last_line(log_file)
+        if message:
+            result['error'] += ': ' + message
+    result['elapsed'] = round(time.perf_counter() - start, 3)
+    conn = Aci_Cal_Toolkit.connections.get(fabric['apic_ip'])
+    if conn is not None:
+        result['requests'] = conn.stats()['requests']
+    return result
+
+
+# Returns the last non empty line of a file
+def last_line(file_name):
+    with open(file_name) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines[-1] if lines else None
+
+
+# Runs the job against all the fabrics, at most 'processes' at the same
+# time, returns the list of the results in the order of the inventory
+def run_fabrics(job, fabrics, processes=fanout_processes,
+                output_dir=output_dir):
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(run_job, job, fabric, output_dir)
+                   for fabric in fabrics]
+        results = []
+        for fabric, future in zip(fabrics, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # the worker process died
+                results.append({'fabric': fabric['name'],
+                                'apic': fabric['apic_ip'], 'status': 'failed',
+                                'error': '{}: {}'.format(type(e).__name__, e),
+                                'result': None, 'requests': 0, 'log': None,
+                                'elapsed': None})
+    return {'job': job,
+            'elapsed': round(time.perf_counter() - start, 3),
+            'fabrics': results}
+
+
+def print_report(report):
+    table = [[r['fabric'], r['apic'], r['status'], r['elapsed'], r['requests'],
+              r['error'] or ''] for r in report['fabrics']]
+    print(tabulate(table, headers=['fabric', 'apic', 'status', 'time (s)',
+                                   'requests', 'error']))
+    failed = sum(1 for r in report['fabrics'] if r['status'] != 'ok')
+    print('{} fabrics, {} failed, total time {:.1f}s'.format(
+        len(report['fabrics']), failed, report['elapsed']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python fabric_runner.py <script.py | module:function> '
+              '[inventory.json]')
+        exit(1)
+    job = sys.argv[1]
+    if len(sys.argv) > 2:
+        inventory_file = sys.argv[2]
+    with open(inventory_file) as f:
+        fabrics = json.load(f)
+    print('Running {} on {} fabrics ...'.format(job, len(fabrics)))
+    report = run_fabrics(job, fabrics)
+    print_report(report)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, report_file), 'w') as f:
+        json.dump(report, f, indent=4, default=str)
+    print('Report saved in ' + os.path.join(output_dir, report_file))
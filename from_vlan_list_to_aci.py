@@ -63,10 +63,13 @@
 # could slow down the write operations, which are atomically approached for safety reasons:
 # a tenant configuration is NOT pushed together with its vrf, bd, epg or whatsoever, operations
 # are always performed in a minimal way: a single tenant is created, a single vrf is created and so on.
-import openpyxl
-from openpyxl.styles import PatternFill
 import re
+import sys
 from Aci_Cal_Toolkit import FabLogin, Query, FabTnPol
+from aci_dn import parse_dn
+from aci_excel import read_vlan_rows, SheetWriter
+from aci_scheduler import PushScheduler
+from aci_journal import PushJournal
 from credentials import apic_ip, apic_pwd, apic_user
 from tabulate import tabulate
 
@@ -74,20 +77,36 @@ from tabulate import tabulate
 # 'ACI translate' is the tab name containing all data to be pushed to the APIC
 excel_dir = "C:/path_to_excel_data/"
 file_name = "ACI_vlan_list.xlsx"
-targ = openpyxl.load_workbook(excel_dir + file_name)
-sheet = targ.get_sheet_by_name("ACI translate")
-xls_cols = {}
+sheet_name = "ACI translate"
 
-# We read the first line of the table, and find the column letter to be assigned to every
-# column. In this way, columns can be swapped, new columns can be inserted, and there is
-# no need to update the script.
+# maximum number of queries performed at the same time while pushing the objects,
+# in total and for the same tenant
+push_concurrency = 8
+push_tenant_concurrency = 4
+
+# Every object pushed is recorded in the journal file as soon as it is committed.
+# When a run is interrupted, run the script again with --resume: the objects
+# already committed are not pushed again.
+journal_file = excel_dir + "ACI_vlan_list.journal"
+resume = '--resume' in sys.argv
+journal = PushJournal(journal_file)
+if resume:
+    if not journal.exists():
+        print ("Nothing to resume, the journal "+journal_file+" does not exist")
+        exit(0)
+    journal.load()
+    print('Resuming the run, {} objects already committed'.format(
+        sum(1 for status in journal.statuses.values() if status == 200)))
+
+# The sheet is read only once, every line becomes a VlanRow (see aci_excel.py).
+# Columns are found by the name in the first line of the table. In this way,
+# columns can be swapped, new columns can be inserted, and there is no need
+# to update the script.
 #
-# apparato    tenant    vrf    vlan_number    l2_vlan_name    app_profile    ip_addr    description    interfaces
-for col in range(0, sheet.max_column):
-    xls_cols[sheet[chr(ord('A')+int(col))+'1'].value] = chr(ord('A')+col)
-# we will now refer to the columns in the following way:
-# xls_cols['variable']
-# xls_cols['description']
+# apparato    tenant    vrf    vlan_number    l2_vlan_name    app_profile    ip_addr    descr    interfaces
+xls_rows = read_vlan_rows(excel_dir + file_name, sheet_name)
+# colors and filled values are written on the output file at the end
+writer = SheetWriter(excel_dir + file_name, sheet_name)
 
 apic = FabLogin (apic_ip, apic_user, apic_pwd)
 cookies = apic.login()
@@ -108,398 +127,435 @@ tnConf = FabTnPol(apic_ip, cookies)
 print('Retrieving all the port-channels and vPC ...')
 vpc_dn = req.query_vpc()
 
-print('Retrieving all fabric ports information ...')
-ports_data = req.query_ports()
-
-# let's read all the present tenants, vrf, BDs to check for double information
-# and already existent policies.
-print("Retrieving all tenants information (vrf, bd, subnets, anp, epg) could take a while ...\n\n")
-apic_data = req.query_all_tenants()
-
-
-fatal_error = 0
-# we now check that if BD are NOT new, we are not over-writing something. In case
-# the ip address is defined in the excel, the BD already exists but it doesn't
-# have an ip defined, we just print a warning. If an ip address already exists,
-# we raise a fatal error: we suppose here that every BD can be associated to just
-# one subnet. Regadring application profile, we do not think there are problems
-# in case the application profile already exists or not. A warning could be printed
-# anyway in case the application profile already exists (????).
-# We also check that in every row a tenant and a vrf is defined.
-print('Checking for errors inside the excel file on tenant, vrf, BD columns ...')
-for row in range(2, sheet.max_row+1):
-    bd_name = str(sheet[xls_cols['l2_vlan_name']+str(row)].value).strip()
-    if bd_name == 'None':
-        print ('ERROR in row '+str(row)+' empty BD name')
-        fatal_error = 1
-        continue
-    tenant = str(sheet[xls_cols['tenant']+str(row)].value).strip()
-    if tenant == 'None':
-        print ('ERROR in row '+str(row)+' empty TENANT name')
-        fatal_error = 1
-        continue
-    vrf = str(sheet[xls_cols['vrf']+str(row)].value).strip()
-    if vrf == 'None':
-        print ('ERROR in row '+str(row)+' empty VRF name')
-        fatal_error = 1
-        continue
-    sub_scope = str(sheet[xls_cols['route_type']+str(row)].value).strip()
-    if (sheet[xls_cols['route_type']+str(row)].value != None):
-        sub_scope = str(sheet[xls_cols['route_type']+str(row)].value).strip()
-        if (sub_scope!='public' and  sub_scope!='private' and sub_scope!='shared'):
-            print ('ERROR in row '+str(row)+' route-type must be private|public|shared')
+# A resumed run does not validate the excel data against the APIC again, this was
+# done by the first run: objects are pushed if the journal does not record them
+# as committed.
+if resume:
+    apic_data = {}
+else:
+    print('Retrieving all fabric ports information ...')
+    ports_data = req.query_ports()
+
+    # let's read all the present tenants, vrf, BDs to check for double information
+    # and already existent policies.
+    print("Retrieving all tenants information (vrf, bd, subnets, anp, epg) could take a while ...\n\n")
+    apic_data = req.query_all_tenants()
+
+
+    fatal_error = 0
+    # we now check that if BD are NOT new, we are not over-writing something. In case
+    # the ip address is defined in the excel, the BD already exists but it doesn't
+    # have an ip defined, we just print a warning. If an ip address already exists,
+    # we raise a fatal error: we suppose here that every BD can be associated to just
+    # one subnet. Regadring application profile, we do not think there are problems
+    # in case the application profile already exists or not. A warning could be printed
+    # anyway in case the application profile already exists (????).
+    # We also check that in every row a tenant and a vrf is defined.
+    print('Checking for errors inside the excel file on tenant, vrf, BD columns ...')
+    for xls in xls_rows:
+        row = xls.row
+        bd_name = xls.l2_vlan_name
+        if bd_name == None:
+            print ('ERROR in row '+str(row)+' empty BD name')
+            fatal_error = 1
+            continue
+        tenant = xls.tenant
+        if tenant == None:
+            print ('ERROR in row '+str(row)+' empty TENANT name')
+            fatal_error = 1
+            continue
+        vrf = xls.vrf
+        if vrf == None:
+            print ('ERROR in row '+str(row)+' empty VRF name')
             fatal_error = 1
             continue
-    ip_addr = str(sheet[xls_cols['ip_addr']+str(row)].value).strip()
-    if tenant in apic_data:
-        if bd_name in apic_data[tenant]['bd_list']:
-            if len(apic_data[tenant]['bd_list'][bd_name]['ip']):
-                print ('ERROR in row '+str(row)+' BD and subnet(s) already exists !')
+        if (xls.route_type != None):
+            sub_scope = xls.route_type
+            if (sub_scope!='public' and  sub_scope!='private' and sub_scope!='shared'):
+                print ('ERROR in row '+str(row)+' route-type must be private|public|shared')
                 fatal_error = 1
                 continue
-            else:
-                print ('WARNING in row '+str(row)+' BD already exists without a configured subnet')
-            if not 'vrf' in apic_data[tenant]['bd_list'][bd_name]:
-                print ('WARNING in row '+str(row)+' BD already exists without a configured vrf')
-
-if (fatal_error):
-    print ("Exiting, fatal errors occurred on excel data")
-    exit(0)
-
-# we now check the vlan columns and the consistency of the interfaces columns
-fatal_error = 0
-print('Checking interfaces column, this could take a while ...')
-for row in range(2, sheet.max_row+1):
-    # checking for Vlan number consistency
-    if not re.search("Vlan\d+",sheet[xls_cols['vlan_number']+str(row)].value):
-        print ('ERROR data on row '+str(row)+' wrong vlan number value, must be Vlan<id>')
-        fatal_error = False
-    vlan_id = re.search("Vlan(\d+)",sheet[xls_cols['vlan_number']+str(row)].value).group(1)
-    if (str(sheet[xls_cols['interfaces']+str(row)].value).strip() != 'None'):
-        # let's retrieve all the lines of the interfaces
-        lines = str(sheet[xls_cols['interfaces']+str(row)].value).strip().splitlines()
+        if tenant in apic_data:
+            if bd_name in apic_data[tenant]['bd_list']:
+                if len(apic_data[tenant]['bd_list'][bd_name]['ip']):
+                    print ('ERROR in row '+str(row)+' BD and subnet(s) already exists !')
+                    fatal_error = 1
+                    continue
+                else:
+                    print ('WARNING in row '+str(row)+' BD already exists without a configured subnet')
+                if not 'vrf' in apic_data[tenant]['bd_list'][bd_name]:
+                    print ('WARNING in row '+str(row)+' BD already exists without a configured vrf')
+
+    if (fatal_error):
+        print ("Exiting, fatal errors occurred on excel data")
+        exit(0)
+
+    # The physical interfaces of the nodes used in the interfaces column and all the
+    # EPG static paths are retrieved once, every row is then checked against them
+    # without any further query:
+    # phys_ifs contains the (pod, node, interface id) of the physical interfaces
+    # path_encaps[(path, encap)] contains the EPG using the encap on the port/bundle
+    print('Retrieving the physical interfaces and the EPG static paths ...')
+    xls_nodes = set()
+    for xls in xls_rows:
+        for intf in xls.interfaces:
+            data = intf.split(",")
+            if len(data) == 5 and re.search(r"\d+", data[1]) and re.search(r"\d+", data[2]):
+                xls_nodes.add((data[1].strip(), data[2].strip()))
+    phys_ifs = req.query_phys_ifs(xls_nodes)
+    path_encaps = req.query_path_encaps()
+    if path_encaps is None:
+        print ("Exiting, unable to retrieve the EPG static paths")
+        exit(0)
+
+    # we now check the vlan columns and the consistency of the interfaces columns
+    fatal_error = 0
+    print('Checking interfaces column, this could take a while ...')
+    for xls in xls_rows:
+        row = xls.row
+        # checking for Vlan number consistency
+        if xls.vlan_id == None:
+            print ('ERROR data on row '+str(row)+' wrong vlan number value, must be Vlan<id>')
+            fatal_error = True
+            continue
+        vlan_id = xls.vlan_id
         xls_port = None
-        for intf in lines:
-            if re.search(",", intf):
-                if_error = 0
-                data = intf.split(",")
-                if len(data) != 5:
-                    fatal_error = True
-                    if_error = 1
-                    print ('ERROR on row '+str(row)+', must be vPC or format \'eth,pod,node_id,module,port_id\'')
-                for i in range(1,5):
-                    if not re.search("\d+", data[i]):
+        if len(xls.interfaces):
+            # all the lines of the interfaces
+            lines = xls.interfaces
+            for intf in lines:
+                if re.search(",", intf):
+                    if_error = 0
+                    data = intf.split(",")
+                    if len(data) != 5:
                         fatal_error = True
                         if_error = 1
                         print ('ERROR on row '+str(row)+', must be vPC or format \'eth,pod,node_id,module,port_id\'')
-                node_id = (int)(data[2])
-                port = data[3]+"/"+data[4]
-                # check that the interface is NOT part of a bundle. In this case print an error and
-                # the "policy group", raise a fatal error and stop. This must be manually solved,
-                # the interface could be wrong.
-                if node_id in ports_data:
-                    if port in ports_data[node_id]['ports']:
-                        # this means that the interface is used, there is a policy applied
-                        # over it, otherwise it would not be here.
-                        if not ports_data[node_id]['ports'][port]['type']=='access':
+                    for i in range(1,5):
+                        if not re.search(r"\d+", data[i]):
                             fatal_error = True
-                            print('ERROR on row '+str(row)+' port is in a bundle, use polGrp name '+
-                                  ports_data[node_id]['ports'][port]['polGrp']+' or change port')
+                            if_error = 1
+                            print ('ERROR on row '+str(row)+', must be vPC or format \'eth,pod,node_id,module,port_id\'')
+                    node_id = (int)(data[2])
+                    port = data[3]+"/"+data[4]
+                    # check that the interface is NOT part of a bundle. In this case print an error and
+                    # the "policy group", raise a fatal error and stop. This must be manually solved,
+                    # the interface could be wrong.
+                    if node_id in ports_data:
+                        if port in ports_data[node_id]['ports']:
+                            # this means that the interface is used, there is a policy applied
+                            # over it, otherwise it would not be here.
+                            if not ports_data[node_id]['ports'][port]['type']=='access':
+                                fatal_error = True
+                                print('ERROR on row '+str(row)+' port is in a bundle, use polGrp name '+
+                                      ports_data[node_id]['ports'][port]['polGrp']+' or change port')
+                        else:
+                            fatal_error = True
+                            print('ERROR on row '+str(row)+' port not configured '+intf)
                     else:
                         fatal_error = True
-                        print('ERROR on row '+str(row)+' port not configured '+intf)
-                else:
-                    fatal_error = True
-                    print('ERROR on row '+str(row)+' selected node does not exist')
+                        print('ERROR on row '+str(row)+' selected node does not exist')
                 
-                if not if_error:
-                    query_url = ('/api/mo/topology/pod-%s/node-%s.json?query-target=subtree'
-                     '&target-subtree-class=l1PhysIf' % (data[1], data[2]))
-                    query_url += '&query-target-filter=eq(l1PhysIf.id,"%s")' % (data[0]+data[3]+"/"+data[4])
-                    # print (query_url)
-                    [status, payload] = req.query_url(query_url)                    
-                    json_data = payload['imdata']
-                    if not len(json_data)>0:
+                    if not if_error:
+                        if not (data[1].strip(), data[2].strip(), data[0]+data[3]+"/"+data[4]) in phys_ifs:
+                            fatal_error = True
+                            print ('ERROR on row '+str(row)+', wrong interface data value '+intf)
+                    xls_port ='eth'+data[3]+"/"+data[4]
+                else:
+                    # in this case it MUST be a port channel name
+                    if not intf.strip() in vpc_dn:
                         fatal_error = True
-                        print ('ERROR on row '+str(row)+', wrong interface data value '+intf)
-                xls_port ='eth'+data[3]+"/"+data[4]
-            else:
-                # in this case it MUST be a port channel name
-                if not intf.strip() in vpc_dn:
-                    fatal_error = True
-                    print ('ERROR on row '+str(row)+' for vpc name, should be one of the following:')
-                    for key in vpc_dn:
-                        print (key)
-                xls_port = intf.strip()
-        # Here it should also be checked if on the port/vPC, the vlan assigned to the EPG
-        # is free or is used. In case it is used, print the EPG that uses it. This check
-        # could give some false positive, in case the same policy group is used on
-        # many different bundles. I believe this is possible in ACI, in case there are different
-        # interface selectors that match different ranges using the same policy (?????).
-        if not fatal_error:
-            [status, payload] = req.query_url('/api/node/class/fvRsPathAtt.json?query-target-filter=eq(fvRsPathAtt.encap,"vlan-'+vlan_id+'")')
-            json_data = payload['imdata']
-            for obj in json_data:
-                dn = obj['fvRsPathAtt']['attributes']['dn']
-                reg = re.search('\/epg-(.*?)\/.*\/pathep-\[(.*?)\]', dn)
-                epg = reg.group(1).strip()
-                port = reg.group(2).strip()
-                if port == xls_port:
+                        print ('ERROR on row '+str(row)+' for vpc name, should be one of the following:')
+                        for key in vpc_dn:
+                            print (key)
+                    xls_port = intf.strip()
+            # Here it should also be checked if on the port/vPC, the vlan assigned to the EPG
+            # is free or is used. In case it is used, print the EPG that uses it. This check
+            # could give some false positive, in case the same policy group is used on
+            # many different bundles. I believe this is possible in ACI, in case there are different
+            # interface selectors that match different ranges using the same policy (?????).
+            if not fatal_error:
+                for epg in path_encaps.get((xls_port, 'vlan-'+vlan_id), []):
                     fatal_error = True
                     print ('ERROR on row '+str(row)+' encap vlan already used by '+epg)
 
-if (fatal_error):
-    print ("Exiting, fatal errors occurred on excel data")
-    exit(0)
-
-# Reading all the tenant, vrf, app profiles used in the excel file, checking if they 
-# are new or not and printing it out. For already existing tenants,
-# we also print out if vrf already exist. It is important that we don't change
-# anything important !! For example the 'enforced/unenforced' attribute, which could
-# break the whole vrf connectivity ... with AciToolKit, by default a vrf json data
-# was created with the 'enforced' attribute set.
-xls_data = {}
-xls_app = {}
-for row in range(2, sheet.max_row+1):
-    ten_name = str(sheet[xls_cols['tenant']+str(row)].value).strip()
-    vrf_name = str(sheet[xls_cols['vrf']+str(row)].value).strip()
-    app_name = str(sheet[xls_cols['app_profile']+str(row)].value).strip()
-    bd_name = str(sheet[xls_cols['l2_vlan_name']+str(row)].value).strip()+"_BD"
-    if (app_name == 'None'):
-        app_name = vrf_name + "_ANP"
-    epg_name = str(sheet[xls_cols['l2_vlan_name']+str(row)].value).strip()+"_EPG"
+    if (fatal_error):
+        print ("Exiting, fatal errors occurred on excel data")
+        exit(0)
+
+    # Reading all the tenant, vrf, app profiles used in the excel file, checking if they 
+    # are new or not and printing it out. For already existing tenants,
+    # we also print out if vrf already exist. It is important that we don't change
+    # anything important !! For example the 'enforced/unenforced' attribute, which could
+    # break the whole vrf connectivity ... with AciToolKit, by default a vrf json data
+    # was created with the 'enforced' attribute set.
+    xls_data = {}
+    xls_app = {}
+    for xls in xls_rows:
+        ten_name = xls.tenant
+        vrf_name = xls.vrf
+        app_name = xls.app_profile
+        bd_name = xls.l2_vlan_name+"_BD"
+        if (app_name == None):
+            app_name = vrf_name + "_ANP"
+        epg_name = xls.l2_vlan_name+"_EPG"
     
-    if not ten_name in xls_data:
-        xls_data[ten_name] = {}
-        xls_app[ten_name] = {}
-    if not vrf_name in xls_data[ten_name]:
-        xls_data[ten_name][vrf_name] = {}
-    if not bd_name in xls_data[ten_name][vrf_name]:
-        xls_data[ten_name][vrf_name][bd_name]=1
-    if not app_name in xls_app[ten_name]:
-        xls_app[ten_name][app_name] = {}
-    if not epg_name in xls_app[ten_name][app_name]:
-        xls_app[ten_name][app_name][epg_name] = 1
-
-output_data = []
-for ten_name in xls_data:
-    for vrf_name in xls_data[ten_name]:
-        for bd in xls_data[ten_name][vrf_name]:
-            if not ten_name in apic_data:
-                output_data.append((ten_name, 'new', vrf_name, 'new', bd, 'new'))
-            elif not vrf_name in apic_data[ten_name]['vrf_list']:
-                output_data.append((ten_name, 'exists', vrf_name, 'new', bd, 'new'))
-            elif not bd in apic_data[ten_name]['vrf_list'][vrf_name]:
-                output_data.append((ten_name, 'exists', vrf_name, 'exists', bd, 'new'))
-            else:
-                output_data.append((ten_name, 'exists', vrf_name, 'exists', bd, 'exists'))
-print (tabulate(output_data, headers=["tenant", "new", "vrf", "new", "BD", "new"]))
-print ('\n\n')
-
-output_data = []
-for ten_name in xls_app:
-    for app in xls_app[ten_name]:
-        for epg in xls_app[ten_name][app]:
-            if not ten_name in apic_data:
-                output_data.append((ten_name, 'new', app, 'new', epg, 'new'))
-            elif not app in apic_data[ten_name]['anp_list']:
-                output_data.append((ten_name, 'exists', app, 'new', epg, 'new'))
-            elif not epg in apic_data[ten_name]['anp_list'][app]:
-                output_data.append((ten_name, 'exists', app, 'exists', epg, 'new'))
-            else:
-                output_data.append((ten_name, 'exists', app, 'exists', epg, 'exists'))
-print (tabulate(output_data, headers=["tenant", "new", "app profile", "new", "epg", "new"]))
-
-
-def color (status, cell):
-    if status == None:
-        sheet[cell].fill = PatternFill("solid", fgColor="FFFF00")
-    elif status == 200:
-        sheet[cell].fill = PatternFill("solid", fgColor="00FF00")
+        if not ten_name in xls_data:
+            xls_data[ten_name] = {}
+            xls_app[ten_name] = {}
+        if not vrf_name in xls_data[ten_name]:
+            xls_data[ten_name][vrf_name] = {}
+        if not bd_name in xls_data[ten_name][vrf_name]:
+            xls_data[ten_name][vrf_name][bd_name]=1
+        if not app_name in xls_app[ten_name]:
+            xls_app[ten_name][app_name] = {}
+        if not epg_name in xls_app[ten_name][app_name]:
+            xls_app[ten_name][app_name][epg_name] = 1
+
+    output_data = []
+    for ten_name in xls_data:
+        for vrf_name in xls_data[ten_name]:
+            for bd in xls_data[ten_name][vrf_name]:
+                if not ten_name in apic_data:
+                    output_data.append((ten_name, 'new', vrf_name, 'new', bd, 'new'))
+                elif not vrf_name in apic_data[ten_name]['vrf_list']:
+                    output_data.append((ten_name, 'exists', vrf_name, 'new', bd, 'new'))
+                elif not bd in apic_data[ten_name]['vrf_list'][vrf_name]:
+                    output_data.append((ten_name, 'exists', vrf_name, 'exists', bd, 'new'))
+                else:
+                    output_data.append((ten_name, 'exists', vrf_name, 'exists', bd, 'exists'))
+    print (tabulate(output_data, headers=["tenant", "new", "vrf", "new", "BD", "new"]))
+    print ('\n\n')
+
+    output_data = []
+    for ten_name in xls_app:
+        for app in xls_app[ten_name]:
+            for epg in xls_app[ten_name][app]:
+                if not ten_name in apic_data:
+                    output_data.append((ten_name, 'new', app, 'new', epg, 'new'))
+                elif not app in apic_data[ten_name]['anp_list']:
+                    output_data.append((ten_name, 'exists', app, 'new', epg, 'new'))
+                elif not epg in apic_data[ten_name]['anp_list'][app]:
+                    output_data.append((ten_name, 'exists', app, 'exists', epg, 'new'))
+                else:
+                    output_data.append((ten_name, 'exists', app, 'exists', epg, 'exists'))
+    print (tabulate(output_data, headers=["tenant", "new", "app profile", "new", "epg", "new"]))
+
+
+def color (status, xls, column):
+    writer.color(status, xls.row, column)
+
+# Returns the dictionary of an existing tenant in apic_data, empty if it is new
+def apic_tenant (ten_name):
+    return apic_data.get(ten_name, {'vrf_list': {}, 'anp_list': {}, 'bd_list': {}})
+
+# The BD is created together with its vrf relationship, in case of errors creating
+# the new BD or the vrf associated to it, the status value is signed as wrong. The
+# post getting the error will be printed out on screen.
+def push_bd (ten_name, bd_name, vrf_name, sub_addr, description):
+    if (sub_addr == None):
+        # configurations optimized for a L2-only bridge domain, changing the 
+        # parameters later when a BD is added could be intrusive, for example
+        # changing the approach of unk_unicast to spine-proxy would lead to
+        # some packet loss. There is no subnet configured, thus unicast routing
+        # MUST be disabled, and arp flooding must be enabled.
+        status = tnConf.bd(tn_name = ten_name,
+                           name = bd_name,
+                           arp = 'yes',
+                           mdest = 'bd-flood',
+                           mcast = 'flood',
+                           unicast = 'no',
+                           unk_unicast = 'flood',
+                           status = 'created',
+                           vrf = vrf_name,
+                           descr = description)
     else:
-        sheet[cell].fill = PatternFill("solid", fgColor="FF1100")        
+        status = tnConf.bd(tn_name = ten_name,
+                           name = bd_name,
+                           arp = 'no',
+                           mdest = 'bd-flood',      # ???
+                           mcast = 'opt-flood',     # ???
+                           unicast = 'yes',
+                           unk_unicast = 'proxy',
+                           status = 'created',
+                           limitlearn = 'yes',
+                           vrf = vrf_name,
+                           descr = description)
+    if (status != 200):
+        return status
+    # add the vrf to the BD
+    status_vrf = tnConf.bd_vrf(tn_name = ten_name,
+                               name = bd_name,
+                               status = 'created',
+                               vrf = vrf_name)
+    if (status_vrf == 200):
+        return 200
+    return 0
+
+# The interfaces cell is green only if all the static paths are pushed
+def push_static_path (ten_name, app_prof, epg, intf, vlan_num):
+    if re.search(",",intf):
+        # 'eth', pod, leaf-id, module, port
+        if_data = intf.split(",")
+        return tnConf.static_path_access(tn_name = ten_name,
+                                         ap_name = app_prof,
+                                         epg_name = epg,
+                                         sw1 = if_data[2],
+                                         port = if_data[4],
+                                         encap = vlan_num,
+                                         deploy = 'immediate',
+                                         status = 'created',
+                                         pod = if_data[1])
+    # it must be a vPC or a port-channel
+    # topology/pod-1/protpaths-113-114/pathep-[vPC_CRE-SNCLB00171_PolGrp]
+    res = parse_dn(vpc_dn[intf.strip()])
+    [sw1, sw2] = res['protpaths'].split('-')
+    return tnConf.static_path_vpc(tn_name = ten_name,
+                                  ap_name = app_prof,
+                                  epg_name = epg,
+                                  sw1 = sw1,
+                                  sw2 = sw2,
+                                  vpc = res['pathep'],
+                                  encap = vlan_num,
+                                  deploy = 'immediate',
+                                  status = 'created',
+                                  pod = res['pod'])
 
-print('\n\nCreating queries, row by row ...')
-# To keep everything more simple and clean, it is better to perform a query
-# row by row. Objects are created in the logical order:
+print('\n\nPlanning the queries ...')
+# All the objects of all the rows are collected in a dependency graph, where the
+# objects are created in the logical order:
 # - tenant
 # - vrf
 # - bridge domains (with subnets)
 # - application profiles
 # - end point groups
-# 
-# In case the object creation is successful, the cell is green colored, and the
-# object is added to the structures. In this way, the second time the same object
-# should be created, the operation is simply SKIPPED and the cell is yellow colored.
-# In case of errors, the cell is red colored and some other object creation could
-# be skipped. For example in case a vrf can't be created, it doesn't make any sense 
-# to create a bridge domain that points to that vrf.
+# - static paths
+#
+# An object used by many rows (i.e. the tenant or the vrf) is pushed only once, and
+# rows that share nothing are pushed in parallel (push_concurrency queries at the
+# same time, at most push_tenant_concurrency for the same tenant). In case of errors,
+# the objects depending on the failed one are not pushed: for example in case a vrf
+# can't be created, it doesn't make any sense to create a bridge domain that points
+# to that vrf.
+#
+# The row pushing an object first gets the cell colored with its result, green or
+# red. The other rows using the same object, or rows with objects that already exist,
+# get the cell yellow colored (no need to perform the query) unless the object
+# failed, in which case they are red too.
 # yellow FFFF00
 # red FF1100
 # green 00FF00
-for row in range(2, len(sheet['A'])+1):
+sched = PushScheduler(concurrency = push_concurrency,
+                      group_limit = push_tenant_concurrency,
+                      journal = journal.open(resume),
+                      resume = resume)
+# row_keys[row][column] contains the key of the object colored on that cell,
+# None if the object already exists
+row_keys = {}
+for xls in xls_rows:
+    keys = {}
+    row_keys[xls.row] = keys
+    ten_name = xls.tenant
+    tenant = apic_tenant(ten_name)
+    
     # TENANT
-    ten_name = str(sheet[xls_cols['tenant']+str(row)].value).strip()
-    status = None
+    ten_key = ('tenant', ten_name)
+    keys['tenant'] = None
     if not ten_name in apic_data:
-        status = tnConf.tenant(name = ten_name, 
-                               status = 'created')
-        if status == 200:
-            apic_data[ten_name]={}
-            apic_data[ten_name]['vrf_list'] = {}
-            apic_data[ten_name]['anp_list'] = {}
-            apic_data[ten_name]['bd_list'] = {}
-            apic_data[ten_name]['anp_list'] = {}
-    color(status, xls_cols['tenant']+str(row))
+        keys['tenant'] = sched.add(ten_key, tnConf.tenant, group = ten_name,
+                                   name = ten_name,
+                                   status = 'created')
     
     # VRF
-    vrf_name = str(sheet[xls_cols['vrf']+str(row)].value).strip()
-    status = None
-    if not vrf_name in apic_data[ten_name]['vrf_list']:
-        status = tnConf.vrf(tn_name = ten_name,
-                            name = vrf_name,
-                            enforce = 'enforced',
-                            status = 'created')
-        if status == 200:
-            apic_data[ten_name]['vrf_list'][vrf_name]={}
-    color(status, xls_cols['vrf']+str(row))
+    vrf_name = xls.vrf
+    vrf_key = ('vrf', ten_name, vrf_name)
+    keys['vrf'] = None
+    if not vrf_name in tenant['vrf_list']:
+        keys['vrf'] = sched.add(vrf_key, tnConf.vrf, depends = [ten_key], group = ten_name,
+                                tn_name = ten_name,
+                                name = vrf_name,
+                                enforce = 'enforced',
+                                status = 'created')
     
-    l2_vname = str(sheet[xls_cols['l2_vlan_name']+str(row)].value).strip()
-    vlan_num = re.search("Vlan(\d+)",sheet[xls_cols['vlan_number']+str(row)].value).group(1)
-    description = sheet[xls_cols['descr']+str(row)].value.strip()
+    l2_vname = xls.l2_vlan_name
+    vlan_num = xls.vlan_id
+    description = xls.descr or ''
     
     sub_name = None
     sub_addr = None
     sub_scope = 'private'
-    if (sheet[xls_cols['ip_addr']+str(row)].value != None):
+    if (xls.ip_addr != None):
         sub_name = l2_vname + '_subnet'
-        sub_addr = sheet[xls_cols['ip_addr']+str(row)].value.strip()
+        sub_addr = xls.ip_addr
     # we have already checked that there are only right values
-    if (sheet[xls_cols['route_type']+str(row)].value != None):
-        sub_scope = str(sheet[xls_cols['route_type']+str(row)].value).strip()
+    if (xls.route_type != None):
+        sub_scope = xls.route_type
     else:
-        sheet[xls_cols['route_type']+str(row)].value = 'private'
+        writer.set_value(xls.row, 'route_type', 'private')
     
     # BRIDGE DOMAIN
     # bd parameters should be optimized depending on other data.
     bd_name = l2_vname + "_BD"
-    status = None
-    if not bd_name in apic_data[ten_name]['vrf_list'][vrf_name]:
-        if (sub_addr == None):
-            # configurations optimized for a L2-only bridge domain, changing the 
-            # parameters later when a BD is added could be intrusive, for example
-            # changing the approach of unk_unicast to spine-proxy would lead to
-            # some packet loss. There is no subnet configured, thus unicast routing
-            # MUST be disabled, and arp flooding must be enabled.
-            status = tnConf.bd(tn_name = ten_name,
-                               name = bd_name,
-                               arp = 'yes',
-                               mdest = 'bd-flood',
-                               mcast = 'flood',
-                               unicast = 'no',
-                               unk_unicast = 'flood',
-                               status = 'created',
-                               vrf = vrf_name,
-                               descr = description)
-        else:
-            status = tnConf.bd(tn_name = ten_name,
-                               name = bd_name,
-                               arp = 'no',
-                               mdest = 'bd-flood',      # ???
-                               mcast = 'opt-flood',     # ???
-                               unicast = 'yes',
-                               unk_unicast = 'proxy',
-                               status = 'created',
-                               limitlearn = 'yes',
-                               vrf = vrf_name,
-                               descr = description)
-        
-        if (status == 200):
-            apic_data[ten_name]['bd_list'][bd_name]={}
-        
-        if (status == 200):
-            # add the vrf to the BD
-            status_vrf = tnConf.bd_vrf(tn_name = ten_name,
-                                       name = bd_name,
-                                       status = 'created',
-                                       vrf = vrf_name)
-            if (status_vrf == 200):
-                apic_data[ten_name]['vrf_list'][vrf_name][bd_name]={}
-        
-        # in case of errors creating the new BD or the vrf associated to it,
-        # the status value is signed as wrong. The post getting the error will
-        # be printed out on screen.        
-        if (status == 200 and status_vrf==200):
-            status=200
-        else:
-            status = 0
-    color(status, xls_cols['l2_vlan_name']+str(row))
-    
-    # in case the BD already exists, we suppose it has already been associated to a vrf,
-    # since EVERY bd must belong to a vrf in ACI. In case it's not
-    if not bd_name in apic_data[ten_name]['vrf_list'][vrf_name]:
-        status_vrf = tnConf.bd_vrf(tn_name = ten_name,
-                                       name = bd_name,
-                                       status = 'created',
-                                       vrf = vrf_name)
-        if (status_vrf == 200):
-            apic_data[ten_name]['vrf_list'][vrf_name][bd_name]={}
-        print('Warning, added '+vrf_name+' to BD '+bd_name)
+    bd_key = ('bd', ten_name, bd_name)
+    keys['l2_vlan_name'] = None
+    if not bd_name in tenant['vrf_list'].get(vrf_name, {}):
+        keys['l2_vlan_name'] = sched.add(bd_key, push_bd, depends = [vrf_key], group = ten_name,
+                                         ten_name = ten_name,
+                                         bd_name = bd_name,
+                                         vrf_name = vrf_name,
+                                         sub_addr = sub_addr,
+                                         description = description)
     
     # BD SUBNET
     # if the BD already exists, the L3 subnet should be added, it was already
     # checked if another subnet was already there ... in this case a fatal error
     # would have been printed out, and the script would have blocked itself.
-    status = tnConf.bd_subnet(tn_name = ten_name,
-                              name = bd_name,
-                              subnet = sub_addr,
-                              scope = sub_scope,
-                              preferred = 'yes',
-                              status = 'created',
-                              descr = description)
-    if status == 200:
-        # add the NEW subnet to the BD
-        apic_data[ten_name]['vrf_list'][vrf_name][bd_name]['ip'] = []
-        apic_data[ten_name]['bd_list'][bd_name]['ip'] = []
-        
-        apic_data[ten_name]['vrf_list'][vrf_name][bd_name]['ip'].append(sub_addr)
-        apic_data[ten_name]['bd_list'][bd_name]['ip'].append(sub_addr)
-    color(status, xls_cols['ip_addr']+str(row))
+    keys['ip_addr'] = None
+    if (sub_addr != None):
+        keys['ip_addr'] = sched.add(('subnet', ten_name, bd_name, sub_addr), tnConf.bd_subnet,
+                                    depends = [bd_key], group = ten_name,
+                                    tn_name = ten_name,
+                                    name = bd_name,
+                                    subnet = sub_addr,
+                                    scope = sub_scope,
+                                    preferred = 'yes',
+                                    status = 'created',
+                                    descr = description)
     
-    
-    if (sheet[xls_cols['app_profile']+str(row)].value != None):
-        app_prof = str(sheet[xls_cols['app_profile']+str(row)].value).strip()
+    if (xls.app_profile != None):
+        app_prof = xls.app_profile
     else:
         app_prof = vrf_name + "_ANP"
-        sheet[xls_cols['app_profile']+str(row)].value = app_prof
+        writer.set_value(xls.row, 'app_profile', app_prof)
     
     # APP PROFILE
-    status = None
-    if not app_prof in apic_data[ten_name]['anp_list']:
-        status = tnConf.app_profile(tn_name = ten_name,
-                                    name = app_prof,
-                                    status = 'created')
-        if status == 200:
-            apic_data[ten_name]['anp_list'][app_prof]={}
-    color(status, xls_cols['app_profile']+str(row))
+    app_key = ('app', ten_name, app_prof)
+    keys['app_profile'] = None
+    if not app_prof in tenant['anp_list']:
+        keys['app_profile'] = sched.add(app_key, tnConf.app_profile, depends = [ten_key],
+                                        group = ten_name,
+                                        tn_name = ten_name,
+                                        name = app_prof,
+                                        status = 'created')
     
     # EPG
-    if (sheet[xls_cols['epg']+str(row)].value != None):
-        epg = str(sheet[xls_cols['epg']+str(row)].value).strip()
+    if (xls.epg != None):
+        epg = xls.epg
     else:
         epg = l2_vname+"_EPG"
-        sheet[xls_cols['epg']+str(row)].value = epg
-    status = None
-    if not epg in apic_data[ten_name]['anp_list'][app_prof]:
-        status = tnConf.epg(tn_name = ten_name,
-                            ap_name = app_prof,
-                            name = epg,
-                            bd = bd_name,
-                            status = 'created')
-        if status == 200:
-            apic_data[ten_name]['anp_list'][app_prof][epg] = {}
-    color(status, xls_cols['epg']+str(row))
+        writer.set_value(xls.row, 'epg', epg)
+    epg_key = ('epg', ten_name, app_prof, epg)
+    keys['epg'] = None
+    if not epg in tenant['anp_list'].get(app_prof, {}):
+        keys['epg'] = sched.add(epg_key, tnConf.epg, depends = [app_key, bd_key],
+                                group = ten_name,
+                                tn_name = ten_name,
+                                ap_name = app_prof,
+                                name = epg,
+                                bd = bd_name,
+                                status = 'created')
     
+    # STATIC PATHS
     # the domain is always the same, we define it here anyway. In general,
     # it could be different for every port but usually this is what is done:
     # it is created a physical domain which contains all the vlan except the intra-vlan,
@@ -507,43 +563,56 @@ for row in range(2, len(sheet['A'])+1):
     #
     # Remember that we have already checked that the port is configured, the vPC exists,
     # and that encap vlan on the physical interface is NOT already used.
-    multiple_checks = True
-    if (str(sheet[xls_cols['interfaces']+str(row)].value).strip() != 'None'):
-        lines = str(sheet[xls_cols['interfaces']+str(row)].value).strip().splitlines()
-        for intf in lines:
-            if re.search(",",intf):
-                # 'eth', pod, leaf-id, module, port
-                if_data = intf.split(",")
-                status = tnConf.static_path_access(tn_name = ten_name,
-                                                ap_name = app_prof,
-                                                epg_name = epg,
-                                                sw1 = if_data[2],
-                                                port = if_data[4],
-                                                encap = vlan_num,
-                                                deploy = 'immediate',
-                                                status = 'created',
-                                                pod = if_data[1])
-                if status != 200:
-                    multiple_checks = False
-            else:
-                # it must be a vPC or a port-channel
-                # topology/pod-1/protpaths-113-114/pathep-[vPC_CRE-SNCLB00171_PolGrp]
-                res = re.search('\/pod-(\d+)\/protpaths-(\d+)-(\d+)\/pathep-\[(.*)\]', vpc_dn[intf.strip()])
-                status = tnConf.static_path_vpc(tn_name = ten_name,
-                                                ap_name = app_prof,
-                                                epg_name = epg,
-                                                sw1 = res.group(2),
-                                                sw2 = res.group(3),
-                                                vpc = res.group(4),
-                                                encap = vlan_num,
-                                                deploy = 'immediate',
-                                                status = 'created',
-                                                pod = res.group(1))
-                if status != 200:
-                    multiple_checks = False
-    if multiple_checks:
+    keys['interfaces'] = []
+    for intf in xls.interfaces:
+        keys['interfaces'].append(sched.add(('path', ten_name, app_prof, epg, intf.strip()),
+                                            push_static_path, depends = [epg_key],
+                                            group = ten_name,
+                                            ten_name = ten_name,
+                                            app_prof = app_prof,
+                                            epg = epg,
+                                            intf = intf,
+                                            vlan_num = vlan_num))
+
+print('Pushing {} objects ...'.format(len(sched.tasks)))
+statuses = sched.run()
+journal.close()
+if resume:
+    print('{} objects were already committed'.format(sched.resumed))
+
+# The first row using an object gets its status, the following ones get
+# None (yellow) unless the object failed
+colored = set()
+def row_status (key):
+    # objects not pushed by a resumed run were already on the APIC
+    if key == None or not key in statuses:
+        return None
+    status = statuses[key]
+    if key in colored and status == 200:
+        return None
+    colored.add(key)
+    return status
+
+for xls in xls_rows:
+    keys = row_keys[xls.row]
+    for column in ('tenant', 'vrf', 'l2_vlan_name', 'ip_addr', 'app_profile', 'epg'):
+        color(row_status(keys[column]), xls, column)
+    if len(xls.interfaces):
         status = 200
-    if (sheet[xls_cols['interfaces']+str(row)].value != None):
-        color(status, xls_cols['interfaces']+str(row))
+        for key in keys['interfaces']:
+            if row_status(key) not in (None, 200):
+                status = statuses[key]
+        color(status, xls, 'interfaces')
+
+# the colors and the filled values are written on the output file in a single step
+writer.save('C:/Users/601787621/Documenti/Snam/ACI e VMWare/ACI_vlan_list_out.xlsx')
 
-targ.save('C:/Users/601787621/Documenti/Snam/ACI e VMWare/ACI_vlan_list_out.xlsx')
+# all the queries and posts share the same keep-alive connections, here we
+# print how many TLS handshakes have been saved during the run.
+stats = apic.conn.stats()
+print('\nREST calls: {}, connections opened: {}, reused: {}'
+      .format(stats['requests'], stats['opened'], stats['reused']))
+# the rate reached by the adaptive limiter, and how many times the APIC throttled
+if stats['rate'] != None:
+    print('Throttled by the APIC {} times, final rate {:.1f} requests/s'
+          .format(stats['throttled'], stats['rate']))
@@ -0,0 +1,577 @@
+# This python script runs a local mock of the APIC REST API, useful to measure
+# and test the toolkit without a live fabric. The mock keeps an in-memory MIT
+# (a dictionary dn -> object) and understands a minimal subset of the API:
+#
+# - POST /api/mo/aaaLogin.json            returns the APIC-cookie
+# - GET  /api/aaaRefresh.json             returns a new APIC-cookie
+# - GET  /api/aaaListDomains.json         answers without authentication
+# - GET  /api/node/class/<class>.json     (also /api/class/...)
+# - GET  /api/node/mo/<dn>.json           (also /api/mo/...)
+# - POST /api/node/mo/<dn>.json           adds the posted objects to the MIT
+# - GET  /api/subscriptionRefresh.json    refreshes a subscription
+# - GET  /socket<token>                   websocket with the subscription events
+#
+# Class and mo queries support query-target=self|children|subtree,
+# target-subtree-class, query-target-filter with eq() filters, the
+# page/page-size pagination (objects are sorted by dn) and the nested
+# rsp-subtree=children|full answers, with rsp-subtree-class. Class queries
+# with subscription=yes return a subscriptionId, the objects of that class
+# created, modified or deleted by a POST are then notified on every open
+# websocket until the subscription expires (query filters are ignored).
+#
+# Every request can be delayed by a configurable latency, to simulate the
+# round trip time toward a real controller. With max_rate, the requests
+# beyond max_rate per second are refused with HTTP 429, as the APIC does
+# when it throttles a client. With token_timeout, tokens expire as on the
+# APIC and requests with an expired or unknown token are refused with HTTP
+# 403 'Token was invalid', and the next logins can be refused with the
+# statuses of refused_logins. The open websockets can be dropped with
+# drop_sockets(), and the next websocket handshakes refused with HTTP 503 by
+# setting refuse_sockets, to test the reconnections. It can be used from another
+# script in the following way:
+#
+#   mock = MockApic(latency=0.05)
+#   mock.add('fvTenant', {'dn': 'uni/tn-common', 'name': 'common'})
+#   apic_ip = mock.start()        # returns 'http://127.0.0.1:<port>'
+#   ...
+#   mock.stop()
+#
+# Every further call of start() adds a controller to the mock cluster: it
+# listens on another port and serves the same MIT and tokens. A controller
+# can be stopped alone with stop_controller(url) to test the failover.
+import collections
+import json
+import queue
+import re
+import select
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from aci_dn import split_dn
+from aci_subscription import (ws_accept_key, ws_encode, ws_read_frame,
+                              OP_CLOSE, OP_PING, OP_PONG)
+
+
+# RN of the relation objects posted by the templates without a rn attribute
+rn_format = {'fvRsPathAtt': 'rspathAtt-[{tDn}]',
+             'fvRsDomAtt': 'rsdomAtt-[{tDn}]',
+             'fvRsCtx': 'rsctx',
+             'fvRsBd': 'rsbd'}
+
+
+class MockApic(object):
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0, max_rate=None,
+                 token_timeout=None):
+        self.latency = latency
+        # seconds of validity of the tokens, None if they never expire
+        self.token_timeout = token_timeout
+        # token -> expiration time
+        self.tokens = {}
+        self.next_token = 1
+        self.logins = 0
+        self.refreshes = 0
+        # HTTP status of the next aaaLogin to be refused, e.g. [401, 503]
+        self.refused_logins = []
+        self.max_rate = max_rate
+        # arrival times of the requests of the last second
+        self.arrivals = collections.deque()
+        self.throttled = 0
+        self.host = host
+        self.port = port
+        # dn -> (class name, attributes)
+        self.mit = {}
+        # indexes of the MIT: class name -> dn of its objects and father dn
+        # -> dn of its children (dictionaries used as ordered sets), queries
+        # do not scan the whole MIT. Fathers not added to the MIT are in the
+        # children index too, so that subtree queries still reach the objects
+        # below them.
+        self.classes = {}
+        self.children = {}
+        self.lock = threading.Lock()
+        self.server = None
+        # url -> server, one for every controller of the cluster
+        self.servers = {}
+        # counters useful for the benchmarks
+        self.requests = 0
+        self.bytes_out = 0
+        # subscription id -> [class name, expiration time]
+        self.subscriptions = {}
+        self.subscription_timeout = 90
+        self.next_subscription = 1
+        # queues of the messages for the open websockets
+        self.sockets = []
+        # number of the next websocket handshakes to be refused
+        self.refuse_sockets = 0
+
+    # Returns a new token, valid for token_timeout seconds
+    def new_token(self):
+        with self.lock:
+            token = 'mock-token-{}'.format(self.next_token)
+            self.next_token += 1
+            timeout = self.token_timeout
+            self.tokens[token] = time.time() + timeout if timeout else None
+        return token
+
+    # True if the token is known and not expired, always True when tokens
+    # do not expire
+    def valid_token(self, token):
+        if self.token_timeout is None:
+            return True
+        with self.lock:
+            expires = self.tokens.get(token, 0)
+        return expires is None or expires > time.time()
+
+    # Adds an object to the MIT, the attributes must contain the dn
+    def add(self, aci_class, attributes):
+        attributes = dict(attributes)
+        with self.lock:
+            self.insert(aci_class, attributes)
+
+    # Changes of the MIT and of its indexes, the lock must be held
+    def insert(self, aci_class, attributes):
+        dn = attributes['dn']
+        if dn in self.mit:
+            self.remove(dn)
+        self.mit[dn] = (aci_class, attributes)
+        self.classes.setdefault(aci_class, {})[dn] = None
+        child = dn
+        while child:
+            siblings = self.children.setdefault(father(child), {})
+            if child in siblings:
+                break
+            siblings[child] = None
+            child = father(child)
+
+    def remove(self, dn):
+        aci_class = self.mit.pop(dn)[0]
+        self.classes[aci_class].pop(dn, None)
+        if not self.children.get(dn):
+            self.children.get(father(dn), {}).pop(dn, None)
+
+    # dn of all the objects below dn, the lock must be held
+    def descendants(self, dn):
+        result = []
+        stack = [dn]
+        while stack:
+            children = list(self.children.get(stack.pop(), ()))
+            result.extend(children)
+            stack.extend(reversed(children))
+        return result
+
+    def start(self):
+        handler = type('MockApicHandler', (MockApicHandler,), {'apic': self})
+        port = self.port if self.server is None else 0
+        server = ThreadingHTTPServer((self.host, port), handler)
+        server.daemon_threads = True
+        url = 'http://{}:{}'.format(self.host, server.server_address[1])
+        if self.server is None:
+            self.server = server
+            self.port = server.server_address[1]
+        self.servers[url] = server
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return url
+
+    # Stops a single controller, the connections already open toward it
+    # are closed at their next request
+    def stop_controller(self, url):
+        server = self.servers.pop(url, None)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def stop(self):
+        for url in list(self.servers):
+            self.stop_controller(url)
+        self.server = None
+
+    # Adds to the MIT an object posted in the ACI json format, together
+    # with its children. The posted object without a dn gets the one of the
+    # url, children get it from the father's dn and their rn (or their
+    # class name, when the rn is not there either).
+    def post_tree(self, tree, parent_dn, dn=None, events=None):
+        notify = events is None
+        if notify:
+            events = []
+        for aci_class, body in tree.items():
+            attributes = dict(body.get('attributes', {}))
+            if 'dn' not in attributes and dn is not None:
+                attributes['dn'] = dn
+            elif 'dn' not in attributes:
+                rn = attributes.get('rn')
+                if rn is None:
+                    rn = rn_format.get(aci_class, aci_class).format(**attributes)
+                attributes['dn'] = parent_dn + '/' + rn
+            obj_dn = attributes['dn']
+            if attributes.get('status') == 'deleted':
+                with self.lock:
+                    if obj_dn not in self.mit:
+                        continue
+                    for key in [obj_dn] + self.descendants(obj_dn):
+                        if key not in self.mit:
+                            continue
+                        events.append({self.mit[key][0]: {'attributes': {
+                            'dn': key, 'status': 'deleted'}}})
+                        self.remove(key)
+                continue
+            with self.lock:
+                if obj_dn in self.mit:
+                    self.mit[obj_dn][1].update(attributes)
+                    status = 'modified'
+                else:
+                    self.insert(aci_class, attributes)
+                    status = 'created'
+                event = dict(self.mit[obj_dn][1])
+            event['status'] = status
+            events.append({aci_class: {'attributes': event}})
+            for child in body.get('children', []):
+                self.post_tree(child, obj_dn, events=events)
+        if notify:
+            self.notify(events)
+
+    # Returns True if the request must be refused, more than max_rate
+    # requests arrived in the last second
+    def throttle(self):
+        if self.max_rate is None:
+            return False
+        with self.lock:
+            now = time.time()
+            while self.arrivals and now - self.arrivals[0] > 1.0:
+                self.arrivals.popleft()
+            if len(self.arrivals) >= self.max_rate:
+                self.throttled += 1
+                return True
+            self.arrivals.append(now)
+            return False
+
+    def subscribe(self, aci_class):
+        with self.lock:
+            sub_id = str(self.next_subscription)
+            self.next_subscription += 1
+            self.subscriptions[sub_id] = [aci_class,
+                                          time.time() + self.subscription_timeout]
+        return sub_id
+
+    # Returns False if the subscription does not exist or has expired
+    def refresh(self, sub_id):
+        with self.lock:
+            subscription = self.subscriptions.get(sub_id)
+            if subscription is None or subscription[1] < time.time():
+                self.subscriptions.pop(sub_id, None)
+                return False
+            subscription[1] = time.time() + self.subscription_timeout
+            return True
+
+    # Sends the events to the websockets, one message for every object with
+    # the ids of the subscriptions to its class
+    def notify(self, events):
+        now = time.time()
+        with self.lock:
+            active = [(sub_id, aci_class) for sub_id, (aci_class, expires)
+                      in self.subscriptions.items() if expires >= now]
+            sockets = list(self.sockets)
+        for event in events:
+            aci_class = list(event.keys())[0]
+            ids = [sub_id for sub_id, sub_class in active
+                   if sub_class == aci_class]
+            if not ids:
+                continue
+            message = json.dumps({'subscriptionId': ids, 'imdata': [event]})
+            for messages in sockets:
+                messages.put(message)
+
+    # Closes all the open websockets, as a controller restarting would do
+    def drop_sockets(self):
+        with self.lock:
+            for messages in self.sockets:
+                messages.put(None)
+
+    # Returns the objects selected by a class or mo query
+    def select(self, aci_class=None, dn=None, params=None):
+        params = params or {}
+        target = params.get('query-target', 'self')
+        subtree_classes = params.get('target-subtree-class')
+        if subtree_classes:
+            subtree_classes = subtree_classes.split(',')
+        selected = []
+        with self.lock:
+            if dn is not None:
+                roots = [dn] if dn in self.mit else []
+            else:
+                roots = list(self.classes.get(aci_class, ()))
+            result = []
+            for root in roots:
+                if target in ('self', 'subtree'):
+                    result.append(root)
+                if target == 'children':
+                    result.extend(self.children.get(root, ()))
+                elif target == 'subtree':
+                    result.extend(self.descendants(root))
+            # an object below two roots is returned once
+            for key in dict.fromkeys(result):
+                if key not in self.mit:
+                    continue
+                obj_class, attributes = self.mit[key]
+                if (subtree_classes and target != 'self'
+                        and obj_class not in subtree_classes):
+                    continue
+                if not match_filter(params.get('query-target-filter'),
+                                    obj_class, attributes):
+                    continue
+                selected.append({obj_class: {'attributes': dict(attributes)}})
+        return selected
+
+
+    # Adds the children of the selected objects, for rsp-subtree=children
+    # (only the first level) or rsp-subtree=full (all the levels). With
+    # rsp-subtree-class only the children of those classes are returned.
+    def add_children(self, imdata, params):
+        mode = params.get('rsp-subtree')
+        if mode not in ('children', 'full'):
+            return imdata
+        classes = params.get('rsp-subtree-class')
+        if classes:
+            classes = classes.split(',')
+
+        def attach(obj, deep):
+            [(aci_class, body)] = obj.items()
+            nested = []
+            for key in self.children.get(body['attributes']['dn'], ()):
+                if key not in self.mit:
+                    continue
+                [child_class, attributes] = self.mit[key]
+                if classes and child_class not in classes:
+                    continue
+                child = {child_class: {'attributes': dict(attributes)}}
+                if deep:
+                    attach(child, deep)
+                nested.append(child)
+            if nested:
+                body['children'] = nested
+
+        with self.lock:
+            for obj in imdata:
+                attach(obj, mode == 'full')
+        return imdata
+
+
+# dn of the father of an object, '' for the root
+def father(dn):
+    return '/'.join(split_dn(dn)[:-1])
+
+
+# Returns True if the object matches the query-target-filter. Only the eq()
+# and and() operators are supported, which is what the toolkit uses.
+def match_filter(query_filter, aci_class, attributes):
+    if not query_filter:
+        return True
+    for obj_class, attr, value in re.findall(
+            r'eq\(([A-Za-z0-9]+)\.([A-Za-z0-9_]+),\s*"(.*?)"\)', query_filter):
+        if obj_class != aci_class or attributes.get(attr) != value:
+            return False
+    return True
+
+
+class MockApicHandler(BaseHTTPRequestHandler):
+    apic = None
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, with Nagle the body would
+    # wait for the delayed ack of the headers (about 40ms on every answer)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def token(self):
+        for item in self.headers.get('Cookie', '').split(';'):
+            [name, _, value] = item.strip().partition('=')
+            if name == 'APIC-cookie':
+                return value
+        return None
+
+    # Replies to aaaLogin and aaaRefresh with a new token
+    def reply_token(self, method):
+        token = self.apic.new_token()
+        timeout = self.apic.token_timeout or 600
+        attributes = {'token': token, 'refreshTimeoutSeconds': str(timeout)}
+        self.reply(200, {'totalCount': '1',
+                         'imdata': [{method: {'attributes': attributes}}]},
+                   cookie=token)
+
+    # Refuses the request if the token is not valid, returns True if so
+    def expired(self):
+        if self.apic.valid_token(self.token()):
+            return False
+        self.reply(403, {'totalCount': '1', 'imdata': [{'error': {'attributes': {
+            'code': '403', 'text': 'Token was invalid (Error: Token timeout)'}}}]})
+        return True
+
+    def reply(self, status, body, cookie=None):
+        data = json.dumps(body).encode()
+        self.apic.requests += 1
+        self.apic.bytes_out += len(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if cookie is not None:
+            self.send_header('Set-Cookie', 'APIC-cookie={}; path=/'.format(cookie))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def parse(self):
+        url = urlsplit(self.path)
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+        return unquote(url.path), params
+
+    # Websocket carrying the subscription events, open until the client
+    # closes it or the mock is stopped
+    def websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', ws_accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        messages = queue.Queue()
+        with self.apic.lock:
+            self.apic.sockets.append(messages)
+        try:
+            while self.server in self.apic.servers.values():
+                if select.select([self.connection], [], [], 0)[0]:
+                    [fin, opcode, payload] = ws_read_frame(self.connection)
+                    if opcode == OP_CLOSE:
+                        break
+                    if opcode == OP_PING:
+                        self.wfile.write(ws_encode(payload, OP_PONG, mask=False))
+                try:
+                    message = messages.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if message is None:
+                    break
+                self.wfile.write(ws_encode(message, mask=False))
+                self.wfile.flush()
+        except Exception:
+            pass
+        finally:
+            with self.apic.lock:
+                self.apic.sockets.remove(messages)
+            self.close_connection = True
+
+    # True if the controller of this request has been stopped, the
+    # connection is then closed without an answer
+    def stopped(self):
+        if self.server in self.apic.servers.values():
+            return False
+        self.close_connection = True
+        return True
+
+    def do_GET(self):
+        if self.stopped():
+            return
+        if self.path.startswith('/socket'):
+            with self.apic.lock:
+                refused = self.apic.refuse_sockets > 0
+                if refused:
+                    self.apic.refuse_sockets -= 1
+            if refused:
+                self.reply(503, {'totalCount': '0', 'imdata': []})
+                self.close_connection = True
+            else:
+                self.websocket()
+            return
+        time.sleep(self.apic.latency)
+        if self.apic.throttle():
+            self.reply(429, {'totalCount': '0', 'imdata': []})
+            return
+        path, params = self.parse()
+        if path == '/api/aaaListDomains.json':
+            self.reply(200, {'totalCount': '0', 'imdata': []})
+            return
+        if self.expired():
+            return
+        if path == '/api/aaaRefresh.json':
+            self.apic.refreshes += 1
+            self.reply_token('aaaLogin')
+            return
+        if path == '/api/subscriptionRefresh.json':
+            if self.apic.refresh(params.get('id')):
+                self.reply(200, {'totalCount': '0', 'imdata': []})
+            else:
+                self.reply(400, {'totalCount': '0', 'imdata': []})
+            return
+        sub_id = None
+        reg = re.match(r'/api/(?:node/)?class/(.*)\.json$', path)
+        if reg:
+            imdata = self.apic.select(aci_class=reg.group(1), params=params)
+            if params.get('subscription') == 'yes':
+                sub_id = self.apic.subscribe(reg.group(1))
+        else:
+            reg = re.match(r'/api/(?:node/)?mo/(.*)\.json$', path)
+            if not reg:
+                self.reply(400, {'totalCount': '0', 'imdata': []})
+                return
+            imdata = self.apic.select(dn=reg.group(1), params=params)
+        total = len(imdata)
+        # objects are always sorted by dn, which is what order-by=<class>.dn
+        # asks for, and makes the pages stable
+        if 'order-by' in params or 'page-size' in params:
+            imdata.sort(key=lambda obj: list(obj.values())[0]['attributes']['dn'])
+        if 'page-size' in params:
+            size = int(params['page-size'])
+            page = int(params.get('page', 0))
+            imdata = imdata[page*size:(page+1)*size]
+        imdata = self.apic.add_children(imdata, params)
+        body = {'totalCount': str(total), 'imdata': imdata}
+        if sub_id is not None:
+            body['subscriptionId'] = sub_id
+        self.reply(200, body)
+
+    def do_POST(self):
+        if self.stopped():
+            return
+        time.sleep(self.apic.latency)
+        path, params = self.parse()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode() if length else '{}'
+        if self.apic.throttle():
+            self.reply(429, {'totalCount': '0', 'imdata': []})
+            return
+        if path.endswith('aaaLogin.json'):
+            with self.apic.lock:
+                refused = self.apic.refused_logins and \
+                    self.apic.refused_logins.pop(0)
+            if refused:
+                self.reply(refused, {'totalCount': '0', 'imdata': []})
+                return
+            self.apic.logins += 1
+            self.reply_token('aaaLogin')
+            return
+        if self.expired():
+            return
+        reg = re.match(r'/api/(?:node/)?mo/(.*)\.json$', path)
+        if not reg:
+            self.reply(400, {'totalCount': '0', 'imdata': []})
+            return
+        try:
+            tree = json.loads(body)
+        except ValueError:
+            self.reply(400, {'totalCount': '0', 'imdata': []})
+            return
+        parent_dn = '/'.join(split_dn(reg.group(1))[:-1])
+        self.apic.post_tree(tree, parent_dn, reg.group(1))
+        self.reply(200, {'totalCount': '0', 'imdata': []})
+
+
+if __name__ == '__main__':
+    mock = MockApic()
+    mock.port = 8000
+    print('Mock APIC listening on ' + mock.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()